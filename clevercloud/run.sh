@@ -10,6 +10,22 @@
 set -o errexit
 
 cd "$(dirname "$0")/../webapp"
+
+# Mode ASGI (ASGI_MODE=1) : workers uvicorn, une boucle asyncio par worker.
+# Les endpoints de l'API (/api/v1, asynchrones) délèguent DuckDB à un pool
+# borné (API_EXECUTOR_THREADS, cf. consommation/offload.py) : un appel lent
+# n'occupe plus un thread gunicorn, les pages restent servies. Le chat est
+# asynchrone lui aussi : une conversation qui attend Mistral ne coûte aucun
+# thread. Condition : une chaîne de middlewares entièrement asynchrone — d'où
+# WhiteNoise (synchrone) retiré de MIDDLEWARE en ASGI, les statiques étant
+# servis devant Django (consommation/static_asgi.py). Les vues synchrones (pages) passent par le thread unique d'asgiref —
+# d'où le mode WSGI par défaut tant que le site n'est pas passé en async.
+if [ "${ASGI_MODE:-0}" = "1" ]; then
+  exec gunicorn config.asgi:application --bind 0.0.0.0:9000 \
+    -k uvicorn_worker.UvicornWorker --workers 2 --timeout 60 \
+    --max-requests 800 --max-requests-jitter 80
+fi
+
 # 2 workers × 4 threads (gthread) : une requête lente (chat Mistral, export CSV)
 # ne bloque plus tout le site. 1 vCPU sur XS : plus de workers n'ajouterait pas
 # de débit. RAM bornée côté DuckDB (memory_limit dans services.py).
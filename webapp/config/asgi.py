@@ -12,5 +12,13 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Chaîne de middlewares entièrement asynchrone (sans WhiteNoiseMiddleware),
+# cf. settings.ASGI_MODE.
+os.environ.setdefault('ASGI_MODE', '1')
 
 application = get_asgi_application()
+
+# Statiques servis devant Django, hors chaîne de middlewares.
+from consommation.static_asgi import StaticFilesApp  # noqa: E402  (après django.setup)
+
+application = StaticFilesApp(application)
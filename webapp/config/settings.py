@@ -61,6 +61,39 @@ PARQUET_CACHE_CHECK_TTL = int(os.getenv('PARQUET_CACHE_CHECK_TTL', '600'))
 # (one-shot warm-up at startup only, refresh falls back to the TTL above).
 PARQUET_CACHE_REFRESH_INTERVAL = int(os.getenv('PARQUET_CACHE_REFRESH_INTERVAL', '600'))
 
+# Métriques Prometheus (cf. consommation/metrics.py). Chaque worker Gunicorn
+# publie ses compteurs dans METRICS_DIR ; /metrics agrège tous les workers.
+# METRICS_TOKEN vide = endpoint désactivé (404) : pas de scrape anonyme.
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/elecstat_metrics')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Intervalle max (secondes) entre deux écritures de l'instantané d'un worker.
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Journal DuckDB (cf. consommation/query_log.py). Requêtes au-delà du seuil
+# journalisées avec SQL, paramètres et nombre de lignes ; 0 = désactivé.
+DUCKDB_SLOW_QUERY_MS = int(os.getenv('DUCKDB_SLOW_QUERY_MS', '2000'))
+# Profilage DuckDB (plan JSON + timings par opérateur) de TOUTES les requêtes,
+# à n'activer que ponctuellement. Pour une seule fonction, préférer la
+# commande `python manage.py profile_query`.
+DUCKDB_PROFILE = os.getenv('DUCKDB_PROFILE', '') == '1'
+DUCKDB_PROFILE_LOG = os.getenv('DUCKDB_PROFILE_LOG', '/tmp/elecstat_duckdb_profile.log')
+# Échéance (secondes) du travail DuckDB d'une requête HTTP (cf.
+# consommation/deadlines.py) : au-delà, interrupt → 504 au lieu d'un worker
+# tué par le timeout Gunicorn (60 s). Chaque tool du chatbot a son propre
+# budget. 0 = désactivé.
+DUCKDB_QUERY_TIMEOUT = int(os.getenv('DUCKDB_QUERY_TIMEOUT', '25'))
+# Budget mémoire DuckDB par worker (Mo), cf. consommation/admission.py : chaque
+# connexion y réserve son memory_limit (256 Mo, 64 pour les petites lectures).
+# 384 = une requête lourde + deux légères par worker, soit < 800 Mo pour les
+# 2 workers sur l'instance de 1 Go. 0 = pas de contrôle d'admission.
+DUCKDB_MEMORY_BUDGET_MB = int(os.getenv('DUCKDB_MEMORY_BUDGET_MB', '384'))
+# Attente max (secondes) en file avant refus (503). Bornée aussi par l'échéance.
+DUCKDB_ADMISSION_TIMEOUT = int(os.getenv('DUCKDB_ADMISSION_TIMEOUT', '10'))
+# Threads par worker pour le travail DuckDB des endpoints API asynchrones
+# (cf. consommation/offload.py). Au-delà, les appels attendent leur tour ;
+# l'admission mémoire (ci-dessus) reste le vrai garde-fou.
+API_EXECUTOR_THREADS = int(os.getenv('API_EXECUTOR_THREADS', '4'))
+
 # OIDC Configuration (provider-agnostic via OpenID Connect discovery).
 # OIDC_ISSUER is the base URL of the IdP, e.g. https://<instance>.zitadel.cloud
 OIDC_ISSUER = os.getenv('OIDC_ISSUER', '')
@@ -78,6 +111,20 @@ ZITADEL_SERVICE_TOKEN = os.getenv('ZITADEL_SERVICE_TOKEN', '')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY', '')
 CHAT_MODEL = os.getenv('CHAT_MODEL', 'mistral-medium-latest')
 CHAT_MAX_TURNS = int(os.getenv('CHAT_MAX_TURNS', '30'))
+# Tools d'un même message exécutés en parallèle (threads par worker), cf.
+# consommation/chat.py. 1 = exécution séquentielle.
+CHAT_TOOL_THREADS = int(os.getenv('CHAT_TOOL_THREADS', '4'))
+# Cache des résultats de tools (Mo par worker, LRU), invalidé par les ETags
+# des Parquet lus. 0 = désactivé.
+CHAT_TOOL_CACHE_MB = int(os.getenv('CHAT_TOOL_CACHE_MB', '16'))
+# Taille visée (tokens estimés) d'un résultat de tool échantillonné : le
+# nombre de points représentatifs s'ajuste pour tenir dedans. 0 = sans borne.
+CHAT_TOOL_TOKEN_BUDGET = int(os.getenv('CHAT_TOOL_TOKEN_BUDGET', '1500'))
+# Conversations stockées côté serveur (consommation.models.Conversation) :
+# au-delà de ce budget (tokens estimés), les tours anciens sont résumés.
+# Purge des conversations inactives après CHAT_CONVERSATION_TTL secondes.
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '4000'))
+CHAT_CONVERSATION_TTL = int(os.getenv('CHAT_CONVERSATION_TTL', '86400'))
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -158,6 +205,12 @@ if not DEBUG:
 # utilisé : aucun impact.
 NINJA_NUM_PROXIES = int(os.getenv('NINJA_NUM_PROXIES', '1'))
 
+# Clés d'API (cf. consommation/api_auth.py) : durée (s) de cache d'une identité
+# vérifiée — la révocation, elle, est immédiate (compteur de génération).
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', '300'))
+# Intervalle (s) d'écriture groupée des last_used_at.
+API_KEY_LAST_USED_FLUSH = int(os.getenv('API_KEY_LAST_USED_FLUSH', '60'))
+
 
 # Application definition
 
@@ -180,8 +233,18 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'consommation.deadlines.DeadlineMiddleware',
 ]
 
+# Mode ASGI (uvicorn, cf. clevercloud/run.sh ; posé aussi par config/asgi.py) :
+# WhiteNoiseMiddleware est synchrone seulement et forcerait Django à passer
+# toute la chaîne par sync_to_async — un thread occupé par requête, même
+# asynchrone. Il est retiré ; les statiques sont servis devant Django
+# (consommation/static_asgi.py). Le reste de la chaîne est sync et async.
+ASGI_MODE = os.getenv('ASGI_MODE', '0') == '1'
+if ASGI_MODE:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -234,6 +297,12 @@ SESSION_COOKIE_AGE = 3600
 # 1 h d'inactivité réelle, pas 1 h après la connexion.
 SESSION_SAVE_EVERY_REQUEST = True
 
+# Cache de page des visiteurs anonymes (accueil + squelettes des pages
+# graphiques, cf. views.anonymous_page_cache) : max-age (secondes) annoncé au
+# proxy frontal / CDN via `Cache-Control: public`. 0 = désactivé (rendu
+# dynamique pour tous).
+PAGE_CACHE_MAX_AGE = int(os.getenv('PAGE_CACHE_MAX_AGE', '300'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -14,7 +14,7 @@ from django.shortcuts import redirect, render
 
 from .auth import get_user_from_session
 from .idp_admin import delete_idp_user, is_account_deletion_enabled
-from .models import ApiKey
+from .models import ApiKey, Conversation
 
 # Mot à recopier dans le formulaire pour confirmer (garde-fou anti-clic réflexe).
 CONFIRM_WORD = 'SUPPRIMER'
@@ -47,6 +47,7 @@ def delete_account(request: HttpRequest) -> HttpResponse:
     try:
         with transaction.atomic():
             ApiKey.anonymize_user(user['sub'])
+            Conversation.objects.filter(user_sub=user['sub']).delete()
             # Appel réseau dans la transaction : c'est lui qui rend le flow
             # tout-ou-rien (échec IdP ⇒ rollback de l'anonymisation locale).
             delete_idp_user(user['sub'])
@@ -0,0 +1,146 @@
+"""
+Contrôle d'admission des connexions DuckDB, par worker.
+
+Avec `--workers 2 --threads 4` et un memory_limit de 256 Mo par connexion,
+huit requêtes lourdes simultanées peuvent réclamer 2 Go sur une instance de
+1 Go : DuckDB spille sur disque, voire le worker est tué (OOM). On borne donc
+la mémoire DuckDB *engagée* par process : chaque connexion réserve son
+memory_limit (le « poids », en Mo) sur un budget DUCKDB_MEMORY_BUDGET_MB, et
+attend son tour si le budget est épuisé.
+
+La file d'attente est ordonnée par priorité puis par ordre d'arrivée : les
+reconstructions de graphiques (interactives, servies ensuite depuis le cache)
+passent devant les gros exports CSV. La file est stricte — une requête lourde
+en tête n'est pas doublée indéfiniment par des légères — et l'attente est
+bornée (DUCKDB_ADMISSION_TIMEOUT, et l'échéance de la requête HTTP, cf.
+deadlines.py) : au-delà, Overloaded → 503 avec Retry-After.
+
+Usage :
+    with admission.admit(weight_mb):      # fait par get_duckdb_connection
+        ...
+
+    @admission.priority(admission.BULK)   # sur une vue d'export
+    def export_xxx(request): ...
+"""
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import deadlines, metrics
+
+# Priorités (plus petit = servi en premier).
+INTERACTIVE = 0
+BULK = 10
+
+_PRIORITY_LABELS = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+WAIT_SECONDS = metrics.Histogram(
+    "elecstat_duckdb_admission_wait_seconds",
+    "Attente en file avant l'ouverture d'une connexion DuckDB.",
+    ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+REJECTED = metrics.Counter(
+    "elecstat_duckdb_admission_rejected_total",
+    "Connexions DuckDB refusées faute de budget mémoire dans le délai.",
+    ["priority"],
+)
+
+
+class Overloaded(Exception):
+    """Budget mémoire DuckDB indisponible dans le délai imparti."""
+
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "duckdb_priority", default=INTERACTIVE
+)
+# Poids déjà réservé par le contexte courant : une connexion ouverte pendant
+# qu'une autre est tenue (fallback d'une fonction de service) ne doit pas
+# attendre un budget qu'elle bloque elle-même.
+_held: contextvars.ContextVar[int] = contextvars.ContextVar("duckdb_held", default=0)
+
+
+@contextmanager
+def priority(level: int):
+    """Priorité d'admission des connexions du bloc (utilisable en décorateur)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Controller:
+    """Sémaphore pondéré avec file de priorité (un par process)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._queue: list[tuple[int, int]] = []  # (priorité, n° d'arrivée)
+        self._seq = itertools.count()
+
+    def _budget(self) -> int:
+        return getattr(settings, "DUCKDB_MEMORY_BUDGET_MB", 0)
+
+    def acquire(self, weight: int, level: int, timeout: float) -> bool:
+        budget = self._budget()
+        weight = min(weight, budget)  # une connexion seule passe toujours
+        entry = (level, next(self._seq))
+        end = time.monotonic() + timeout
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while self._queue[0] != entry or self._in_use + weight > budget:
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        return False
+                    self._cond.wait(left)
+                self._in_use += weight
+                return True
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                # La nouvelle tête peut éventuellement passer.
+                self._cond.notify_all()
+
+    def release(self, weight: int) -> None:
+        with self._cond:
+            self._in_use -= min(weight, self._budget())
+            self._cond.notify_all()
+
+
+_controller = _Controller()
+
+
+@contextmanager
+def admit(weight: int):
+    """Réserve `weight` Mo du budget DuckDB du process pendant le bloc."""
+    if not getattr(settings, "DUCKDB_MEMORY_BUDGET_MB", 0) or _held.get():
+        yield
+        return
+
+    level = _priority.get()
+    label = _PRIORITY_LABELS.get(level, str(level))
+    timeout = getattr(settings, "DUCKDB_ADMISSION_TIMEOUT", 10)
+    left = deadlines.remaining()
+    if left is not None:
+        timeout = min(timeout, max(left, 0))
+
+    start = time.monotonic()
+    admitted = _controller.acquire(weight, level, timeout)
+    WAIT_SECONDS.observe(time.monotonic() - start, priority=label)
+    if not admitted:
+        REJECTED.inc(priority=label)
+        raise Overloaded("budget mémoire DuckDB saturé")
+
+    token = _held.set(weight)
+    try:
+        yield
+    finally:
+        _held.reset(token)
+        _controller.release(weight)
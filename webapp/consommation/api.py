@@ -9,20 +9,41 @@ Accès protégé par clé d'API (en-tête `Authorization: Bearer <clé>`, cf.
 `api_auth.py`) et limité en débit par clé (throttling). Données publiques mais
 accès tracé/révocable.
 
+Endpoints asynchrones : validation et sérialisation dans la boucle, travail
+DuckDB/pandas délégué à un pool de threads borné (cf. `offload.py`). Servis
+par un worker ASGI, les appels lents ne monopolisent plus un thread de
+worker ; en WSGI (mode par défaut), Django les exécute comme des vues
+synchrones.
+
 Documentation interactive (Swagger) : /api/v1/docs
 """
+import hashlib
+import inspect
+import json
 import os
+import threading
 from datetime import date, datetime
-from typing import Optional
+from functools import wraps
+from typing import Literal, Optional
 
 import pandas as pd
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from ninja import NinjaAPI, Schema
 from ninja.errors import HttpError
 from ninja.throttling import AuthRateThrottle
 
-from . import services
+from . import admission, data_cache, deadlines, metrics, offload, services
 from .api_auth import get_api_auth
 
+# Encodeur JSON rapide, optionnel : sérialise directement les tableaux NumPy
+# (float NaN → null, datetime64 → ISO 8601). Repli sur json (stdlib) sinon.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépend de l'environnement
+    orjson = None
+
 
 # ========== Rate limiting (throttling) ==========
 # Les endpoints sont coûteux (lecture Parquet + DuckDB à chaque appel) :
@@ -30,24 +51,97 @@ from .api_auth import get_api_auth
 # `AuthRateThrottle` compte PAR CLÉ d'API (str(request.auth)) : la requête est
 # toujours authentifiée puisqu'une clé valide est requise. Deux fenêtres :
 #   - "burst"     : coupe les boucles serrées (rafale courte)
-#   - "sustained" : plafonne le volume total sur la durée
+#   - "sustained" : plafonne le volume total sur la durée — seau à jetons
+#                   pondéré par le coût estimé de chaque appel (cf.
+#                   _request_cost) : un agrégat mensuel coûte une fraction
+#                   d'unité, une année de courbe brute plusieurs unités.
 # Les seuils sont ajustables sans redéploiement via variables d'environnement.
 # NB : le compteur vit dans le cache Django (LocMemCache par défaut, donc par
 # process) — la limite effective est multipliée par le nombre de workers
 # Gunicorn. Pour un comptage exact en multi-worker, brancher un cache partagé
 # (Redis) ; ce throttling « approximatif » protège déjà l'essentiel.
-class BurstRateThrottle(AuthRateThrottle):
+THROTTLED = metrics.Counter(
+    "elecstat_api_throttled_total",
+    "Requêtes API refusées (429) par fenêtre de throttling.",
+    ["scope"],
+)
+
+
+class _CountingThrottleMixin:
+    """Compte les refus (métrique Prometheus) sans changer la décision."""
+
+    def allow_request(self, request):
+        allowed = super().allow_request(request)
+        if not allowed:
+            THROTTLED.inc(scope=self.scope)
+        return allowed
+
+
+class BurstRateThrottle(_CountingThrottleMixin, AuthRateThrottle):
     scope = "burst"
 
 
-class SustainedRateThrottle(AuthRateThrottle):
+class CostRateThrottle(AuthRateThrottle):
+    """Seau à jetons dont chaque requête consomme son coût estimé.
+
+    Le taux se lit en unités de coût : "5/min" = un seau de 5 unités, rempli
+    de 5 unités par minute. Une requête passe si le seau contient son coût
+    (plafonné à la capacité, sinon un appel très lourd ne passerait jamais),
+    puis le débite — éventuellement en négatif : le client attend alors que
+    le seau se reremplisse, à proportion de ce qu'il a consommé.
+    """
+
+    def cost(self, request) -> float:
+        return 1.0
+
+    def allow_request(self, request):
+        self.key = self.get_cache_key(request)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        capacity = float(self.num_requests)
+        self.refill = capacity / self.duration
+        tokens, last = self.cache.get(self.key, (capacity, self.now))
+        self.tokens = min(capacity, tokens + (self.now - last) * self.refill)
+        request_cost = self.cost(request)
+        self.needed = min(request_cost, capacity)
+        if self.tokens < self.needed:
+            return False
+        self.tokens -= request_cost
+        # Conservé jusqu'à ce que le seau soit de nouveau plein.
+        ttl = (capacity - self.tokens) / self.refill
+        self.cache.set(self.key, (self.tokens, self.now), int(ttl) + 1)
+        return True
+
+    def wait(self):
+        return max(self.needed - self.tokens, 0) / self.refill
+
+
+class SustainedRateThrottle(_CountingThrottleMixin, CostRateThrottle):
     scope = "sustained"
 
+    def cost(self, request) -> float:
+        return _request_cost(request)
+
+    def allow_request(self, request):
+        # Une revalidation qui aboutira à un 304 ne coûte rien (ni DuckDB ni
+        # sérialisation) : elle n'entame pas le quota soutenu. La rafale, elle,
+        # continue de couper les boucles serrées.
+        if _not_modified(request):
+            return True
+        return super().allow_request(request)
+
 
 # Seuils de débit (par clé), exposés comme constantes pour que la page /api/
 # puisse afficher les limites réelles sans dupliquer les valeurs par défaut.
 THROTTLE_BURST = os.getenv("API_THROTTLE_BURST", "1/2s")
 THROTTLE_SUSTAINED = os.getenv("API_THROTTLE_SUSTAINED", "5/min")
+# Unité de coût du quota soutenu : ~ROWS_PER_UNIT points renvoyés. Les lignes
+# lues par DuckDB pèsent SCAN_WEIGHT fois moins (un scan Parquet est ~100×
+# plus rapide que la sérialisation JSON d'autant de lignes).
+ROWS_PER_UNIT = int(os.getenv("API_THROTTLE_ROWS_PER_UNIT", "10000"))
+SCAN_WEIGHT = 0.01
+MIN_COST = 0.2
 
 api = NinjaAPI(
     title="ElecStat API",
@@ -72,10 +166,138 @@ api = NinjaAPI(
 # redéploiement via `API_MAX_RANGE_DAYS`. Les endpoints « énergie » ne renvoient
 # qu'une ligne par mois → cap bien plus large.
 MAX_RANGE_DAYS = int(os.getenv("API_MAX_RANGE_DAYS", "366"))
+# Formats streamés (ndjson/csv) : envoyés par lots au fil de la lecture DuckDB,
+# le pic RAM ne dépend plus de la plage → cap relevé (5 ans par défaut).
+MAX_RANGE_DAYS_STREAM = int(os.getenv("API_MAX_RANGE_DAYS_STREAM", str(366 * 5)))
+# Pagination par curseur (keyset sur date_heure) : taille de page bornée, donc
+# mémoire constante par appel — la plage totale n'est alors plus plafonnée.
+PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "10000"))
+PAGE_SIZE_MIN = 100
 MAX_RANGE_DAYS_ENERGIE = 366 * 10
 
 
+# Échéance DuckDB dépassée / client parti (cf. deadlines.py) : réponse JSON
+# au format Ninja plutôt que la page texte du middleware.
+@api.exception_handler(deadlines.QueryTimeout)
+def _query_timeout(request, exc):
+    return api.create_response(
+        request,
+        {"detail": "Calcul trop long : réduisez la plage demandée."},
+        status=504,
+    )
+
+
+@api.exception_handler(deadlines.ClientDisconnected)
+def _client_disconnected(request, exc):
+    return api.create_response(request, {"detail": "Requête annulée."}, status=503)
+
+
+@api.exception_handler(admission.Overloaded)
+def _overloaded(request, exc):
+    response = api.create_response(
+        request,
+        {"detail": "Service momentanément saturé, réessayez dans quelques secondes."},
+        status=503,
+    )
+    response["Retry-After"] = "5"
+    return response
+
+
 # ========== Helpers ==========
+def _etag(request) -> tuple[str, str]:
+    """(ETag, version des données) de la requête, mémorisés sur la requête.
+
+    L'ETag couvre le chemin, les paramètres (triés) et la version des
+    Parquet sources (cf. data_cache.data_version) : une même requête garde le
+    même ETag tant que les données ne changent pas.
+    """
+    cached = getattr(request, "_api_etag", None)
+    if cached is None:
+        version = data_cache.data_version()
+        params = "&".join(f"{k}={v}" for k, values in sorted(request.GET.lists()) for v in values)
+        raw = f"{request.path}?{params}|{version}"
+        cached = (quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32]), version)
+        request._api_etag = cached
+    return cached
+
+
+def _not_modified(request) -> bool:
+    """If-None-Match correspond à l'ETag courant (réponse 304 possible)."""
+    header = request.headers.get("If-None-Match")
+    if request.method not in ("GET", "HEAD") or not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or _etag(request)[0] in etags
+
+
+def conditional(view):
+    """GET conditionnel : ETag et X-Data-Version sur chaque réponse, 304 sans
+    exécuter la vue (donc sans DuckDB) si If-None-Match correspond.
+
+    À placer sous `@api.get`, sur une vue asynchrone : la vue reçoit en plus
+    la réponse temporaire de Ninja (paramètre annoté HttpResponse) pour y
+    poser les en-têtes quand elle renvoie des données à sérialiser.
+    """
+    sig = inspect.signature(view)
+    extra = inspect.Parameter("http_response", inspect.Parameter.KEYWORD_ONLY,
+                              annotation=HttpResponse)
+
+    @wraps(view)
+    async def wrapper(request, *args, http_response, **kwargs):
+        etag, version = _etag(request)
+        if _not_modified(request):
+            response = HttpResponse(status=304)
+        else:
+            response = await view(request, *args, **kwargs)
+            if not isinstance(response, HttpResponse | StreamingHttpResponse):
+                http_response["ETag"] = etag
+                http_response["X-Data-Version"] = version
+                return response
+        response["ETag"] = etag
+        response["X-Data-Version"] = version
+        return response
+
+    wrapper.__signature__ = sig.replace(parameters=[*sig.parameters.values(), extra])
+    return wrapper
+
+
+def _request_cost(request) -> float:
+    """Coût estimé (unités de quota) d'un appel, avant tout accès aux données.
+
+    Points renvoyés + points lus (pondérés par SCAN_WEIGHT), d'après
+    l'endpoint, la plage, le pas, la pagination et le nombre de séries ;
+    au moins MIN_COST. Paramètres invalides : coût minimal (rejet 400 sans
+    calcul).
+    """
+    endpoint = request.path.rstrip("/").rsplit("/", 1)[-1]
+    params = request.GET
+    try:
+        days = (_parse_date(params["fin"], "fin") - _parse_date(params["debut"], "debut")).days + 1
+    except (KeyError, HttpError):
+        days = 0
+    scanned = max(days, 0) * 96  # pas de 15 min
+    if endpoint in ("courbe_conso", "courbe_prod", "echange", "series"):
+        pas = params.get("pas")
+        returned = scanned
+        if pas in services.RESAMPLE_STEPS:
+            returned = scanned // (services.RESAMPLE_STEPS[pas][1] // 15)
+        elif "limite" in params or "curseur" in params:
+            limite = params.get("limite", "")
+            returned = scanned = min(scanned, int(limite) if limite.isdigit() else PAGE_SIZE)
+        if endpoint == "series":
+            try:
+                consommation, filieres, pays_list = _parse_series(params.get("series", ""))
+            except HttpError:
+                consommation, filieres, pays_list = False, [], []
+            n = max(int(consommation) + len(filieres) + len(pays_list), 1)
+            returned, scanned = returned * n, scanned * n
+    elif endpoint.startswith("energie_"):
+        returned = days // 30 + 1
+    else:  # meta (précalculé), parc (quelques centaines de lignes)
+        returned = scanned = 0
+    return max(MIN_COST, (returned + scanned * SCAN_WEIGHT) / ROWS_PER_UNIT)
+
+
 def _parse_date(value: str, name: str) -> date:
     try:
         return datetime.strptime(value, "%Y-%m-%d").date()
@@ -83,18 +305,101 @@ def _parse_date(value: str, name: str) -> date:
         raise HttpError(400, f"{name} doit être au format AAAA-MM-JJ")
 
 
-def _validate_range(start: date, end: date, max_days: int = MAX_RANGE_DAYS) -> None:
+def _validate_range(start: date, end: date, max_days: Optional[int] = MAX_RANGE_DAYS) -> None:
+    """`max_days=None` : pas de plafond (pagination)."""
     if start > end:
         raise HttpError(400, "debut doit être antérieure ou égale à fin")
-    if (end - start).days > max_days:
+    if max_days is not None and (end - start).days > max_days:
         raise HttpError(400, f"La plage demandée ne peut excéder {max_days} jours")
 
 
+def _parse_cursor(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+    except (ValueError, TypeError):
+        raise HttpError(400, "curseur invalide (attendu : next_cursor d'une page précédente)")
+
+
 def _records(df: pd.DataFrame) -> list[dict]:
     """DataFrame → liste de dicts JSON-safe (NaN/NaT → null)."""
     return df.where(pd.notnull(df), None).to_dict(orient="records")
 
 
+def _columns_response(meta: dict, df: pd.DataFrame) -> HttpResponse:
+    """Réponse `format=columns` : `{..meta, "data": {colonne: [valeurs]}}`.
+
+    Sérialisée directement depuis les tableaux NumPy, sans passer par une
+    liste de dicts ni par la validation Ninja ligne à ligne. Sur une année au
+    pas 15 min : ~100× plus rapide et ~2× plus léger que le format lignes
+    (cf. `manage.py bench_api_format`).
+    """
+    if orjson is not None:
+        data = {}
+        for name in df.columns:
+            col = df[name]
+            if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_datetime64_any_dtype(col):
+                data[name] = col.to_numpy()
+            else:  # chaînes (source) : pas de tableau NumPy natif
+                data[name] = col.astype(object).where(col.notnull(), None).tolist()
+        body = orjson.dumps(
+            {**meta, "format": "columns", "data": data},
+            option=orjson.OPT_SERIALIZE_NUMPY,
+            default=str,
+        )
+    else:
+        data = {}
+        for name in df.columns:
+            col = df[name]
+            if pd.api.types.is_datetime64_any_dtype(col):
+                col = col.dt.strftime("%Y-%m-%dT%H:%M:%S")
+            data[name] = col.astype(object).where(col.notnull(), None).tolist()
+        body = json.dumps({**meta, "format": "columns", "data": data}, default=str)
+    return HttpResponse(body, content_type="application/json")
+
+
+def _stream_response(chunks, format: str, filename: str,
+                     asgi: bool = False) -> StreamingHttpResponse:
+    """Réponse streamée `format=ndjson|csv` depuis des lots de DataFrame.
+
+    Un objet JSON par ligne (NDJSON) ou un CSV avec en-tête ; chaque lot est
+    sérialisé puis relâché avant la lecture du suivant. Les erreurs de
+    paramètres sont levées avant (cf. services.stream_courbe) : une fois
+    l'envoi commencé, le statut est forcément 200.
+
+    `asgi` : itérateur asynchrone, chaque lot lu dans le pool (cf.
+    offload.iterate). Django consommerait sinon tout l'itérateur synchrone
+    en mémoire avant l'envoi — et inversement en WSGI : le type d'itérateur
+    suit donc le serveur.
+    """
+    def lines():
+        header = True
+        for df in chunks:
+            if format == "csv":
+                yield df.to_csv(index=False, header=header, date_format="%Y-%m-%dT%H:%M:%S")
+                header = False
+            elif len(df):
+                df["date_heure"] = df["date_heure"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+                yield df.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n"
+
+    content = offload.iterate(lines()) if asgi else lines()
+    if format == "csv":
+        response = StreamingHttpResponse(content, content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+    else:
+        response = StreamingHttpResponse(content, content_type="application/x-ndjson")
+    return response
+
+
+def _max_days(format: str, pas: Optional[str] = None) -> int:
+    """Plage max (jours) : relevée en streaming, et proportionnellement au pas
+    (même nombre de points qu'au pas de 15 min : au pas journalier, tout
+    l'historique passe)."""
+    days = MAX_RANGE_DAYS_STREAM if format in ("ndjson", "csv") else MAX_RANGE_DAYS
+    if pas is not None:
+        days *= services.RESAMPLE_STEPS[pas][1] // 15
+    return days
+
+
 def _gwh(value) -> Optional[float]:
     """MWh → GWh, arrondi à 1 décimale, None-safe."""
     if value is None or pd.isna(value):
@@ -112,6 +417,8 @@ def _energie_mois(df: pd.DataFrame) -> list[dict]:
 class DateRange(Schema):
     min: date
     max: date
+    lignes: Optional[int] = None
+    mis_a_jour: Optional[datetime] = None
 
 
 class MetaOut(Schema):
@@ -134,6 +441,9 @@ class CourbeConsoOut(Schema):
     debut: date
     fin: date
     unite: str = "MW"
+    pas: Optional[str] = None
+    agg: Optional[str] = None
+    next_cursor: Optional[str] = None
     data: list[CourbeConsoRow]
 
 
@@ -149,9 +459,15 @@ class CourbeProdOut(Schema):
     fin: date
     filiere: str
     unite: str = "MW"
+    pas: Optional[str] = None
+    agg: Optional[str] = None
+    next_cursor: Optional[str] = None
     data: list[CourbeProdRow]
 
 
+NOTE_ECHANGE = "Signe positif = import vers la France, négatif = export."
+
+
 class EchangeRow(Schema):
     date_heure: datetime
     echange: Optional[float] = None
@@ -164,7 +480,10 @@ class EchangeOut(Schema):
     fin: date
     pays: str
     unite: str = "MW"
-    note: str = "Signe positif = import vers la France, négatif = export."
+    pas: Optional[str] = None
+    agg: Optional[str] = None
+    next_cursor: Optional[str] = None
+    note: str = NOTE_ECHANGE
     data: list[EchangeRow]
 
 
@@ -217,91 +536,269 @@ class ParcOut(Schema):
     data: list[ParcRow]
 
 
+# --- Multi-séries alignées (un seul appel pour plusieurs courbes) ---
+class SeriesOut(Schema):
+    count: int
+    debut: date
+    fin: date
+    unite: str = "MW"
+    series: list[str]
+    date_heure: list[datetime]
+    valeurs: dict[str, list[Optional[float]]]
+
+
 # ========== Endpoints ==========
-@api.get("/meta", response=MetaOut, tags=["meta"], summary="Métadonnées")
-def meta(request):
-    """Plages de dates disponibles et listes de référence (filières, pays).
+# /meta est le premier appel de tout client : la réponse (trois scans de
+# plages de dates + comptages) est précalculée et sérialisée une fois par
+# version des données, puis servie telle quelle. Reconstruite à la fin de
+# chaque cycle de rafraîchissement du cache Parquet (thread de fond), sinon
+# paresseusement au premier appel qui voit une nouvelle version.
+_META_DATASETS = (
+    ("consommation", "puissance", services.get_date_range),
+    ("production", "production", services.get_production_date_range),
+    ("echanges", "echanges", services.get_echanges_date_range),
+)
+_meta_snapshot: tuple[str, bytes] | None = None  # (version des données, JSON)
+_meta_lock = threading.Lock()
 
-    La liste `pays` inclut la clé `total` (somme des frontières commerciales),
-    acceptée par `echange` et `energie_echange`.
-    """
-    c_min, c_max = services.get_date_range()
-    p_min, p_max = services.get_production_date_range()
-    e_min, e_max = services.get_echanges_date_range()
-    return {
-        "consommation": {"min": c_min, "max": c_max},
-        "production": {"min": p_min, "max": p_max},
-        "echanges": {"min": e_min, "max": e_max},
+
+def _build_meta() -> bytes:
+    payload = {
         "filieres": services.get_production_filieres(),
         "pays": {"total": "Total (somme des frontières commerciales)",
                  **services.get_echanges_pays()},
     }
+    for name, key, date_range in _META_DATASETS:
+        start, end = date_range()
+        rows, updated_at = services.get_dataset_stats(key)
+        payload[name] = {
+            "min": start, "max": end, "lignes": rows,
+            "mis_a_jour": updated_at and datetime.fromtimestamp(updated_at),
+        }
+    return MetaOut.model_validate(payload).model_dump_json().encode()
+
+
+def _meta_json(version: str) -> bytes:
+    """JSON de /meta pour `version`, recalculé seulement si elle a changé."""
+    global _meta_snapshot
+    snapshot = _meta_snapshot
+    if snapshot is None or snapshot[0] != version:
+        with _meta_lock:
+            if _meta_snapshot is None or _meta_snapshot[0] != version:
+                _meta_snapshot = (version, _build_meta())
+            snapshot = _meta_snapshot
+    return snapshot[1]
+
+
+def refresh_meta() -> None:
+    """Listener data_cache : précalcule /meta pour la nouvelle version."""
+    _meta_json(data_cache.data_version())
+
+
+data_cache.add_refresh_listener(refresh_meta)
+
+
+@api.get("/meta", response=MetaOut, tags=["meta"], summary="Métadonnées")
+@conditional
+async def meta(request):
+    """Plages de dates disponibles et listes de référence (filières, pays).
+
+    Pour chaque jeu de données : plage de dates, nombre de lignes et date de
+    dernière mise à jour. La liste `pays` inclut la clé `total` (somme des
+    frontières commerciales), acceptée par `echange` et `energie_echange`.
+    """
+    body = await offload.run(_meta_json, _etag(request)[1])
+    return HttpResponse(body, content_type="application/json")
 
 
 # ---------- Courbes (puissance, MW) ----------
+# `rows` (défaut) : liste d'objets validés par le schéma ; `columns` : une liste
+# par colonne, sérialisée sans validation ligne à ligne (gros volumes) ;
+# `ndjson` / `csv` : streamés par lots, plage jusqu'à MAX_RANGE_DAYS_STREAM.
+FormatCourbe = Literal["rows", "columns", "ndjson", "csv"]
+# Ré-échantillonnage côté serveur (DuckDB time_bucket), cf.
+# services.get_courbe_resampled : `pas` absent = points bruts (15/30 min).
+PasCourbe = Literal["15min", "30min", "1h", "1j", "1sem"]
+AggCourbe = Literal["mean", "min", "max", "energie"]
+
+
+def _courbe_response(kind: str, key: Optional[str], s: date, e: date, meta: dict,
+                     format: str, pas: Optional[str], agg: str, load,
+                     curseur: Optional[str] = None, limite: Optional[int] = None,
+                     asgi: bool = False):
+    """Réponse commune des courbes : brute (`load()`), ré-échantillonnée ou
+    paginée.
+
+    `meta` porte les champs propres à l'endpoint (filiere, pays, note) ; la
+    plage est validée ici, bornée selon le format et le pas (cf. _max_days),
+    sans plafond en pagination. Bloquante : appelée via offload.run.
+    """
+    paginate = curseur is not None or limite is not None
+    if paginate and (pas is not None or format in ("ndjson", "csv")):
+        raise HttpError(400, "curseur/limite : formats rows ou columns, sans pas")
+    if limite is not None and not PAGE_SIZE_MIN <= limite <= PAGE_SIZE:
+        raise HttpError(400, f"limite doit être comprise entre {PAGE_SIZE_MIN} et {PAGE_SIZE}")
+    _validate_range(s, e, None if paginate else _max_days(format, pas))
+    if pas is None and agg != "mean":
+        raise HttpError(400, "agg nécessite un pas de ré-échantillonnage (paramètre pas)")
+    filename = "_".join([kind] + ([key] if key else []) + ([pas] if pas else []) + [str(s), str(e)])
+    try:
+        if paginate:
+            after = _parse_cursor(curseur) if curseur is not None else None
+            df, next_cursor = services.get_courbe_page(kind, s, e, key, after, limite or PAGE_SIZE)
+            meta = {**meta, "next_cursor": next_cursor and next_cursor.strftime("%Y-%m-%dT%H:%M:%S")}
+        elif pas is not None:
+            df = services.get_courbe_resampled(kind, s, e, key, pas, agg)
+            meta = {**meta, "unite": "MWh" if agg == "energie" else "MW", "pas": pas, "agg": agg}
+            if format in ("ndjson", "csv"):
+                return _stream_response([df], format, filename, asgi)
+        elif format in ("ndjson", "csv"):
+            return _stream_response(services.stream_courbe(kind, s, e, key),
+                                    format, filename, asgi)
+        else:
+            df = load()
+    except ValueError as ex:
+        raise HttpError(400, str(ex))
+    meta = {"count": len(df), "debut": s, "fin": e, "unite": "MW", **meta}
+    if format == "columns":
+        return _columns_response(meta, df)
+    return {**meta, "data": _records(df)}
+
+
 @api.get("/courbe_conso", response=CourbeConsoOut, tags=["courbes"],
          summary="Courbe de consommation (puissance)")
-def courbe_conso(request, debut: str, fin: str):
-    """Courbe de consommation (MW) sur une plage de dates."""
+@conditional
+async def courbe_conso(request, debut: str, fin: str, format: FormatCourbe = "rows",
+                 pas: Optional[PasCourbe] = None, agg: AggCourbe = "mean",
+                 curseur: Optional[str] = None, limite: Optional[int] = None):
+    """Courbe de consommation (MW) sur une plage de dates.
+    `format=columns` : données en colonnes (`{"date_heure": [...], ...}`) ;
+    `format=ndjson|csv` : une ligne par point, streamée (plage étendue).
+    `pas` (`15min`…`1sem`) : ré-échantillonnage côté serveur, agrégé selon
+    `agg` (`mean`, `min`, `max`, ou `energie` en MWh) — plage étendue d'autant.
+    `limite` / `curseur` : pagination (pages de `limite` points, plage libre) ;
+    passer le `next_cursor` reçu en `curseur` jusqu'à obtenir `null`."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
-    _validate_range(s, e)
-    df = services.get_puissance_data(s, e)
-    return {"count": len(df), "debut": s, "fin": e, "data": _records(df)}
+    return await offload.run(
+        _courbe_response, "consommation", None, s, e, {}, format, pas, agg,
+        lambda: services.get_puissance_data(s, e), curseur, limite,
+        asgi=isinstance(request, ASGIRequest))
 
 
 @api.get("/courbe_prod", response=CourbeProdOut, tags=["courbes"],
          summary="Courbe de production par filière")
-def courbe_prod(request, debut: str, fin: str, filiere: str = "nucleaire"):
-    """Courbe de production (MW) d'une filière. Filières : voir `/meta`."""
+@conditional
+async def courbe_prod(request, debut: str, fin: str, filiere: str = "nucleaire",
+                      format: FormatCourbe = "rows",
+                      pas: Optional[PasCourbe] = None, agg: AggCourbe = "mean",
+                      curseur: Optional[str] = None, limite: Optional[int] = None):
+    """Courbe de production (MW) d'une filière. Filières : voir `/meta`.
+    `format=columns` : données en colonnes ; `format=ndjson|csv` : streamée ;
+    `pas` / `agg` : ré-échantillonnage, `limite` / `curseur` : pagination (cf.
+    `/courbe_conso`)."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
-    _validate_range(s, e)
-    try:
-        df = services.get_production_data(s, e, filiere)
-    except ValueError as ex:
-        raise HttpError(400, str(ex))
-    return {"count": len(df), "debut": s, "fin": e, "filiere": filiere,
-            "data": _records(df)}
+    return await offload.run(
+        _courbe_response, "production", filiere, s, e, {"filiere": filiere},
+        format, pas, agg, lambda: services.get_production_data(s, e, filiere),
+        curseur, limite, asgi=isinstance(request, ASGIRequest))
 
 
 @api.get("/echange", response=EchangeOut, tags=["courbes"],
          summary="Courbe d'échanges transfrontaliers")
-def echange(request, debut: str, fin: str, pays: str = "total"):
+@conditional
+async def echange(request, debut: str, fin: str, pays: str = "total",
+                  format: FormatCourbe = "rows",
+                  pas: Optional[PasCourbe] = None, agg: AggCourbe = "mean",
+                  curseur: Optional[str] = None, limite: Optional[int] = None):
     """Courbe de flux d'échange (MW). `pays` : `total`, `ech_physiques` ou une
-    frontière commerciale (voir `/meta`)."""
+    frontière commerciale (voir `/meta`). `format=columns` : données en colonnes ;
+    `format=ndjson|csv` : streamée ; `pas` / `agg` : ré-échantillonnage,
+    `limite` / `curseur` : pagination (cf. `/courbe_conso`)."""
+    s = _parse_date(debut, "debut")
+    e = _parse_date(fin, "fin")
+    return await offload.run(
+        _courbe_response, "echange", pays, s, e, {"pays": pays, "note": NOTE_ECHANGE},
+        format, pas, agg, lambda: services.get_echanges_data(s, e, pays),
+        curseur, limite, asgi=isinstance(request, ASGIRequest))
+
+
+def _parse_series(spec: str) -> tuple[bool, list[str], list[str]]:
+    """`consommation,production:nucleaire,echange:total` → (conso, filières, pays).
+
+    `production:*` = toutes les filières, `echange:*` = toutes les frontières
+    commerciales. Doublons ignorés, ordre conservé.
+    """
+    consommation, filieres, pays_list = False, [], []
+    for item in (x.strip() for x in spec.split(",")):
+        if not item:
+            continue
+        kind, _, name = item.partition(":")
+        if kind == "consommation" and not name:
+            consommation = True
+        elif kind == "production" and name:
+            names = list(services.get_production_filieres()) if name == "*" else [name]
+            filieres += [n for n in names if n not in filieres]
+        elif kind == "echange" and name:
+            names = list(services.get_echanges_pays_commerciaux()) if name == "*" else [name]
+            pays_list += [n for n in names if n not in pays_list]
+        else:
+            raise HttpError(400, f"Série inconnue : {item!r} (attendu : consommation, "
+                                 "production:<filière>, echange:<pays>)")
+    return consommation, filieres, pays_list
+
+
+@api.get("/series", response=SeriesOut, tags=["courbes"],
+         summary="Plusieurs courbes alignées en un appel")
+@conditional
+async def series(request, debut: str, fin: str, series: str):
+    """Plusieurs courbes de puissance (MW) sur la même plage, alignées sur un
+    axe `date_heure` commun (valeur `null` si une série n'a pas de point à cet
+    instant). `series` : liste séparée par des virgules de `consommation`,
+    `production:<filière>` et `echange:<pays>` (`*` = toutes ; filières et
+    pays : voir `/meta`). Un seul appel compte pour le débit, et chaque fichier
+    source n'est lu qu'une fois."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
     _validate_range(s, e)
+    consommation, filieres, pays_list = await offload.run(_parse_series, series)
     try:
-        df = services.get_echanges_data(s, e, pays)
+        df = await offload.run(services.get_series_multi, s, e, consommation, filieres, pays_list)
     except ValueError as ex:
         raise HttpError(400, str(ex))
-    return {"count": len(df), "debut": s, "fin": e, "pays": pays,
-            "data": _records(df)}
+    names = [c for c in df.columns if c != "date_heure"]
+    values = df[names].astype(object).where(df[names].notnull(), None)
+    return {
+        "count": len(df), "debut": s, "fin": e, "series": names,
+        "date_heure": df["date_heure"].tolist(),
+        "valeurs": {name: values[name].tolist() for name in names},
+    }
 
 
 # ---------- Énergie (GWh, par mois) ----------
 @api.get("/energie_conso", response=EnergieConsoOut, tags=["énergie"],
          summary="Énergie consommée par mois")
-def energie_conso(request, debut: str, fin: str):
+@conditional
+async def energie_conso(request, debut: str, fin: str):
     """Énergie consommée (GWh), un total par mois sur la plage."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
     _validate_range(s, e, MAX_RANGE_DAYS_ENERGIE)
-    df = services.get_consommation_energie_mensuelle(s, e)
+    df = await offload.run(services.get_consommation_energie_mensuelle, s, e)
     return {"debut": s, "fin": e, "data": _energie_mois(df)}
 
 
 @api.get("/energie_prod", response=EnergieProdOut, tags=["énergie"],
          summary="Énergie produite par mois")
-def energie_prod(request, debut: str, fin: str, filiere: str = "nucleaire"):
+@conditional
+async def energie_prod(request, debut: str, fin: str, filiere: str = "nucleaire"):
     """Énergie produite (GWh) d'une filière, un total par mois. Filières : `/meta`."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
     _validate_range(s, e, MAX_RANGE_DAYS_ENERGIE)
     try:
-        df = services.get_production_energie_mensuelle(s, e, filiere)
+        df = await offload.run(services.get_production_energie_mensuelle, s, e, filiere)
     except ValueError as ex:
         raise HttpError(400, str(ex))
     return {"debut": s, "fin": e, "filiere": filiere, "data": _energie_mois(df)}
@@ -309,14 +806,15 @@ def energie_prod(request, debut: str, fin: str, filiere: str = "nucleaire"):
 
 @api.get("/energie_echange", response=EnergieEchangeOut, tags=["énergie"],
          summary="Énergie échangée (import/export) par mois")
-def energie_echange(request, debut: str, fin: str, pays: str = "total"):
+@conditional
+async def energie_echange(request, debut: str, fin: str, pays: str = "total"):
     """Énergie importée/exportée (GWh) par mois. `pays` : `total` ou une
     frontière commerciale (voir `/meta`)."""
     s = _parse_date(debut, "debut")
     e = _parse_date(fin, "fin")
     _validate_range(s, e, MAX_RANGE_DAYS_ENERGIE)
     try:
-        df = services.get_echanges_energie_mensuelle(s, e, pays)
+        df = await offload.run(services.get_echanges_energie_mensuelle, s, e, pays)
     except ValueError as ex:
         raise HttpError(400, str(ex))
     data = [{"mois": r["mois"],
@@ -329,7 +827,8 @@ def energie_echange(request, debut: str, fin: str, pays: str = "total"):
 # ---------- Parc ----------
 @api.get("/parc", response=ParcOut, tags=["parc"],
          summary="Parc installé (éolien/solaire)")
-def parc(request):
+@conditional
+async def parc(request):
     """Parc installé mensuel (MW) pour l'éolien (terrestre/mer) et le solaire."""
-    df = services.get_parc_installe_data()
+    df = await offload.run(services.get_parc_installe_data)
     return {"count": len(df), "data": _records(df)}
@@ -12,13 +12,33 @@ Politique d'accès (identique en dev et en prod) :
 
 Les clés se créent depuis la page `/api/` (connecté via l'IdP) ; en local sans
 IdP, créer une `ApiKey` via `manage.py shell`.
+
+Chemin chaud : une requête API ne touche plus la base. L'identité d'une clé
+valide est gardée API_KEY_CACHE_TTL secondes dans le cache Django, sous une
+clé qui inclut un numéro de génération ; révoquer (ou anonymiser) incrémente
+la génération, ce qui invalide d'un coup toutes les entrées — dans tous les
+workers, la génération étant l'horodatage d'un fichier partagé. Les mises à
+jour de `last_used_at` sont regroupées en mémoire et écrites en un seul
+`bulk_update` au plus toutes les API_KEY_LAST_USED_FLUSH secondes (et à
+l'arrêt du worker) : la date affichée peut retarder d'autant.
 """
+import atexit
 import hashlib
+import logging
 import os
-
+import tempfile
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
 from django.utils import timezone
 from ninja.security import HttpBearer
 
+logger = logging.getLogger(__name__)
+
 
 def hash_key(raw_key: str) -> str:
     """Hash SHA-256 (hex) d'une clé brute — ce qui est stocké."""
@@ -49,6 +69,93 @@ def load_env_keys() -> dict[str, str]:
 _ENV_KEYS = load_env_keys()
 
 
+# ---------- cache des identités ---------- #
+
+# Horodatage (mtime) du fichier = génération, partagée par tous les workers
+# de la machine pour un coût d'un stat() par requête.
+_GENERATION_FILE = os.path.join(tempfile.gettempdir(), "elecstat_apikey_generation")
+
+
+def _generation() -> int:
+    try:
+        return os.stat(_GENERATION_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def invalidate_cache() -> None:
+    """Invalide toutes les identités en cache (révocation, anonymisation)."""
+    try:
+        with open(_GENERATION_FILE, "a"):
+            pass
+        # time_ns garantit une valeur nouvelle même si deux révocations
+        # tombent dans la même granularité de mtime du système de fichiers.
+        now = time.time_ns()
+        os.utime(_GENERATION_FILE, ns=(now, max(now, _generation() + 1)))
+    except OSError:
+        logger.warning("Invalidation du cache des clés d'API impossible", exc_info=True)
+
+
+def _cache_key(h: str) -> str:
+    return f"apikey:{_generation()}:{h}"
+
+
+# ---------- last_used_at différé ---------- #
+
+_pending_last_used: dict[int, object] = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _note_used(pk: int) -> bool:
+    """Note l'utilisation de la clé `pk` ; True si le lot est à écrire."""
+    with _pending_lock:
+        _pending_last_used[pk] = timezone.now()
+        return time.monotonic() - _last_flush >= settings.API_KEY_LAST_USED_FLUSH
+
+
+def _touch(pk: int) -> None:
+    """Note l'utilisation de la clé `pk` ; écrit le lot si l'intervalle est échu."""
+    if _note_used(pk):
+        flush_last_used()
+
+
+def flush_last_used() -> None:
+    """Écrit les `last_used_at` en attente (un seul UPDATE, best-effort)."""
+    global _last_flush
+    from .models import ApiKey
+    with _pending_lock:
+        pending = dict(_pending_last_used)
+        _pending_last_used.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    try:
+        ApiKey.objects.bulk_update(
+            [ApiKey(pk=pk, last_used_at=ts) for pk, ts in pending.items()],
+            ["last_used_at"],
+        )
+    except DatabaseError:
+        logger.warning("Écriture des last_used_at impossible (%d clés)", len(pending), exc_info=True)
+
+
+def _flush_at_exit() -> None:
+    """Dernier lot à l'arrêt du worker — sauf si la table n'existe pas
+    (base jamais migrée, p. ex. la base par défaut en fin de tests)."""
+    from .models import ApiKey
+    if not _pending_last_used:
+        return
+    try:
+        if ApiKey._meta.db_table not in connection.introspection.table_names():
+            return
+    except DatabaseError:
+        return
+    flush_last_used()
+
+
+atexit.register(_flush_at_exit)
+
+
 class ApiKeyAuth(HttpBearer):
     """Valide `Authorization: Bearer <clé>` contre la base puis l'env.
 
@@ -62,20 +169,29 @@ class ApiKeyAuth(HttpBearer):
     throttling). Toutes les clés d'un même user partagent donc un seul budget.
     """
 
-    def authenticate(self, request, token):
+    async def authenticate(self, request, token):
+        # Asynchrone (endpoints servis en ASGI, cf. offload.py) : le chemin
+        # chaud reste dans la boucle, seuls les accès base passent par un
+        # thread — une clé en cache ne monopolise plus un thread de worker.
         if not token:
             return None
         h = hash_key(token)
-
-        # Source principale : la base. On filtre sur les clés non révoquées.
-        from .models import ApiKey
-        key = ApiKey.objects.filter(key_hash=h, revoked_at__isnull=True).first()
-        if key is not None:
-            # Trace de dernière utilisation (best-effort, sans bloquer la requête).
-            ApiKey.objects.filter(pk=key.pk).update(last_used_at=timezone.now())
-            # Identité = l'utilisateur, pour que le throttling soit partagé entre
-            # toutes ses clés (cf. docstring). Repli sur la clé si pas de sub.
-            return f"user:{key.user_sub}" if key.user_sub else f"key:{key.pk}"
+        # Génération lue AVANT la base : une révocation validée pendant la
+        # lecture change la génération, et l'entrée posée sous l'ancienne
+        # n'est plus jamais lue.
+        cache_key = _cache_key(h)
+
+        # Chemin chaud : identité déjà vérifiée récemment (cf. docstring du module).
+        cached = cache.get(cache_key)
+        if cached is not None:
+            pk, identity = cached
+            if _note_used(pk):
+                await sync_to_async(flush_last_used)()
+            return identity
+
+        identity = await sync_to_async(_lookup_db)(h, cache_key)
+        if identity is not None:
+            return identity
 
         # Clés d'env — pas d'utilisateur associé, quota par hash.
         if h in _ENV_KEYS:
@@ -83,6 +199,23 @@ class ApiKeyAuth(HttpBearer):
         return None
 
 
+def _lookup_db(h: str, cache_key: str):
+    """Identité de la clé de hash `h` en base (None si absente ou révoquée),
+    mise en cache sous `cache_key` (génération lue avant la requête)."""
+    # Source principale : la base. On filtre sur les clés non révoquées.
+    from .models import ApiKey
+    key = ApiKey.objects.filter(key_hash=h, revoked_at__isnull=True).first()
+    if key is None:
+        return None
+    # Identité = l'utilisateur, pour que le throttling soit partagé entre
+    # toutes ses clés (cf. docstring). Repli sur la clé si pas de sub.
+    identity = f"user:{key.user_sub}" if key.user_sub else f"key:{key.pk}"
+    cache.set(cache_key, (key.pk, identity), settings.API_KEY_CACHE_TTL)
+    # Trace de dernière utilisation (différée, écrite par lots).
+    _touch(key.pk)
+    return identity
+
+
 def get_api_auth():
     """Auth à passer à NinjaAPI."""
     return ApiKeyAuth()
@@ -0,0 +1,95 @@
+"""
+Dimension calendrier : une ligne par jour, calculée une fois par process.
+
+Colonnes :
+    date              – jour (datetime64, minuit)
+    annee             – année
+    jour_semaine      – 0 = lundi … 6 = dimanche
+    jour              – nom du jour (Lundi … Dimanche)
+    type_jour         – 'ouvré', 'samedi', 'dimanche' ou 'férié' (prioritaire)
+    is_weekend, is_ferie, is_ouvre, is_ouvrable
+    nom_ferie         – nom du jour férié, sinon None
+    saison            – saison météorologique (hiver = décembre-février…)
+    is_heure_ete      – heure d'été en vigueur (Europe/Paris, à midi)
+    duree_h           – durée du jour en heures : 23 / 25 aux changements d'heure
+
+Jour ouvré = lundi-vendredi hors fériés ; jour ouvrable = lundi-samedi hors
+fériés. La table couvre de FIRST_YEAR à l'an prochain (élargie si une plage
+sort de ces bornes) ; elle se joint dans DuckDB après `register_calendar`
+(cf. services.get_courbe_by_day_type) au lieu de boucler jour par jour en
+Python.
+"""
+import functools
+from datetime import date
+
+import holidays as holidays_lib
+import numpy as np
+import pandas as pd
+
+FIRST_YEAR = 2000
+TABLE_NAME = "calendrier"
+
+JOURS_SEMAINE = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+# Saison météorologique par mois (index 0 = janvier).
+_SAISONS = np.array(["hiver", "hiver", "printemps", "printemps", "printemps", "été",
+                     "été", "été", "automne", "automne", "automne", "hiver"])
+
+
+def _utc_offset_h(local: pd.DatetimeIndex) -> np.ndarray:
+    return ((local.tz_localize(None) - local.tz_convert("UTC").tz_localize(None))
+            / pd.Timedelta(hours=1)).to_numpy()
+
+
+@functools.lru_cache(maxsize=4)
+def _build(first_year: int, last_year: int) -> pd.DataFrame:
+    dates = pd.date_range(f"{first_year}-01-01", f"{last_year}-12-31", freq="D")
+    feries = holidays_lib.France(years=range(first_year, last_year + 1))
+    nom_ferie = pd.Series(dates.date).map(feries.get)
+
+    weekday = dates.weekday.to_numpy()
+    is_ferie = nom_ferie.notna().to_numpy()
+    is_weekend = weekday >= 5
+
+    # Décalage UTC local à minuit (minuit existe toujours à Paris : le
+    # changement d'heure a lieu à 2 h / 3 h) ; l'écart d'un jour au suivant
+    # donne sa durée.
+    offset_h = _utc_offset_h(pd.date_range(f"{first_year}-01-01", f"{last_year + 1}-01-01",
+                                           freq="D", tz="Europe/Paris"))
+    noon_offset_h = _utc_offset_h((dates + pd.Timedelta(hours=12)).tz_localize("Europe/Paris"))
+
+    table = pd.DataFrame({
+        "date": dates,
+        "annee": dates.year,
+        "jour_semaine": weekday,
+        "jour": np.array(JOURS_SEMAINE)[weekday],
+        "type_jour": np.select(
+            [is_ferie, weekday == 5, weekday == 6], ["férié", "samedi", "dimanche"], "ouvré"
+        ),
+        "is_weekend": is_weekend,
+        "is_ferie": is_ferie,
+        "nom_ferie": nom_ferie.to_numpy(),
+        "is_ouvre": ~is_weekend & ~is_ferie,
+        "is_ouvrable": (weekday != 6) & ~is_ferie,
+        "saison": _SAISONS[dates.month.to_numpy() - 1],
+        "is_heure_ete": noon_offset_h == 2,  # CEST = UTC+2
+        "duree_h": 24 - (offset_h[1:] - offset_h[:-1]),
+    })
+    table["nom_ferie"] = table["nom_ferie"].astype(object).where(is_ferie, None)
+    return table
+
+
+def _bounds(start: date, end: date) -> tuple[int, int]:
+    return min(FIRST_YEAR, start.year), max(date.today().year + 1, end.year)
+
+
+def get_calendar(start: date, end: date) -> pd.DataFrame:
+    """Lignes de la table calendrier entre `start` et `end` inclus."""
+    table = _build(*_bounds(start, end))
+    mask = (table["date"] >= pd.Timestamp(start)) & (table["date"] <= pd.Timestamp(end))
+    return table[mask].reset_index(drop=True)
+
+
+def register_calendar(conn, start: date, end: date) -> None:
+    """Expose la table calendrier (couvrant `start`..`end`) à une connexion
+    DuckDB sous le nom TABLE_NAME — vue sur le DataFrame, sans copie."""
+    conn.register(TABLE_NAME, _build(*_bounds(start, end)))
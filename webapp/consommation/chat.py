@@ -6,15 +6,26 @@ questions about French electricity data (consumption, production, exchanges).
 
 Stateless: the caller supplies the full message history each turn (OpenAI-style
 roles: user / assistant / tool).
+
+Asynchronous: Mistral calls go through the SDK's async client and 429 backoff
+sleeps on the event loop, so a turn waiting on Mistral holds no thread (under
+ASGI, with the async middleware chain of config/asgi.py). Tools (DuckDB,
+blocking) run on a bounded thread pool.
 """
 from __future__ import annotations
 
+import asyncio
+import contextvars
+import functools
 import json
+import logging
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 
-import holidays as holidays_lib
-
+import numpy as np
 import pandas as pd
 try:
     from mistralai import Mistral
@@ -27,12 +38,15 @@ except ImportError:  # mistralai 1.x : les erreurs HTTP dérivent de models.SDKE
 from django.conf import settings
 from django.utils import timezone
 
-from . import services
+from . import calendrier, data_cache, deadlines, metrics, services
 
+logger = logging.getLogger(__name__)
 
-SYSTEM_PROMPT = """Tu es un assistant qui aide à explorer les données électriques françaises (source RTE / ODRÉ).
 
-Date du jour : {today} (fuseau Europe/Paris). Toute expression relative — « hier », « aujourd'hui », « ce mois-ci », « cette année », « le mois dernier », etc. — se calcule par rapport à cette date, PAS à tes connaissances internes. Les données ont parfois un léger retard : si la donnée « d'hier » n'existe pas encore, appelle `get_overview` pour connaître la dernière date réellement disponible et dis-le à l'utilisateur.
+# Partie statique du prompt système : identique d'un appel à l'autre (jusqu'à
+# 10 par tour), elle forme un préfixe stable que l'API peut réutiliser. Tout
+# ce qui varie (date du jour, résumé de conversation) vient APRÈS.
+SYSTEM_PROMPT = """Tu es un assistant qui aide à explorer les données électriques françaises (source RTE / ODRÉ).
 
 Règles :
 - Réponds toujours en français, de manière concise.
@@ -40,187 +54,175 @@ Règles :
 - N'invente jamais de chiffres : utilise systématiquement les tools pour récupérer les données.
 - Si l'utilisateur ne précise pas la période, appelle d'abord `get_overview` pour connaître les bornes disponibles.
 - Les valeurs de consommation et de production sont en MW (puissance instantanée demi-horaire) ou MWh (énergie agrégée mensuelle/annuelle). Précise toujours l'unité.
+- Dates des tools au format ISO YYYY-MM-DD (YYYY-MM pour `get_parc`).
 - Pour les filières de production : nucleaire, hydraulique, eolien, solaire, gaz, charbon, fioul, bioenergies.
 - Pour les pays d'échange : ech_physiques (solde total), ech_comm_angleterre, ech_comm_espagne, ech_comm_italie, ech_comm_suisse, ech_comm_allemagne_belgique. Un solde négatif = exportation, positif = importation.
 - Pour les VOLUMES d'échange importés/exportés (en énergie, sur un mois ou une année), utilise `get_echanges_energie` (MWh), pas `get_echanges` (qui ne donne que la puissance MW).
 - Pour la puissance installée (parc) : `get_parc` — évolution du parc éolien terrestre, éolien en mer et solaire uniquement. granularity='annual' par défaut (une valeur par année, année en cours marquée partial=true) ou 'monthly' pour le détail. Une ligne partial=true est la valeur du dernier mois connu, pas un total annuel : présente-la comme telle.
 - Quand tu présentes des séries de chiffres, utilise des tableaux markdown lisibles.
 - Pour les questions de type « pic / record / maximum / minimum » sur une période, appelle TOUJOURS `get_peak` (pas `get_consommation`/`get_production` en raw — qui downsample et perdent le datetime exact).
-- La granularité `raw` est limitée à 31 jours. Au-delà, utilise `daily` ou `get_peak`.
+- La granularité `raw` n'est demi-horaire que sur 31 jours au plus ; au-delà, elle est agrégée par heure (jusqu'à un an) puis par jour. Pour une longue période, préfère `daily`, `weekly` ou `monthly` (moyenne, min et max en MW, énergie en MWh par période), ou `get_peak` pour les extrêmes.
 - N'affirme jamais qu'une donnée « s'arrête » à une année donnée sans le vérifier : fie-toi aux lignes réellement renvoyées par le tool (et à `get_overview`). Si tu résumes une série mensuelle en années, inclus la dernière année même partielle et précise le dernier mois disponible.
-- Pour toute question impliquant des jours ouvrés, jours ouvrables, jours fériés ou l'effet du calendrier sur la conso/production, utilise `get_calendrier` pour qualifier les jours, puis croise avec les données via `get_consommation` ou `get_production` en `granularity='daily'`. Rappel : jour ouvré = lundi-vendredi hors jours fériés ; jour ouvrable = lundi-samedi hors jours fériés.
+- Pour une moyenne ou des extrêmes par type de jour (jours fériés, ouvrés, samedis/dimanches, jour de la semaine, saison), appelle directement `get_stats_type_jour` : le croisement est fait côté serveur. Pour qualifier des jours précis (ouvré ou non, nom du férié), utilise `get_calendrier`. Rappel : jour ouvré = lundi-vendredi hors jours fériés ; jour ouvrable = lundi-samedi hors jours fériés.
 - Si une demande est ambiguë, pose une courte question avant d'appeler un tool."""
 
+_DATE_LINE = """
 
-def _build_system_prompt() -> str:
-    """Prompt système avec la date du jour (Europe/Paris) injectée à chaque appel.
+Date du jour : {today} (fuseau Europe/Paris). Toute expression relative — « hier », « aujourd'hui », « ce mois-ci », « cette année », « le mois dernier », etc. — se calcule par rapport à cette date, PAS à tes connaissances internes. Les données ont parfois un léger retard : si la donnée « d'hier » n'existe pas encore, appelle `get_overview` pour connaître la dernière date réellement disponible et dis-le à l'utilisateur."""
 
-    Sans cette date, le modèle résout « hier » / « aujourd'hui » d'après ses
-    connaissances internes (année erronée) au lieu de la date réelle.
-    """
-    d = timezone.localdate()
+
+@functools.lru_cache(maxsize=2)
+def _system_prompt(d: date) -> str:
     jours = ("lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche")
     mois = ("janvier", "février", "mars", "avril", "mai", "juin", "juillet",
             "août", "septembre", "octobre", "novembre", "décembre")
     today = f"{jours[d.weekday()]} {d.day} {mois[d.month - 1]} {d.year} ({d.isoformat()})"
-    return SYSTEM_PROMPT.format(today=today)
+    return SYSTEM_PROMPT + _DATE_LINE.format(today=today)
+
 
+def _build_system_prompt() -> str:
+    """Prompt système : partie statique puis date du jour (Europe/Paris).
+
+    Sans cette date, le modèle résout « hier » / « aujourd'hui » d'après ses
+    connaissances internes (année erronée) au lieu de la date réelle. Le
+    texte n'est construit qu'une fois par jour (cache sur la date).
+    """
+    return _system_prompt(timezone.localdate())
+
+
+_FILIERES = ["nucleaire", "hydraulique", "eolien", "solaire", "gaz", "charbon", "fioul", "bioenergies"]
+_PAYS = ["ech_physiques", "ech_comm_angleterre", "ech_comm_espagne", "ech_comm_italie",
+         "ech_comm_suisse", "ech_comm_allemagne_belgique"]
+_DATASETS = ["consommation", "production", "echanges"]
+# Paramètres partagés, décrits une seule fois ici. Les dates (format ISO
+# YYYY-MM-DD, rappelé dans SYSTEM_PROMPT) se passent de description.
+_DATE = {"type": "string"}
+_PERIOD = {"start": _DATE, "end": _DATE}
+# Filtres/tri côté serveur des séries mensuelles (get_consommation,
+# get_production, get_echanges_energie).
+_MONTHLY_FILTERS = {
+    "month": {"type": "integer", "description": "Mois 1-12 (2 = tous les février)."},
+    "order": {"enum": ["value", "recent"], "description": "Si `month` : 'value' (défaut) = décroissant (records), 'recent' = plus récent d'abord."},
+    "top_n": {"type": "integer"},
+}
+_SERIE_PARAMS = {
+    "dataset": {"enum": _DATASETS},
+    "filiere": {"enum": _FILIERES, "description": "Si dataset=production."},
+    "pays": {"enum": _PAYS, "description": "Si dataset=echanges."},
+    **_PERIOD,
+}
+_NO_PARAMS = {"type": "object", "properties": {}}
 
 TOOLS = [
     {
         "name": "get_overview",
-        "description": "Retourne les bornes temporelles disponibles pour chaque dataset (consommation, production, échanges) ainsi que la liste des filières et pays. À appeler en début de conversation si tu n'as pas le contexte.",
-        "input_schema": {"type": "object", "properties": {}, "required": []},
+        "description": "Bornes temporelles de chaque dataset, filières et pays disponibles.",
+        "input_schema": _NO_PARAMS,
     },
     {
         "name": "get_consommation",
-        "description": "Consommation électrique française. Utilise `granularity` pour choisir l'agrégation. 'raw' = données demi-horaires en MW (limiter à quelques jours). 'daily' = moyenne quotidienne en MW. 'monthly' = totaux mensuels en MWh. 'annual' = totaux annuels en MWh. Pour 'monthly' : utilise `month` (1-12) pour filtrer sur un mois calendaire précis (ex. 2 = tous les mois de février de chaque année), `order` pour choisir le tri ('value' = classement par conso pour les questions record/palmarès ; 'recent' = du plus récent au plus ancien pour les questions « les N derniers/récents février ») et `top_n` pour ne garder que les N premiers résultats déjà triés.",
+        "description": "Consommation française. 'raw' = demi-horaire MW ; 'daily'/'weekly' (semaine du lundi) = moyenne `value`, `min`, `max` en MW et `energie_mwh` ; 'monthly'/'annual' = MWh, tout l'historique (start/end ignorés).",
         "input_schema": {
             "type": "object",
             "properties": {
-                "granularity": {"type": "string", "enum": ["raw", "daily", "monthly", "annual"]},
-                "start": {"type": "string", "description": "Date de début ISO YYYY-MM-DD. Ignoré pour 'monthly' et 'annual' (renvoie tout)."},
-                "end": {"type": "string", "description": "Date de fin ISO YYYY-MM-DD."},
-                "month": {"type": "integer", "description": "Filtre sur un mois calendaire (1=janvier … 12=décembre). Uniquement pour granularity='monthly'."},
-                "order": {"type": "string", "enum": ["value", "recent"], "description": "Tri appliqué quand `month` est utilisé. 'value' (défaut) = consommation décroissante (classement/record/palmarès). 'recent' = du mois le plus récent au plus ancien (pour « les N derniers/récents <mois> »)."},
-                "top_n": {"type": "integer", "description": "Nombre de résultats à retourner (après tri selon `order`). Uniquement pour granularity='monthly'."},
+                "granularity": {"enum": ["raw", "daily", "weekly", "monthly", "annual"]},
+                **_PERIOD,
+                **_MONTHLY_FILTERS,
             },
             "required": ["granularity"],
         },
     },
     {
         "name": "get_production",
-        "description": "Production électrique française par filière. 'raw' = demi-horaire MW, 'daily' = moyenne quotidienne MW, 'monthly' = MWh mensuels, 'annual' = MWh annuels. Pour 'monthly' : utilise `month` (1-12) pour filtrer sur un mois calendaire précis (ex. 7 = tous les mois de juillet de chaque année), `order` pour choisir le tri ('value' = classement par production pour les questions record/palmarès ; 'recent' = du plus récent au plus ancien pour « les N derniers/récents juillet ») et `top_n` pour ne garder que les N premiers résultats déjà triés.",
+        "description": "Production par filière ; granularités et colonnes de get_consommation.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "filiere": {"type": "string", "enum": ["nucleaire", "hydraulique", "eolien", "solaire", "gaz", "charbon", "fioul", "bioenergies"]},
-                "granularity": {"type": "string", "enum": ["raw", "daily", "monthly", "annual"]},
-                "start": {"type": "string", "description": "Date début ISO. Ignoré pour 'monthly'/'annual'."},
-                "end": {"type": "string", "description": "Date fin ISO."},
-                "month": {"type": "integer", "description": "Filtre sur un mois calendaire (1=janvier … 12=décembre). Uniquement pour granularity='monthly'."},
-                "order": {"type": "string", "enum": ["value", "recent"], "description": "Tri appliqué quand `month` est utilisé. 'value' (défaut) = production décroissante (classement/record/palmarès). 'recent' = du mois le plus récent au plus ancien (pour « les N derniers/récents <mois> »)."},
-                "top_n": {"type": "integer", "description": "Nombre de résultats à retourner (après tri selon `order`). Uniquement pour granularity='monthly'."},
+                "filiere": {"enum": _FILIERES},
+                "granularity": {"enum": ["raw", "daily", "weekly", "monthly", "annual"]},
+                **_PERIOD,
+                **_MONTHLY_FILTERS,
             },
             "required": ["filiere", "granularity"],
         },
     },
     {
         "name": "get_echanges",
-        "description": "Échanges transfrontaliers d'électricité. Solde négatif = export, positif = import. Granularité 'raw' (MW demi-horaire) ou 'daily' (moyenne MW).",
+        "description": "Échanges transfrontaliers en MW. 'raw' = demi-horaire ; 'daily'/'weekly'/'monthly' = moyenne `value`, `min`, `max` et solde `energie_mwh`.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "pays": {"type": "string", "enum": ["ech_physiques", "ech_comm_angleterre", "ech_comm_espagne", "ech_comm_italie", "ech_comm_suisse", "ech_comm_allemagne_belgique"]},
-                "granularity": {"type": "string", "enum": ["raw", "daily"]},
-                "start": {"type": "string"},
-                "end": {"type": "string"},
+                "pays": {"enum": _PAYS},
+                "granularity": {"enum": ["raw", "daily", "weekly", "monthly"]},
+                **_PERIOD,
             },
             "required": ["pays", "granularity", "start", "end"],
         },
     },
     {
         "name": "get_dashboard",
-        "description": "Photo du jour : dernière journée disponible (conso et production demi-horaires), pic de conso de l'année et historique, mix de production de l'année en cours.",
-        "input_schema": {"type": "object", "properties": {}, "required": []},
+        "description": "Photo du jour : dernière journée (conso et production demi-horaires), pic de conso de l'année et historique, mix de l'année.",
+        "input_schema": _NO_PARAMS,
     },
     {
         "name": "get_parc",
-        "description": (
-            "Puissance installée (parc) en MW — série historique, disponible UNIQUEMENT pour "
-            "'Eolien terrestre', 'Eolien en mer' et 'Solaire' (estimée à partir de production / "
-            "facteur de charge). granularity='annual' (défaut) = une valeur par année (le parc du "
-            "dernier mois connu de l'année ; l'année en cours est marquée partial=true). "
-            "granularity='monthly' = série mensuelle détaillée."
-        ),
+        "description": "Puissance installée (MW) éolien terrestre, éolien en mer et solaire. 'annual' (défaut) = parc du dernier mois connu de chaque année ; 'monthly' = série mensuelle.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "granularity": {
-                    "type": "string",
-                    "enum": ["annual", "monthly"],
-                    "description": "Défaut 'annual'.",
-                },
-                "filiere": {
-                    "type": "string",
-                    "enum": ["Eolien terrestre", "Eolien en mer", "Solaire"],
-                    "description": "Filtre optionnel.",
-                },
-                "start": {"type": "string", "description": "Mois de début YYYY-MM (optionnel)."},
-                "end": {"type": "string", "description": "Mois de fin YYYY-MM (optionnel)."},
+                "granularity": {"enum": ["annual", "monthly"]},
+                "filiere": {"enum": ["Eolien terrestre", "Eolien en mer", "Solaire"]},
+                "start": {"type": "string", "description": "YYYY-MM"},
+                "end": {"type": "string", "description": "YYYY-MM"},
             },
-            "required": [],
         },
     },
     {
         "name": "get_echanges_energie",
-        "description": (
-            "Volumes d'échanges en ÉNERGIE (MWh) importés/exportés, par mois ou par an, pour une frontière "
-            "commerciale ou 'total' (solde commercial global de la France). "
-            "Convention : import = entrant vers la France, export = sortant (deux volumes positifs distincts). "
-            "À privilégier sur get_echanges (qui ne renvoie que de la puissance MW) pour toute question de "
-            "VOLUME importé/exporté sur une période. "
-            "Pour 'monthly' : utilise `month` (1-12) pour filtrer sur un mois calendaire, `order` "
-            "('value' = classement par volume / 'recent' = du plus récent au plus ancien pour « les N "
-            "derniers <mois> »), `sort_by` ('import_mwh' ou 'export_mwh', sens du volume classé quand "
-            "order='value') et `top_n` pour les N résultats — tri appliqué côté serveur."
-        ),
+        "description": "Volumes d'échanges en MWh (import = entrant, export = sortant, deux volumes positifs), par mois ou par an, par frontière commerciale ou 'total'.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "granularity": {"type": "string", "enum": ["monthly", "annual"]},
-                "pays": {
-                    "type": "string",
-                    "enum": ["total", "ech_comm_angleterre", "ech_comm_espagne", "ech_comm_italie", "ech_comm_suisse", "ech_comm_allemagne_belgique"],
-                    "description": "Frontière commerciale ou 'total'. Défaut 'total'. (ech_physiques non disponible en énergie.)",
-                },
-                "start": {"type": "string", "description": "Date de début ISO YYYY-MM-DD."},
-                "end": {"type": "string", "description": "Date de fin ISO YYYY-MM-DD."},
-                "month": {"type": "integer", "description": "Filtre sur un mois calendaire (1=janvier … 12=décembre). Uniquement pour granularity='monthly'."},
-                "order": {"type": "string", "enum": ["value", "recent"], "description": "Tri appliqué quand `month` est utilisé. 'value' (défaut) = volume décroissant selon `sort_by` (classement/record). 'recent' = du mois le plus récent au plus ancien (pour « les N derniers <mois> »)."},
-                "sort_by": {"type": "string", "enum": ["import_mwh", "export_mwh"], "description": "Colonne de tri pour le classement (volumes positifs). Uniquement pour granularity='monthly' avec order='value'. Défaut 'import_mwh'."},
-                "top_n": {"type": "integer", "description": "Nombre de résultats à retourner (après tri selon `order`). Uniquement pour granularity='monthly'."},
+                "granularity": {"enum": ["monthly", "annual"]},
+                "pays": {"enum": ["total"] + _PAYS[1:], "description": "Défaut 'total'."},
+                **_PERIOD,
+                **_MONTHLY_FILTERS,
+                "sort_by": {"enum": ["import_mwh", "export_mwh"], "description": "Volume classé si order='value'."},
             },
             "required": ["granularity", "start", "end"],
         },
     },
     {
         "name": "get_calendrier",
-        "description": (
-            "Retourne la nature de chaque jour d'une plage : ouvré / non-ouvré, jour de semaine, férié et son nom. "
-            "À utiliser pour contextualiser les données de conso/production par type de jour (comparer un lundi ouvré "
-            "vs un jour férié, filtrer des jours ouvrés…). "
-            "Si summary=true, renvoie un compte agrégé (nb ouvrés, fériés, weekends) sans le détail jour par jour — "
-            "utile pour les longues périodes. "
-            "Définitions : jour ouvré = lundi-vendredi hors jours fériés ; "
-            "jour ouvrable = lundi-samedi hors jours fériés."
-        ),
+        "description": "Nature de chaque jour d'une plage : jour de semaine, ouvré, ouvrable, férié et son nom. summary=true : comptes seuls (longues périodes).",
+        "input_schema": {
+            "type": "object",
+            "properties": {**_PERIOD, "summary": {"type": "boolean"}},
+            "required": ["start", "end"],
+        },
+    },
+    {
+        "name": "get_stats_type_jour",
+        "description": "Stats journalières groupées par type de jour, calculées côté serveur : nombre de jours, moyenne et min/max des puissances (MW), énergie moyenne par jour (MWh).",
         "input_schema": {
             "type": "object",
             "properties": {
-                "start": {"type": "string", "description": "Date début ISO YYYY-MM-DD."},
-                "end": {"type": "string", "description": "Date fin ISO YYYY-MM-DD."},
-                "summary": {
-                    "type": "boolean",
-                    "description": "Si true, retourne un résumé agrégé plutôt que le détail jour par jour.",
-                },
+                **_SERIE_PARAMS,
+                "by": {"enum": ["type_jour", "jour_semaine", "saison", "ferie"],
+                       "description": "'type_jour' (défaut) = ouvré/samedi/dimanche/férié ; 'ferie' = une ligne par férié."},
             },
-            "required": ["start", "end"],
+            "required": ["dataset", "start", "end"],
         },
     },
     {
         "name": "get_peak",
-        "description": "Top-N valeurs extrêmes (max ou min) avec leur datetime exact, sur une période. À utiliser pour toute question 'pic / record / maximum / minimum' au lieu de get_consommation/get_production en granularity raw (plus précis, pas de downsampling).",
+        "description": "Top-N extrêmes avec leur datetime exact sur une période.",
         "input_schema": {
             "type": "object",
             "properties": {
-                "dataset": {"type": "string", "enum": ["consommation", "production", "echanges"]},
-                "filiere": {"type": "string", "enum": ["nucleaire", "hydraulique", "eolien", "solaire", "gaz", "charbon", "fioul", "bioenergies"], "description": "Requis si dataset=production."},
-                "pays": {"type": "string", "enum": ["ech_physiques", "ech_comm_angleterre", "ech_comm_espagne", "ech_comm_italie", "ech_comm_suisse", "ech_comm_allemagne_belgique"], "description": "Requis si dataset=echanges."},
-                "start": {"type": "string", "description": "Date début ISO YYYY-MM-DD."},
-                "end": {"type": "string", "description": "Date fin ISO YYYY-MM-DD."},
-                "direction": {"type": "string", "enum": ["max", "min"], "description": "Sens du tri. Défaut 'max'."},
-                "n": {"type": "integer", "description": "Nombre de résultats (1-20). Défaut 5."},
+                **_SERIE_PARAMS,
+                "direction": {"enum": ["max", "min"]},
+                "n": {"type": "integer", "description": "1-20, défaut 5."},
             },
             "required": ["dataset", "start", "end"],
         },
@@ -228,16 +230,30 @@ TOOLS = [
 ]
 
 
+def _compact_schema(node):
+    """Copie d'un schéma sans ce qui ne porte pas d'information : listes
+    `required` vides, espaces superflus dans les descriptions."""
+    if isinstance(node, dict):
+        return {
+            k: " ".join(v.split()) if k == "description" and isinstance(v, str) else _compact_schema(v)
+            for k, v in node.items()
+            if not (k == "required" and v == [])
+        }
+    if isinstance(node, list):
+        return [_compact_schema(v) for v in node]
+    return node
+
+
 # Mistral attend le format OpenAI : {"type": "function", "function": {name, description, parameters}}.
 # On dérive cette liste des définitions ci-dessus pour garder les schémas en un seul endroit.
 MISTRAL_TOOLS = [
     {
         "type": "function",
-        "function": {
+        "function": _compact_schema({
             "name": t["name"],
             "description": t["description"],
             "parameters": t["input_schema"],
-        },
+        }),
     }
     for t in TOOLS
 ]
@@ -246,8 +262,11 @@ MISTRAL_TOOLS = [
 # ---------- serialization helpers ---------- #
 
 _MAX_ROWS = 150
-_SAMPLE_SIZE = 30
-_MAX_RAW_DAYS = 31
+_SAMPLE_MAX = 120   # points représentatifs au plus, avant ajustement au budget
+_SAMPLE_MIN = 12
+_CHARS_PER_TOKEN = 4  # estimation grossière, sans tokenizer (cf. _estimate_tokens)
+_MAX_RAW_DAYS = 31      # au-delà, `raw` est agrégé par heure…
+_MAX_HOURLY_DAYS = 366  # …puis par jour
 
 
 def _isoformat(v):
@@ -258,13 +277,83 @@ def _isoformat(v):
     return v
 
 
-def _df_to_payload(df: pd.DataFrame, value_col: str, unit: str, force_full: bool = False) -> dict:
+def _lttb_indices(y: np.ndarray, n: int) -> np.ndarray:
+    """Indices des `n` points retenus par Largest-Triangle-Three-Buckets.
+
+    Garde la forme de la courbe (pics, creux, ruptures) là où un pas fixe
+    tombe entre deux extrêmes. Premier et dernier points toujours inclus ;
+    abscisse = rang de la ligne (séries à pas régulier).
+    """
+    length = len(y)
+    if n >= length or n < 3:
+        return np.arange(length) if n >= length else np.array([0, length - 1])
+    bucket = (length - 2) / (n - 2)
+    x = np.arange(length, dtype=float)
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, length - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = int(i * bucket) + 1, int((i + 1) * bucket) + 1
+        nxt_hi = min(int((i + 2) * bucket) + 1, length)
+        avg_x, avg_y = x[hi:nxt_hi].mean(), y[hi:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def _columnar(df: pd.DataFrame) -> dict:
+    """{colonne: [valeurs]} : les noms de colonnes ne sont pas répétés à
+    chaque ligne comme dans une liste de dicts."""
+    return {
+        col: [None if pd.isna(v) else _isoformat(v) for v in df[col].tolist()]
+        for col in df.columns
+    }
+
+
+def _payload_tokens(payload: dict) -> int:
+    return len(json.dumps(payload, default=str, ensure_ascii=False)) // _CHARS_PER_TOKEN
+
+
+def _representative_sample(df: pd.DataFrame, series: pd.Series, base: dict) -> dict:
+    """Ajoute à `base` l'échantillon représentatif de `df` qui tient dans
+    CHAT_TOOL_TOKEN_BUDGET : points LTTB + min/max exacts, en colonnes.
+
+    Le nombre de points part de _SAMPLE_MAX et décroît proportionnellement
+    au dépassement estimé, sans descendre sous _SAMPLE_MIN. Une `note` de
+    `base` est préfixée à celle de l'échantillon, et comptée dans le budget.
+    """
+    budget = getattr(settings, "CHAT_TOOL_TOKEN_BUDGET", 0)
+    prefix = f"{base['note']} " if "note" in base else ""
+    y = series.fillna(series.mean()).to_numpy(dtype=float)
+    extremes = [int(np.nanargmin(series.to_numpy(dtype=float))),
+                int(np.nanargmax(series.to_numpy(dtype=float)))]
+    n = min(_SAMPLE_MAX, len(df))
+    while True:
+        keep = np.union1d(_lttb_indices(y, n), extremes)
+        payload = {
+            **base,
+            "sample": _columnar(df.iloc[keep]),
+            "note": f"{prefix}Série de {len(df)} lignes — {len(keep)} points représentatifs (forme de "
+                    f"la courbe, min et max exacts inclus), en colonnes, plus stats globales.",
+        }
+        tokens = _payload_tokens(payload)
+        if not budget or tokens <= budget or n <= _SAMPLE_MIN:
+            return payload
+        n = max(_SAMPLE_MIN, min(n - 1, int(n * budget / tokens * 0.9)))
+
+
+def _df_to_payload(df: pd.DataFrame, value_col: str, unit: str, force_full: bool = False,
+                   extra: dict | None = None) -> dict:
     """Compact JSON for a time-series DataFrame.
 
     Returns full rows when `force_full` ou sous _MAX_ROWS, else stats +
-    sous-échantillon de lignes. Le sous-échantillonnage jette des lignes
-    entières (donc des périodes entières) : à ne JAMAIS utiliser pour des
-    agrégats déjà compacts (mensuel/annuel) — passer `force_full=True`.
+    échantillon représentatif en colonnes (cf. _representative_sample),
+    dimensionné pour CHAT_TOOL_TOKEN_BUDGET. L'échantillon omet des
+    périodes : à ne JAMAIS utiliser pour des agrégats déjà compacts
+    (mensuel/annuel) — passer `force_full=True`.
+    `extra` : clés ajoutées au payload avant le dimensionnement (p.ex. une
+    `note` de l'appelant, préfixée à celle de l'échantillon).
     """
     if df.empty:
         return {"rows_total": 0, "data": [], "unit": unit}
@@ -281,20 +370,17 @@ def _df_to_payload(df: pd.DataFrame, value_col: str, unit: str, force_full: bool
         "sum": float(series.sum()),
         "count": int(series.count()),
     }
-    payload = {"unit": unit, "rows_total": len(df), "stats": stats}
+    payload = {"unit": unit, "rows_total": len(df), "stats": stats, **(extra or {})}
 
     if force_full or len(df) <= _MAX_ROWS:
         payload["data"] = [
             {k: _isoformat(v) for k, v in r.items()} for r in df.to_dict(orient="records")
         ]
-    else:
-        step = max(1, len(df) // _SAMPLE_SIZE)
-        sample = df.iloc[::step].head(_SAMPLE_SIZE)
-        payload["sample"] = [
-            {k: _isoformat(v) for k, v in r.items()} for r in sample.to_dict(orient="records")
-        ]
-        payload["note"] = f"Dataset trop volumineux ({len(df)} lignes) — sample équiréparti de {len(sample)} points fourni, plus stats globales."
-    return payload
+        return payload
+    first_col = df.columns[0]
+    stats["period"] = {"start": _isoformat(df[first_col].iloc[0]),
+                       "end": _isoformat(df[first_col].iloc[-1])}
+    return _representative_sample(df.reset_index(drop=True), series.reset_index(drop=True), payload)
 
 
 def _parc_to_annual(df: pd.DataFrame) -> pd.DataFrame:
@@ -327,6 +413,43 @@ def _parse_dates(args: dict, default_days: int | None = None) -> tuple[date, dat
     return start_d, end_d
 
 
+def _courbe_payload(kind: str, key, args: dict, fetch_raw) -> dict:
+    """Série de puissance d'un tool : demi-horaire (`raw`, via `fetch_raw`)
+    ou agrégée par DuckDB (services.get_courbe_aggregated).
+
+    Seules les lignes agrégées (une par période, avec moyenne/min/max en MW
+    et énergie en MWh) arrivent en Python : dix ans en `daily` ≈ 3 600
+    lignes au lieu de 175 000 points. Un `raw` au-delà de _MAX_RAW_DAYS est
+    servi agrégé par heure, puis par jour, plutôt que refusé.
+    """
+    g = args["granularity"]
+    start, end = _parse_dates(args)
+    if not start or not end:
+        return {"error": f"start et end sont requis pour granularity {g}"}
+    days = (end - start).days
+    if g == "raw" and days <= _MAX_RAW_DAYS:
+        df = fetch_raw(start, end)
+        if df.empty:
+            return {"rows_total": 0, "data": [], "unit": "MW"}
+        return _df_to_payload(df[["date_heure", kind]].rename(columns={kind: "value"}), "value", "MW")
+
+    step = g if g != "raw" else ("hourly" if days <= _MAX_HOURLY_DAYS else "daily")
+    df = services.get_courbe_aggregated(kind, start, end, key=key, step=step)
+    if df.empty:
+        return {"rows_total": 0, "data": [], "unit": "MW"}
+    df = df.rename(columns={"mean": "value"})
+    if step != "hourly":
+        df = df.rename(columns={"date_heure": "date"})
+        df["date"] = df["date"].dt.date
+    extra = None
+    if g == "raw":
+        # Passé avant le dimensionnement de l'échantillon : compté dans le budget.
+        extra = {"granularity": step,
+                 "note": f"Période de {days} jours : données agrégées par "
+                         f"{'heure' if step == 'hourly' else 'jour'} (value = moyenne en MW)."}
+    return _df_to_payload(df, "value", "MW", extra=extra)
+
+
 def _tool_get_overview() -> dict:
     cons_min, cons_max = services.get_date_range()
     prod_min, prod_max = services.get_production_date_range()
@@ -359,20 +482,7 @@ def _tool_get_consommation(args: dict) -> dict:
             df = df.head(int(top_n))
         return _df_to_payload(df, "value", "MWh", force_full=True)
 
-    start, end = _parse_dates(args)
-    if not start or not end:
-        return {"error": "start et end sont requis pour granularity raw/daily"}
-    if g == "raw" and (end - start).days > _MAX_RAW_DAYS:
-        return {"error": f"Période trop longue pour granularity=raw ({(end - start).days} jours > {_MAX_RAW_DAYS}). Utilise granularity='daily' pour agréger, ou le tool 'get_peak' pour les extrêmes."}
-    df = services.get_puissance_data(start, end)
-    if df.empty:
-        return {"rows_total": 0, "data": [], "unit": "MW"}
-    df = df[["date_heure", "consommation"]].rename(columns={"consommation": "value"})
-
-    if g == "daily":
-        df["date"] = pd.to_datetime(df["date_heure"]).dt.date
-        df = df.groupby("date", as_index=False)["value"].mean()
-    return _df_to_payload(df, "value", "MW")
+    return _courbe_payload("consommation", None, args, services.get_puissance_data)
 
 
 def _tool_get_production(args: dict) -> dict:
@@ -402,37 +512,18 @@ def _tool_get_production(args: dict) -> dict:
             df = df.head(int(top_n))
         return _df_to_payload(df, "value", "MWh", force_full=True)
 
-    start, end = _parse_dates(args)
-    if not start or not end:
-        return {"error": "start et end sont requis pour granularity raw/daily"}
-    if g == "raw" and (end - start).days > _MAX_RAW_DAYS:
-        return {"error": f"Période trop longue pour granularity=raw ({(end - start).days} jours > {_MAX_RAW_DAYS}). Utilise granularity='daily' pour agréger, ou le tool 'get_peak' pour les extrêmes."}
-    df = services.get_production_data(start, end, filiere=filiere)
-    if df.empty:
-        return {"rows_total": 0, "data": [], "unit": "MW"}
-    df = df[["date_heure", "production"]].rename(columns={"production": "value"})
-    if g == "daily":
-        df["date"] = pd.to_datetime(df["date_heure"]).dt.date
-        df = df.groupby("date", as_index=False)["value"].mean()
-    return _df_to_payload(df, "value", "MW")
+    return _courbe_payload(
+        "production", filiere, args,
+        lambda start, end: services.get_production_data(start, end, filiere=filiere),
+    )
 
 
 def _tool_get_echanges(args: dict) -> dict:
     pays = args["pays"]
-    g = args["granularity"]
-    start, end = _parse_dates(args)
-    if not start or not end:
-        return {"error": "start et end sont requis"}
-    if g == "raw" and (end - start).days > _MAX_RAW_DAYS:
-        return {"error": f"Période trop longue pour granularity=raw ({(end - start).days} jours > {_MAX_RAW_DAYS}). Utilise granularity='daily' pour agréger, ou le tool 'get_peak' pour les extrêmes."}
-    df = services.get_echanges_data(start, end, pays=pays)
-    if df.empty:
-        return {"rows_total": 0, "data": [], "unit": "MW"}
-    df = df[["date_heure", "echange"]].rename(columns={"echange": "value"})
-    if g == "daily":
-        df["date"] = pd.to_datetime(df["date_heure"]).dt.date
-        df = df.groupby("date", as_index=False)["value"].mean()
-    return _df_to_payload(df, "value", "MW")
+    return _courbe_payload(
+        "echange", pays, args,
+        lambda start, end: services.get_echanges_data(start, end, pays=pays),
+    )
 
 
 def _tool_get_dashboard() -> dict:
@@ -536,8 +627,6 @@ def _tool_get_echanges_energie(args: dict) -> dict:
     }
 
 
-_JOURS_SEMAINE = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
-
 _MAX_CALENDAR_DAYS = 400
 
 
@@ -546,57 +635,62 @@ def _tool_get_calendrier(args: dict) -> dict:
     if not start or not end:
         return {"error": "start et end sont requis"}
     nb_days = (end - start).days + 1
-    if nb_days > _MAX_CALENDAR_DAYS:
-        return {"error": f"Plage trop longue ({nb_days} jours > {_MAX_CALENDAR_DAYS}). Utilise summary=true ou réduis la période."}
-
-    years = range(start.year, end.year + 1)
-    fr_holidays = {}
-    for y in years:
-        fr_holidays.update(holidays_lib.France(years=y))
-
     summary_mode = args.get("summary", False)
-    rows = []
-    counts = {"ouvrés": 0, "ouvrables": 0, "weekends": 0, "fériés": 0, "total": nb_days}
-
-    d = start
-    while d <= end:
-        wd = d.weekday()  # 0=lundi … 6=dimanche
-        is_weekend = wd >= 5
-        ferie_name = fr_holidays.get(d)
-        is_ferie = ferie_name is not None
-        is_ouvre = not is_weekend and not is_ferie
-        is_ouvrable = wd != 6 and not is_ferie  # lundi-samedi hors fériés
-
-        if is_weekend:
-            counts["weekends"] += 1
-        if is_ferie:
-            counts["fériés"] += 1
-        if is_ouvre:
-            counts["ouvrés"] += 1
-        if is_ouvrable:
-            counts["ouvrables"] += 1
-
-        if not summary_mode:
-            row = {
-                "date": d.isoformat(),
-                "jour": _JOURS_SEMAINE[wd],
-                "is_ouvre": is_ouvre,
-                "is_ouvrable": is_ouvrable,
-                "is_weekend": is_weekend,
-                "is_ferie": is_ferie,
-            }
-            if is_ferie:
-                row["nom_ferie"] = ferie_name
-            rows.append(row)
-
-        d += timedelta(days=1)
+    if nb_days > _MAX_CALENDAR_DAYS and not summary_mode:
+        return {"error": f"Plage trop longue ({nb_days} jours > {_MAX_CALENDAR_DAYS}). Utilise summary=true ou réduis la période."}
 
+    cal = calendrier.get_calendar(start, end)
+    counts = {
+        "ouvrés": int(cal["is_ouvre"].sum()),
+        "ouvrables": int(cal["is_ouvrable"].sum()),
+        "weekends": int(cal["is_weekend"].sum()),
+        "fériés": int(cal["is_ferie"].sum()),
+        "total": nb_days,
+    }
     result = {"start": start.isoformat(), "end": end.isoformat(), "summary": counts}
     if not summary_mode:
+        cols = ["date", "jour", "is_ouvre", "is_ouvrable", "is_weekend", "is_ferie", "nom_ferie"]
+        rows = []
+        for r in cal[cols].to_dict(orient="records"):
+            r["date"] = r["date"].date().isoformat()
+            if not r["is_ferie"]:
+                del r["nom_ferie"]
+            rows.append(r)
         result["jours"] = rows
     return result
 
 
+def _tool_get_stats_type_jour(args: dict) -> dict:
+    dataset = args["dataset"]
+    start, end = _parse_dates(args)
+    if not start or not end:
+        return {"error": "start et end sont requis"}
+    if dataset == "consommation":
+        kind, key = "consommation", None
+    elif dataset == "production":
+        kind, key = "production", args.get("filiere")
+        if not key:
+            return {"error": "filiere requise pour dataset=production"}
+    elif dataset == "echanges":
+        kind, key = "echange", args.get("pays")
+        if not key:
+            return {"error": "pays requis pour dataset=echanges"}
+    else:
+        return {"error": f"dataset {dataset} inconnu"}
+
+    by = args.get("by", "type_jour")
+    df = services.get_courbe_by_day_type(kind, start, end, key=key, by=by)
+    return {
+        "unit": "MW",
+        "energy_unit": "MWh/jour",
+        "by": by,
+        "rows": [
+            {k: (round(v, 1) if isinstance(v, float) else v) for k, v in r.items()}
+            for r in df.to_dict(orient="records")
+        ],
+    }
+
+
 def _tool_get_peak(args: dict) -> dict:
     dataset = args["dataset"]
     direction = args.get("direction", "max")
@@ -642,20 +736,173 @@ _DISPATCH = {
     "get_parc": _tool_get_parc,
     "get_dashboard": lambda args: _tool_get_dashboard(),
     "get_calendrier": _tool_get_calendrier,
+    "get_stats_type_jour": _tool_get_stats_type_jour,
     "get_peak": _tool_get_peak,
 }
 
 
+TOOL_SECONDS = metrics.Histogram(
+    "elecstat_chat_tool_seconds",
+    "Durée d'exécution des tools du chatbot.",
+    ["tool"],
+)
+MISTRAL_SECONDS = metrics.Histogram(
+    "elecstat_chat_mistral_seconds",
+    "Durée des appels chat.complete (retries et attentes incluses).",
+)
+MISTRAL_RETRIES = metrics.Counter(
+    "elecstat_chat_mistral_retries_total",
+    "Réponses 429 de l'API Mistral suivies d'un retry.",
+)
+MISTRAL_BUSY = metrics.Counter(
+    "elecstat_chat_mistral_busy_total",
+    "429 persistants après retries (ChatBusyError).",
+)
+
+
+TOOL_CACHE = metrics.Counter(
+    "elecstat_chat_tool_cache_total",
+    "Lookups du cache des résultats de tools, par résultat.",
+    ["result"],
+)
+
+# Fichiers Parquet lus par chaque tool : leurs ETags entrent dans la clé du
+# cache des résultats (nouvel ETL → nouvelle clé). Un tool absent n'est pas
+# mis en cache ; () = ne lit aucune donnée (calendrier).
+_TOOL_DATASETS = {
+    "get_overview": ("puissance", "production", "echanges"),
+    "get_consommation": ("puissance", "annuel", "mensuel"),
+    "get_production": ("production", "production_annuel", "production_mensuel"),
+    "get_echanges": ("echanges",),
+    "get_echanges_energie": ("echanges", "echanges_annuel_imp_exp"),
+    "get_parc": ("rte_eolien_production", "rte_eolien_facteur_charge",
+                 "rte_solaire_production", "rte_solaire_facteur_charge"),
+    "get_dashboard": ("puissance", "production", "production_annuel"),
+    "get_calendrier": (),
+    "get_stats_type_jour": ("puissance", "production", "echanges"),
+    "get_peak": ("puissance", "production", "echanges"),
+}
+
+
+class _ToolResultCache:
+    """LRU des résultats de tools (JSON), borné en octets par process.
+
+    Les questions reviennent (« pic de consommation cette année », « mix
+    annuel ») : un résultat déjà calculé sur la même version des données est
+    resservi sans DuckDB — seul l'appel Mistral reste sur le chemin critique.
+    Budget : CHAT_TOOL_CACHE_MB (0 = désactivé).
+    """
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple, tuple[str, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, value: str) -> None:
+        budget = getattr(settings, "CHAT_TOOL_CACHE_MB", 16) * 1024 * 1024
+        size = len(value.encode())
+        if size > budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            while self._entries and self._size + size > budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+            self._entries[key] = (value, size)
+            self._size += size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_tool_cache = _ToolResultCache()
+
+
+def _tool_cache_key(name: str, args: dict) -> tuple | None:
+    """(tool, args normalisés, version des fichiers lus) ; None = pas de cache."""
+    datasets = _TOOL_DATASETS.get(name)
+    if datasets is None or not isinstance(args, dict):
+        return None
+    normalized = json.dumps({k: v for k, v in args.items() if v is not None},
+                            sort_keys=True, separators=(",", ":"), default=str)
+    return name, normalized, data_cache.data_version(datasets)
+
+
 def _run_tool(name: str, args: dict) -> str:
+    # Nom choisi par le modèle : on borne la cardinalité du label.
+    label = name if name in _DISPATCH else "inconnu"
+    key = _tool_cache_key(name, args)
+    if key is not None:
+        cached = _tool_cache.get(key)
+        TOOL_CACHE.inc(result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
     try:
-        result = _DISPATCH[name](args)
+        # Budget DuckDB propre à chaque tool : l'échéance de la requête HTTP
+        # inclurait les appels Mistral qui précèdent. Un dépassement revient au
+        # modèle comme une erreur de tool (QueryTimeout), pas comme un 504.
+        with TOOL_SECONDS.time(tool=label), \
+                deadlines.deadline(getattr(settings, "DUCKDB_QUERY_TIMEOUT", 0)):
+            result = _DISPATCH[name](args)
     except KeyError:
         result = {"error": f"tool {name} inconnu"}
     except ValueError as e:
         result = {"error": str(e)}
     except Exception as e:  # noqa: BLE001
         result = {"error": f"{type(e).__name__}: {e}"}
-    return json.dumps(result, default=str, ensure_ascii=False)
+    result_json = json.dumps(result, default=str, ensure_ascii=False)
+    # Les erreurs (échéance, paramètres) ne sont pas figées : le prochain
+    # appel retente le calcul.
+    if key is not None and not (isinstance(result, dict) and "error" in result):
+        _tool_cache.put(key, result_json)
+    return result_json
+
+
+# Les tool calls d'un même message assistant sont indépendants (le modèle les
+# émet tous avant d'en voir un résultat) : on les exécute en parallèle, sur
+# un pool borné par process. La mémoire DuckDB reste bornée par l'admission
+# (admission.py) — au-delà du budget, les tools attendent leur tour.
+_tool_executor: ThreadPoolExecutor | None = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "CHAT_TOOL_THREADS", 4),
+                    thread_name_prefix="chat-tools",
+                )
+    return _tool_executor
+
+
+async def _run_tools(calls: list[tuple[str, dict]]) -> list[str]:
+    """Exécute les `(nom, args)` d'un message, résultats dans l'ordre des appels.
+
+    Durée du lot ≈ celle du tool le plus lent. Chaque appel tourne dans le
+    pool, sur une copie du contexte courant (priorité d'admission, journal des
+    requêtes) : la boucle asyncio n'est jamais bloquée par DuckDB.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_tool_executor()
+    return list(await asyncio.gather(*(
+        loop.run_in_executor(executor, contextvars.copy_context().run, _run_tool, name, args)
+        for name, args in calls
+    )))
 
 
 # ---------- main loop ---------- #
@@ -670,7 +917,7 @@ class ChatBusyError(Exception):
 # les conversations partagent la même clé. Un 429 est donc un événement normal
 # à absorber par retry, pas une anomalie.
 _RETRY_ATTEMPTS = 3          # appels au total par requête API (1 + 2 retries)
-_RETRY_MAX_SLEEP = 8.0       # borne le Retry-After serveur (worker bloqué pendant l'attente)
+_RETRY_MAX_SLEEP = 8.0       # borne le Retry-After serveur (attente de l'utilisateur)
 
 
 def _content_to_text(content) -> str:
@@ -714,15 +961,99 @@ def _prune_tool_history(messages: list[dict]) -> list[dict]:
     return pruned
 
 
+def _parse_tool_args(raw_args) -> dict:
+    try:
+        return json.loads(raw_args) if isinstance(raw_args, str) else (raw_args or {})
+    except json.JSONDecodeError:
+        return {}
+
+
+async def _append_tool_calls(history: list[dict], content: str, calls: list[dict]) -> None:
+    """Ajoute à `history` le message assistant porteur de `calls` ({id, name,
+    arguments}) puis exécute les tools et ajoute leurs résultats, dans l'ordre.
+
+    On stocke des dicts JSON-sérialisables (l'historique fait l'aller-retour
+    avec le frontend) — pas les objets SDK.
+    """
+    history.append({
+        "role": "assistant",
+        "content": content,
+        "tool_calls": [
+            {
+                "id": c["id"],
+                "type": "function",
+                "function": {"name": c["name"], "arguments": c["arguments"]},
+            }
+            for c in calls
+        ],
+    })
+    results = await _run_tools([(c["name"], _parse_tool_args(c["arguments"])) for c in calls])
+    for c, result_json in zip(calls, results):
+        history.append({
+            "role": "tool",
+            "name": c["name"],
+            "tool_call_id": c["id"],
+            "content": result_json,
+        })
+
+
+def _merge_tool_call_deltas(calls: list[dict], deltas) -> None:
+    """Accumule les tool calls d'un flux Mistral (un appel peut arriver en
+    plusieurs fragments : le premier porte l'id, les suivants la suite des
+    arguments)."""
+    for tc in deltas:
+        tc_id = getattr(tc, "id", None)
+        if not isinstance(tc_id, str) or tc_id == "null":
+            tc_id = None
+        if not calls or (tc_id and tc_id != calls[-1]["id"]):
+            calls.append({"id": tc_id or f"call_{len(calls)}", "name": "", "arguments": ""})
+        call = calls[-1]
+        fn = tc.function
+        call["name"] = call["name"] or (fn.name or "")
+        if isinstance(fn.arguments, str):
+            call["arguments"] += fn.arguments
+        elif fn.arguments:
+            call["arguments"] = json.dumps(fn.arguments, ensure_ascii=False)
+
+
+# Tokens (estimés) renvoyés à chaque appel quoi qu'il arrive : prompt système
+# statique + schémas des tools. Multiplié par le nombre d'appels du tour, il
+# dit ce que coûte la boucle tool-use elle-même (log `chat usage`).
+_PREFIX_TOKENS = (
+    len(SYSTEM_PROMPT) + len(json.dumps(MISTRAL_TOOLS, ensure_ascii=False, separators=(",", ":")))
+) // _CHARS_PER_TOKEN
+
+
+def _new_usage() -> dict:
+    return {"input": 0, "output": 0, "calls": 0, "prefix": 0}
+
+
+def _add_usage(totals: dict, usage) -> None:
+    """Cumule l'usage d'un appel Mistral dans les totaux du tour."""
+    totals["input"] += getattr(usage, "prompt_tokens", 0) or 0
+    totals["output"] += getattr(usage, "completion_tokens", 0) or 0
+    totals["calls"] += 1
+    totals["prefix"] += _PREFIX_TOKENS
+
+
 class ChatService:
-    def __init__(self):
-        if not settings.MISTRAL_API_KEY:
-            raise RuntimeError("MISTRAL_API_KEY non configurée")
-        self.client = Mistral(api_key=settings.MISTRAL_API_KEY)
+    def __init__(self, client=None):
+        """`client` : client Mistral de substitution (fake_mistral.FakeMistral
+        pour les benchmarks hors ligne) ; par défaut, le vrai client."""
+        if client is None:
+            if not settings.MISTRAL_API_KEY:
+                raise RuntimeError("MISTRAL_API_KEY non configurée")
+            client = Mistral(api_key=settings.MISTRAL_API_KEY)
+        self.client = client
         self.model = settings.CHAT_MODEL
         self.max_turns = settings.CHAT_MAX_TURNS
+        # Secondes passées par étape, cumulées sur la vie du service (un par
+        # requête) : tools (durée des lots parallèles) et attentes entre
+        # retries 429. Lues par bench_chat ; les histogrammes, eux, agrègent
+        # toutes les conversations.
+        self.stage_seconds = {"tools": 0.0, "retry_wait": 0.0}
 
-    def _complete(self, history: list[dict]):
+    async def _complete(self, history: list[dict], summary: str = ""):
         """Un appel `chat.complete`, avec retries sur 429 uniquement.
 
         Backoff exponentiel (1 s, 2 s), `Retry-After` honoré s'il est plus
@@ -730,12 +1061,24 @@ class ChatService:
         la vue traduit en HTTP 429 avec un message actionnable. Toute autre
         erreur remonte telle quelle (un retry ne la réparerait pas).
         """
+        with MISTRAL_SECONDS.time():
+            return await self._with_retries(self.client.chat.complete_async, history, summary)
+
+    async def _stream(self, history: list[dict], summary: str = ""):
+        """Ouvre un flux `chat.stream` (mêmes retries que `_complete` : un 429
+        arrive à l'ouverture, avant le premier événement)."""
+        return await self._with_retries(self.client.chat.stream_async, history, summary)
+
+    async def _with_retries(self, call, history: list[dict], summary: str = ""):
+        system = _build_system_prompt()
+        if summary:
+            system += _SUMMARY_PREFIX + summary
         for attempt in range(_RETRY_ATTEMPTS):
             try:
-                return self.client.chat.complete(
+                return await call(
                     model=self.model,
                     max_tokens=2048,
-                    messages=[{"role": "system", "content": _build_system_prompt()}] + history,
+                    messages=[{"role": "system", "content": system}] + history,
                     tools=MISTRAL_TOOLS,
                     tool_choice="auto",
                 )
@@ -743,20 +1086,35 @@ class ChatService:
                 if getattr(e, "status_code", None) != 429:
                     raise
                 if attempt == _RETRY_ATTEMPTS - 1:
+                    MISTRAL_BUSY.inc()
                     raise ChatBusyError("API Mistral saturée (429 persistant)") from e
+                MISTRAL_RETRIES.inc()
                 headers = getattr(e, "headers", None) or {}
                 try:
                     retry_after = float(headers.get("retry-after", ""))
                 except (TypeError, ValueError):
                     retry_after = 0.0
-                time.sleep(min(max(retry_after, float(2 ** attempt)), _RETRY_MAX_SLEEP))
-
-    def run(self, messages: list[dict]) -> dict:
+                wait = min(max(retry_after, float(2 ** attempt)), _RETRY_MAX_SLEEP)
+                self.stage_seconds["retry_wait"] += wait
+                await asyncio.sleep(wait)
+
+    async def _append_tool_calls(self, history: list[dict], content: str, calls: list[dict]) -> None:
+        start = time.monotonic()
+        try:
+            await _append_tool_calls(history, content, calls)
+        finally:
+            self.stage_seconds["tools"] += time.monotonic() - start
+
+    async def run(self, messages: list[dict], summary: str = "") -> dict:
         """Run the tool-use loop until the model produces a final text answer.
 
         `messages` is the OpenAI/Mistral-format history: [{role, content, ...}, ...]
         (without the system message — il est ajouté à chaque appel).
+        `summary` : résumé des tours anciens (cf. compact_history), ajouté au
+        prompt système.
         Returns {"reply": str, "messages": updated_history, "usage": {...}}.
+        `usage` : tokens d'entrée/sortie du tour, nombre d'appels Mistral et
+        part estimée du préfixe fixe renvoyé à chaque appel (`prefix`).
         """
         # L'historique entrant est élagué de la plomberie tool-use des tours
         # passés (y compris celle d'historiques stockés avant ce changement) :
@@ -764,13 +1122,11 @@ class ChatService:
         history = _prune_tool_history(messages)
         if len(history) > self.max_turns * 2:
             return {"error": f"Conversation trop longue (>{self.max_turns} tours)"}
-        usage_totals = {"input": 0, "output": 0}
+        usage_totals = _new_usage()
 
         for _ in range(10):  # hard cap on tool-use iterations
-            resp = self._complete(history)
-            usage = resp.usage
-            usage_totals["input"] += getattr(usage, "prompt_tokens", 0) or 0
-            usage_totals["output"] += getattr(usage, "completion_tokens", 0) or 0
+            resp = await self._complete(history, summary)
+            _add_usage(usage_totals, resp.usage)
 
             msg = resp.choices[0].message
             tool_calls = msg.tool_calls or []
@@ -783,36 +1139,137 @@ class ChatService:
                 # déjà servi, seule la réponse texte reste utile.
                 return {"reply": text, "messages": _prune_tool_history(history), "usage": usage_totals}
 
-            # On stocke des dicts JSON-sérialisables (l'historique fait l'aller-retour
-            # avec le frontend) — pas les objets SDK.
-            history.append({
-                "role": "assistant",
-                "content": _content_to_text(msg.content),
-                "tool_calls": [
-                    {
-                        "id": tc.id,
-                        "type": "function",
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments,
-                        },
-                    }
-                    for tc in tool_calls
-                ],
-            })
-
-            for tc in tool_calls:
-                raw_args = tc.function.arguments
-                try:
-                    args = json.loads(raw_args) if isinstance(raw_args, str) else (raw_args or {})
-                except json.JSONDecodeError:
-                    args = {}
-                result_json = _run_tool(tc.function.name, args)
-                history.append({
-                    "role": "tool",
-                    "name": tc.function.name,
-                    "tool_call_id": tc.id,
-                    "content": result_json,
-                })
+            await self._append_tool_calls(history, _content_to_text(msg.content), [
+                {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+                for tc in tool_calls
+            ])
 
         return {"error": "Trop d'itérations tool-use", "messages": _prune_tool_history(history), "usage": usage_totals}
+
+    async def run_stream(self, messages: list[dict], summary: str = ""):
+        """Variante streamée de `run` : générateur asynchrone d'événements
+        `(type, données)`.
+
+        - `("token", {"text"})` : fragment de texte, au fil de la génération ;
+        - `("tool", {"name", "status"})` : tool lancé (`start`) puis terminé
+          (`done`) ;
+        - en dernier, `("done", {"reply", "messages", "usage"})` (comme `run`)
+          ou `("error", {"error"})`.
+
+        Le texte émis avant des tool calls (« Je consulte… ») n'entre pas dans
+        `reply`. ChatBusyError et les erreurs Mistral remontent telles quelles.
+        """
+        history = _prune_tool_history(messages)
+        if len(history) > self.max_turns * 2:
+            yield "error", {"error": f"Conversation trop longue (>{self.max_turns} tours)"}
+            return
+        usage_totals = _new_usage()
+
+        for _ in range(10):  # hard cap on tool-use iterations
+            parts, calls = [], []
+            start = time.monotonic()
+            async with await self._stream(history, summary) as stream:
+                async for event in stream:
+                    chunk = event.data
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        _add_usage(usage_totals, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    # Champs absents du delta : sentinelle UNSET du SDK, pas None.
+                    content = getattr(delta, "content", None)
+                    text = _content_to_text(content) if isinstance(content, (str, list)) else ""
+                    if text:
+                        parts.append(text)
+                        yield "token", {"text": text}
+                    deltas = getattr(delta, "tool_calls", None)
+                    if isinstance(deltas, list):
+                        _merge_tool_call_deltas(calls, deltas)
+            MISTRAL_SECONDS.observe(time.monotonic() - start)
+
+            text = "".join(parts)
+            if not calls:
+                history.append({"role": "assistant", "content": text})
+                yield "done", {"reply": text, "messages": _prune_tool_history(history),
+                               "usage": usage_totals}
+                return
+
+            for c in calls:
+                yield "tool", {"name": c["name"], "status": "start"}
+            await self._append_tool_calls(history, text, calls)
+            for c in calls:
+                yield "tool", {"name": c["name"], "status": "done"}
+
+        yield "error", {"error": "Trop d'itérations tool-use"}
+
+    async def summarize(self, summary: str, messages: list[dict]) -> str:
+        """Condense `messages` (et le résumé précédent) en un court résumé.
+
+        Un seul appel, sans tools ni retries : en cas d'échec, l'appelant
+        abandonne simplement les tours anciens.
+        """
+        lines = [f"{m['role']} : {_content_to_text(m.get('content'))}" for m in messages]
+        prompt = _SUMMARY_INSTRUCTIONS
+        if summary:
+            prompt += f"\n\nRésumé précédent :\n{summary}"
+        prompt += "\n\nÉchanges à résumer :\n" + "\n".join(lines)
+        with MISTRAL_SECONDS.time():
+            resp = await self.client.chat.complete_async(
+                model=self.model,
+                max_tokens=_SUMMARY_MAX_TOKENS,
+                messages=[{"role": "user", "content": prompt}],
+            )
+        return _content_to_text(resp.choices[0].message.content).strip()
+
+
+# ---------- historique borné (conversations stockées côté serveur) ---------- #
+
+_SUMMARY_PREFIX = "\n\nRésumé des échanges précédents de cette conversation :\n"
+_SUMMARY_INSTRUCTIONS = (
+    "Résume en français, en 150 mots au plus, les échanges ci-dessous entre un "
+    "utilisateur et un assistant de données électriques : questions posées, "
+    "périodes et séries étudiées, chiffres clés des réponses. Réponds uniquement "
+    "par le résumé."
+)
+_SUMMARY_MAX_TOKENS = 400
+
+
+def _estimate_tokens(messages: list[dict]) -> int:
+    """Estimation grossière (~4 caractères par token), sans tokenizer."""
+    return sum(len(_content_to_text(m.get("content"))) for m in messages) // _CHARS_PER_TOKEN
+
+
+async def compact_history(service: ChatService, summary: str,
+                    messages: list[dict]) -> tuple[str, list[dict]]:
+    """Borne l'historique stocké d'une conversation : `(résumé, messages)`.
+
+    Au-delà de CHAT_HISTORY_TOKEN_BUDGET tokens estimés, les tours les plus
+    anciens sont condensés dans le résumé ; les plus récents (la moitié du
+    budget, au moins le dernier échange) restent tels quels. Le fil conservé
+    commence toujours par un message utilisateur. Si le résumé échoue, les
+    tours anciens sont abandonnés : la taille reste bornée.
+    """
+    budget = getattr(settings, "CHAT_HISTORY_TOKEN_BUDGET", 0)
+    if not budget or _estimate_tokens(messages) <= budget:
+        return summary, messages
+
+    keep, used = len(messages), 0
+    while keep > 0:
+        cost = _estimate_tokens([messages[keep - 1]])
+        if used + cost > budget // 2:
+            break
+        used += cost
+        keep -= 1
+    last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=0)
+    keep = min(keep, last_user)
+    while keep < last_user and messages[keep].get("role") != "user":
+        keep += 1
+    if keep == 0:
+        return summary, messages
+
+    try:
+        summary = await service.summarize(summary, messages[:keep])
+    except Exception:  # noqa: BLE001
+        logger.warning("Résumé de conversation impossible, tours anciens abandonnés", exc_info=True)
+    return summary, messages[keep:]
@@ -1,18 +1,35 @@
 """
 Chatbot views — authenticated only.
+
+Conversations are stored server-side (models.Conversation): the client posts
+only its new message and the conversation id. The full-history payload
+(`messages`) is still accepted from older clients.
+
+The message views are async: under ASGI (config/asgi.py), a turn waiting on
+Mistral holds no thread. This relies on a fully async middleware chain:
+WhiteNoise, which is sync-only, is kept out of it (see static_asgi.py). Short
+database steps (request checks, saving the turn) borrow a thread through
+sync_to_async. Under WSGI the views still work, each request keeping its
+thread as before.
 """
+import asyncio
 import json
 import logging
 import os
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.http import require_GET, require_POST
 
 from .auth import get_user_from_session
-from .chat import ChatBusyError, ChatService
+from .chat import ChatBusyError, ChatService, compact_history
+from .models import Conversation
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +47,8 @@ MAX_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", "100000"))
 CHAT_RATE_HOURLY = int(os.getenv("CHAT_RATE_HOURLY", "50"))
 CHAT_RATE_DAILY = int(os.getenv("CHAT_RATE_DAILY", "100"))
 
+BUSY_MESSAGE = "Le service est très sollicité en ce moment — réessaie dans quelques instants."
+
 
 def _rate_limit_exceeded(user_key: str) -> bool:
     """Compte les messages de `user_key` sur deux fenêtres (heure / jour).
@@ -59,35 +78,91 @@ def chat_page(request):
     return render(request, "consommation/chat.html")
 
 
-@require_POST
-def chat_message(request):
+def _load_conversation(user_sub: str, conversation_id):
+    """Conversation de l'utilisateur, nouvelle (non enregistrée) sans id,
+    None si introuvable, expirée ou appartenant à un autre utilisateur."""
+    if not conversation_id:
+        # Purge opportuniste : une requête par nouvelle conversation suffit.
+        Conversation.purge_expired(settings.CHAT_CONVERSATION_TTL)
+        return Conversation(user_sub=user_sub)
+    try:
+        return Conversation.objects.get(pk=conversation_id, user_sub=user_sub)
+    except (Conversation.DoesNotExist, ValidationError, ValueError):
+        return None
+
+
+async def _save_turn(service: ChatService, conversation: Conversation, messages: list) -> None:
+    """Enregistre l'historique élagué du tour, résumé au-delà du budget."""
+    conversation.summary, conversation.messages = await compact_history(
+        service, conversation.summary, messages
+    )
+    await conversation.asave()
+
+
+async def _compact_saved(service: ChatService, conversation: Conversation) -> None:
+    """Compacte l'historique déjà enregistré (réponse streamée, cf. _sse_events)."""
+    summary, messages = await compact_history(
+        service, conversation.summary, conversation.messages
+    )
+    if messages is not conversation.messages:  # au-delà du budget
+        conversation.summary, conversation.messages = summary, messages
+        await conversation.asave()
+
+
+def _error(message: str, status: int):
+    return None, None, None, JsonResponse({"error": message}, status=status)
+
+
+def _check_chat_request(request):
+    """Contrôles communs à chat_message et chat_stream.
+
+    Retourne (user, messages, conversation, None), ou (None, None, None,
+    réponse d'erreur). `conversation` est None pour un client qui envoie
+    encore tout l'historique. Synchrone (session, base, cache) : les vues
+    l'appellent via sync_to_async.
+    """
     user = get_user_from_session(request)
     if user is None:
-        return JsonResponse({"error": "Authentification requise"}, status=401)
+        return _error("Authentification requise", 401)
 
     # Borne la taille AVANT de parser : un body démesuré = un coût de tokens
     # démesuré. Content-Length peut mentir/manquer, donc on se fie à len(body).
     if len(request.body) > MAX_BODY_BYTES:
-        return JsonResponse(
-            {"error": "Conversation trop volumineuse — réinitialise-la."},
-            status=413,
-        )
+        return _error("Conversation trop volumineuse — réinitialise-la.", 413)
 
     try:
         body = json.loads(request.body)
     except json.JSONDecodeError:
-        return JsonResponse({"error": "JSON invalide"}, status=400)
+        return _error("JSON invalide", 400)
+    if not isinstance(body, dict):
+        return _error("JSON invalide", 400)
 
-    messages = body.get("messages")
-    if not isinstance(messages, list) or not messages:
-        return JsonResponse({"error": "messages requis (liste non vide)"}, status=400)
+    user_key = user.get("sub") or user.get("email", "?")
+    conversation = None
+    if "message" in body:
+        text = body["message"]
+        if not isinstance(text, str) or not text.strip():
+            return _error("message requis (texte non vide)", 400)
+        conversation = _load_conversation(user_key, body.get("conversation_id"))
+        if conversation is None:
+            return _error("Conversation introuvable ou expirée — réinitialise-la.", 404)
+        messages = conversation.messages + [{"role": "user", "content": text}]
+    else:
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not messages:
+            return _error("messages requis (liste non vide)", 400)
 
-    if _rate_limit_exceeded(user.get("sub") or user.get("email", "?")):
+    if _rate_limit_exceeded(user_key):
         logger.warning("Chat rate-limit dépassé user=%s", user.get("email"))
-        return JsonResponse(
-            {"error": "Limite de messages atteinte — réessaie plus tard."},
-            status=429,
-        )
+        return _error("Limite de messages atteinte — réessaie plus tard.", 429)
+    return user, messages, conversation, None
+
+
+@require_POST
+async def chat_message(request):
+    user, messages, conversation, error = await sync_to_async(_check_chat_request)(request)
+    if error is not None:
+        return error
 
     try:
         service = ChatService()
@@ -95,14 +170,11 @@ def chat_message(request):
         return JsonResponse({"error": str(e)}, status=503)
 
     try:
-        result = service.run(messages)
+        result = await service.run(messages, conversation.summary if conversation else "")
     except ChatBusyError:
         # 429 Mistral persistant malgré les retries : transitoire, pas interne.
         logger.warning("Chat busy (429 Mistral persistant) user=%s", user.get("email"))
-        return JsonResponse(
-            {"error": "Le service est très sollicité en ce moment — réessaie dans quelques instants."},
-            status=429,
-        )
+        return JsonResponse({"error": BUSY_MESSAGE}, status=429)
     except Exception as e:  # noqa: BLE001
         logger.exception("Chat error")
         return JsonResponse({"error": f"Erreur interne: {type(e).__name__}"}, status=500)
@@ -110,8 +182,89 @@ def chat_message(request):
     if "error" in result:
         return JsonResponse(result, status=400)
 
-    logger.info("chat usage user=%s usage=%s", request.session.get("user", {}).get("email"), result["usage"])
+    logger.info("chat usage user=%s usage=%s", user.get("email"), result["usage"])
+    if conversation is not None:
+        await _save_turn(service, conversation, result["messages"])
+        return JsonResponse({"reply": result["reply"], "conversation_id": str(conversation.id)})
     return JsonResponse({
         "reply": result["reply"],
         "messages": result["messages"],
     })
+
+
+# ---------- réponse streamée (Server-Sent Events) ---------- #
+# Même contrat que chat_message, mais la réponse part au fil de l'eau : jetons
+# Mistral dès leur génération, et progression des tools (« get_peak en
+# cours… »). Le navigateur affiche le début de la réponse en ~1 s au lieu
+# d'attendre la fin de la boucle tool-use. Les erreurs survenues une fois le
+# flux ouvert arrivent en événement `error` (le statut HTTP est déjà parti).
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_events(service: ChatService, messages: list, conversation, email):
+    summary = conversation.summary if conversation is not None else ""
+    try:
+        async for event, data in service.run_stream(messages, summary):
+            if event != "done":
+                yield _sse(event, data)
+                continue
+            logger.info("chat usage user=%s usage=%s", email, data["usage"])
+            if conversation is None:
+                yield _sse(event, {"reply": data["reply"], "messages": data["messages"]})
+                continue
+            # Tour brut enregistré avant `done` : un client qui ferme le flux
+            # dès la réponse (GeneratorExit au yield) ne perd pas le tour.
+            # Le résumé, lent, vient après ; s'il est perdu, le tour suivant
+            # compacte l'historique (compact_history part du stocké).
+            conversation.messages = data["messages"]
+            await conversation.asave()
+            yield _sse(event, {"reply": data["reply"], "conversation_id": str(conversation.id)})
+            await _compact_saved(service, conversation)
+    except ChatBusyError:
+        logger.warning("Chat busy (429 Mistral persistant) user=%s", email)
+        yield _sse("error", {"error": BUSY_MESSAGE})
+    except Exception as e:  # noqa: BLE001
+        logger.exception("Chat error")
+        yield _sse("error", {"error": f"Erreur interne: {type(e).__name__}"})
+
+
+def _iterate_blocking(events):
+    """Itérateur synchrone sur le générateur asynchrone `events` (WSGI).
+
+    Une boucle dédiée pour tout le flux : le client HTTP asynchrone de
+    Mistral reste attaché à la même boucle d'un événement à l'autre. Django
+    consommerait sinon l'itérateur asynchrone en entier avant l'envoi.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(events.aclose())
+        loop.close()
+
+
+@require_POST
+async def chat_stream(request):
+    user, messages, conversation, error = await sync_to_async(_check_chat_request)(request)
+    if error is not None:
+        return error
+
+    try:
+        service = ChatService()
+    except RuntimeError as e:
+        return JsonResponse({"error": str(e)}, status=503)
+
+    events = _sse_events(service, messages, conversation, user.get("email"))
+    if not isinstance(request, ASGIRequest):
+        events = _iterate_blocking(events)
+    response = StreamingHttpResponse(events, content_type="text/event-stream; charset=utf-8")
+    response["Cache-Control"] = "no-cache"
+    # nginx (frontal Clever Cloud) bufferise sinon la réponse entière.
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -11,6 +11,7 @@ Usage in services:
     path = data_cache.get_local_path('puissance')   # str, local or s3:// fallback
 """
 
+import hashlib
 import json
 import logging
 import os
@@ -21,8 +22,29 @@ from pathlib import Path
 import boto3
 from django.conf import settings
 
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
+REFRESH_SECONDS = metrics.Histogram(
+    "elecstat_parquet_refresh_seconds",
+    "Duration of a refresh_all() pass per key (ETag check + download if changed).",
+    ["key"],
+)
+ETAG_CHANGES = metrics.Counter(
+    "elecstat_parquet_etag_changes_total",
+    "Parquet (re-)downloads triggered by a new or missing local copy.",
+    ["key"],
+)
+REFRESH_ERRORS = metrics.Counter(
+    "elecstat_parquet_refresh_errors_total",
+    "Failed S3 ETag checks/downloads (stale copy or s3:// fallback served).",
+    ["key"],
+)
+
+# Callbacks run after each refresh_all() pass (see add_refresh_listener)
+_refresh_listeners: list = []
+
 # Per-key locks to avoid concurrent downloads of the same file
 _locks: dict[str, threading.Lock] = {}
 _locks_lock = threading.Lock()
@@ -156,10 +178,12 @@ def ensure_local_parquet(key: str, force_check: bool = False) -> str:
                 return str(local)
 
             # New data: re-download
+            ETAG_CHANGES.inc(key=key)
             _download(key)
             return str(local)
 
         except Exception:
+            REFRESH_ERRORS.inc(key=key)
             logger.exception("Failed to check/download parquet for key=%s", key)
             # Graceful degradation: local stale copy or original S3 URL
             return str(local) if local.exists() else s3_path
@@ -180,6 +204,28 @@ def get_etag(key: str) -> str:
     return _read_meta(key).get("etag", "")
 
 
+def get_updated_at(key: str) -> float | None:
+    """Local download time of *key* (epoch seconds), None if not cached locally."""
+    if not settings.S3_PATHS.get(key):
+        return None
+    try:
+        return _local_path(key).stat().st_mtime
+    except OSError:
+        return None
+
+
+def data_version(keys=None) -> str:
+    """
+    Short fingerprint of the ETags of *keys* (default: every configured file
+    in settings.S3_PATHS). Changes as soon as one of the files is refreshed;
+    local reads only, like get_etag. Unconfigured keys are ignored.
+    """
+    if keys is None:
+        keys = sorted(settings.S3_PATHS)
+    raw = "|".join(f"{k}={get_etag(k)}" for k in keys if settings.S3_PATHS.get(k))
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
 def refresh_all(force: bool = False, force_check: bool = False) -> None:
     """
     Download/refresh all parquet files declared in settings.S3_PATHS.
@@ -196,6 +242,23 @@ def refresh_all(force: bool = False, force_check: bool = False) -> None:
                     meta_file.unlink()
                 if local.exists():
                     local.unlink()
-            ensure_local_parquet(key, force_check=force_check)
+            with REFRESH_SECONDS.time(key=key):
+                ensure_local_parquet(key, force_check=force_check)
         except Exception:
             logger.exception("refresh_all failed for key=%s", key)
+
+    for listener in list(_refresh_listeners):
+        try:
+            listener()
+        except Exception:
+            logger.exception("Refresh listener %r failed", listener)
+
+
+def add_refresh_listener(callback) -> None:
+    """
+    Register *callback* (no arguments) to run after every refresh_all() pass,
+    in the refreshing thread — e.g. to rebuild a precomputed response while
+    no request is waiting for it.
+    """
+    if callback not in _refresh_listeners:
+        _refresh_listeners.append(callback)
@@ -0,0 +1,301 @@
+"""
+Échéances des requêtes DuckDB et annulation sur déconnexion du client.
+
+Sans garde-fou, une requête pathologique (fenêtre glissante sur 10 ans dans
+get_echanges_annual_detail, p.ex.) tourne jusqu'au timeout Gunicorn (60 s) :
+le worker est tué, et avec lui les 3 autres threads et leurs requêtes.
+
+`DeadlineMiddleware` pose une échéance par requête HTTP (DUCKDB_QUERY_TIMEOUT
+secondes) dans une contextvar. `get_duckdb_connection` enregistre chaque
+connexion auprès d'un thread de surveillance unique qui appelle
+`conn.interrupt()` quand l'échéance est dépassée ou que le client a fermé la
+connexion (sous Gunicorn, test non bloquant du socket). L'interruption
+remonte en QueryTimeout / ClientDisconnected, traduites en 504 / 503 propres
+par le middleware (et par l'API, cf. api.py) — le worker survit.
+
+Réponses streamées (exports NDJSON/CSV, SSE du chat) : le corps est produit
+après le retour de la vue. Le middleware enveloppe donc `streaming_content` :
+chaque lot est produit sous la même échéance et le même test de déconnexion
+que la vue. Une interruption à ce stade ne peut plus devenir une 504 (statut
+déjà envoyé) : l'exception remonte au serveur, qui coupe la connexion — le
+client voit un corps tronqué, pas une réponse complète. Les exports ne font
+travailler DuckDB qu'au premier lot (résultat vidé sur disque, cf.
+services.stream_courbe) ; le chat pose sa propre échéance par tool.
+
+Hors requête HTTP (thread de rafraîchissement, commandes de gestion), pas
+d'échéance : rien n'est surveillé. Servi en ASGI (cf. clevercloud/run.sh),
+l'échéance s'applique de même — la contextvar suit le travail délégué au pool
+de l'API (offload.py) — mais la déconnexion n'est pas détectée : pas de
+socket à sonder.
+"""
+import contextvars
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import duckdb
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Période de surveillance : précision de l'échéance et délai de détection
+# d'une déconnexion. Négligeable face aux durées visées (secondes).
+_POLL_INTERVAL = 0.2
+
+INTERRUPTED = metrics.Counter(
+    "elecstat_duckdb_interrupted_total",
+    "Requêtes DuckDB interrompues (échéance dépassée ou client parti).",
+    ["reason"],
+)
+
+
+class QueryTimeout(Exception):
+    """Échéance de la requête HTTP dépassée pendant un travail DuckDB."""
+
+
+class ClientDisconnected(Exception):
+    """Le client a fermé la connexion : le résultat ne sera jamais lu."""
+
+
+# (échéance monotone ou None, test de déconnexion ou None)
+_current: contextvars.ContextVar[tuple] = contextvars.ContextVar(
+    "duckdb_deadline", default=(None, None)
+)
+
+
+@contextmanager
+def deadline(seconds: float | None, disconnected=None):
+    """Pose une échéance (et un test de déconnexion) pour le travail du bloc.
+
+    Remplace l'échéance courante : le chatbot s'en sert pour donner à chaque
+    tool un budget propre, indépendant de la durée des appels Mistral. Sans
+    `disconnected`, le test de déconnexion courant est conservé.
+    """
+    expires = time.monotonic() + seconds if seconds else None
+    if disconnected is None:
+        disconnected = _current.get()[1]
+    with _until(expires, disconnected):
+        yield
+
+
+@contextmanager
+def _until(expires, disconnected):
+    token = _current.set((expires, disconnected))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def remaining() -> float | None:
+    """Secondes restantes avant l'échéance courante (None = pas d'échéance)."""
+    expires, _ = _current.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+# ---------- surveillance ---------- #
+
+class _Watch:
+    __slots__ = ("conn", "expires", "disconnected", "reason")
+
+    def __init__(self, conn, expires, disconnected):
+        self.conn = conn
+        self.expires = expires
+        self.disconnected = disconnected
+        self.reason = None
+
+
+_watches: set[_Watch] = set()
+_cond = threading.Condition()
+_thread: threading.Thread | None = None
+
+
+def _watchdog() -> None:
+    while True:
+        with _cond:
+            while not _watches:
+                _cond.wait()
+            pending = list(_watches)
+        now = time.monotonic()
+        for w in pending:
+            if not w.reason:
+                if w.expires is not None and now >= w.expires:
+                    w.reason = "timeout"
+                elif w.disconnected is not None and w.disconnected():
+                    w.reason = "disconnect"
+            # Ré-émis à chaque tour : un interrupt tombé entre deux requêtes
+            # de la même fonction est sans effet sur la suivante.
+            if w.reason:
+                try:
+                    w.conn.interrupt()
+                except Exception:  # connexion fermée entre-temps
+                    pass
+        time.sleep(_POLL_INTERVAL)
+
+
+def _ensure_watchdog() -> None:
+    global _thread
+    with _cond:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_watchdog, name="duckdb-deadlines", daemon=True)
+            _thread.start()
+
+
+@contextmanager
+def watch(conn):
+    """Surveille `conn` pendant le bloc selon l'échéance courante.
+
+    Lève QueryTimeout d'emblée si l'échéance est déjà passée (fonctions de
+    service qui enchaînent plusieurs requêtes), et traduit l'interruption
+    DuckDB en QueryTimeout / ClientDisconnected.
+    """
+    expires, disconnected = _current.get()
+    if expires is None and disconnected is None:
+        yield
+        return
+    if expires is not None and time.monotonic() >= expires:
+        INTERRUPTED.inc(reason="timeout")
+        raise QueryTimeout("échéance dépassée avant la requête DuckDB")
+
+    w = _Watch(conn, expires, disconnected)
+    _ensure_watchdog()
+    with _cond:
+        _watches.add(w)
+        _cond.notify()
+    try:
+        yield
+    except duckdb.InterruptException as e:
+        if w.reason == "disconnect":
+            INTERRUPTED.inc(reason="disconnect")
+            raise ClientDisconnected("client déconnecté") from e
+        INTERRUPTED.inc(reason="timeout")
+        raise QueryTimeout("requête DuckDB interrompue (échéance dépassée)") from e
+    finally:
+        with _cond:
+            _watches.discard(w)
+
+
+# ---------- middleware ---------- #
+
+def _socket_closed_check(request):
+    """Test de déconnexion sur le socket Gunicorn (None hors Gunicorn)."""
+    sock = request.META.get("gunicorn.socket")
+    if sock is None:
+        return None
+
+    def closed() -> bool:
+        try:
+            # Lecture non bloquante sans consommer : b'' = fin de flux (FIN reçu).
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except BlockingIOError:
+            return False
+        except (ConnectionError, ValueError):
+            return True
+        except OSError:
+            return False
+
+    return closed
+
+
+class DeadlineMiddleware:
+    """Échéance DuckDB par requête, et réponses 504/503 en cas d'interruption
+    ou de refus d'admission (cf. admission.py). Synchrone ou asynchrone selon
+    la chaîne (WSGI / ASGI)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timeout = getattr(settings, "DUCKDB_QUERY_TIMEOUT", 0)
+        if not timeout:
+            return self.get_response(request)
+        expires = time.monotonic() + timeout
+        disconnected = _socket_closed_check(request)
+        with _until(expires, disconnected):
+            response = self.get_response(request)
+        return _guard_stream(response, expires, disconnected)
+
+    async def __acall__(self, request):
+        timeout = getattr(settings, "DUCKDB_QUERY_TIMEOUT", 0)
+        if not timeout:
+            return await self.get_response(request)
+        expires = time.monotonic() + timeout
+        with _until(expires, None):
+            response = await self.get_response(request)
+        return _guard_stream(response, expires, None)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, QueryTimeout):
+            logger.warning("Échéance DuckDB dépassée : %s", request.path)
+            return _error_response(request, 504, "Le calcul a pris trop de temps. Essayez une période plus courte.")
+        if isinstance(exception, ClientDisconnected):
+            logger.info("Client déconnecté, requête DuckDB annulée : %s", request.path)
+            return _error_response(request, 503, "Requête annulée.")
+        # Import local : admission dépend de ce module (échéance de la file).
+        from .admission import Overloaded
+        if isinstance(exception, Overloaded):
+            logger.warning("Admission DuckDB refusée (budget saturé) : %s", request.path)
+            response = _error_response(request, 503, "Service momentanément saturé, réessayez dans quelques secondes.")
+            response["Retry-After"] = "5"
+            return response
+        return None
+
+
+def _guard_stream(response, expires, disconnected):
+    """Garde l'échéance active pendant la production du corps streamé.
+
+    Les fichiers (FileResponse) ne touchent pas DuckDB : laissés tels quels
+    pour conserver wsgi.file_wrapper (sendfile).
+    """
+    if not response.streaming or isinstance(response, FileResponse):
+        return response
+    content = response.streaming_content
+    if response.is_async:
+        response.streaming_content = _aguarded(content, expires, disconnected)
+    else:
+        response.streaming_content = _guarded(content, expires, disconnected)
+    return response
+
+
+def _guarded(content, expires, disconnected):
+    # Contextvar posée lot par lot, jamais entre deux `yield` : le lecteur
+    # (serveur) ne doit pas hériter de l'échéance.
+    it = iter(content)
+    end = object()
+    while True:
+        with _until(expires, disconnected):
+            chunk = next(it, end)
+        if chunk is end:
+            return
+        yield chunk
+
+
+async def _aguarded(content, expires, disconnected):
+    it = aiter(content)
+    while True:
+        with _until(expires, disconnected):
+            try:
+                chunk = await anext(it)
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def _error_response(request, status, message):
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return JsonResponse({"error": message}, status=status)
+    return HttpResponse(message, status=status, content_type="text/plain; charset=utf-8")
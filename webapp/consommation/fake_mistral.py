@@ -0,0 +1,151 @@
+"""
+Offline stand-in for the Mistral client, for benchmarks and tests.
+
+FakeMistral implements the subset of the SDK that ChatService uses
+(`chat.complete_async`, `chat.stream_async`, async only) and replays a
+scripted conversation: each API call consumes the next step, either a list
+of tool calls `[(name, args), ...]` or the final text answer. Latency and
+429 rate limits are simulated; token usage is estimated from the request
+size (~4 characters per token, tool schemas included), so prompt changes
+show up in the numbers.
+
+Usage:
+    client = FakeMistral([[("get_overview", {})], "Voici la réponse."], latency=0.3)
+    result = await ChatService(client=client).run(messages)
+    client.calls, client.seconds, client.rejected
+
+    with stub_tools():        # canned tool results, no S3/DuckDB needed
+        ...
+"""
+
+import asyncio
+import json
+import random
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import httpx
+
+from . import chat
+
+_CHARS_PER_TOKEN = 4
+_STREAM_CHUNK_WORDS = 3
+
+
+def _tokens(obj) -> int:
+    return len(json.dumps(obj, default=str, ensure_ascii=False)) // _CHARS_PER_TOKEN
+
+
+class FakeMistral:
+    """Scripted client. `latency` is the time to the first event of each call
+    (the rest of a stream follows `chunk_delay` apart); `rate_429` the
+    probability that a call is rejected with HTTP 429 (seeded, reproducible).
+    """
+
+    def __init__(self, steps, latency=0.0, chunk_delay=0.0, rate_429=0.0, seed=0):
+        self.steps = list(steps)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+        self.calls = 0          # accepted calls
+        self.rejected = 0       # simulated 429s
+        self.seconds = 0.0      # simulated time spent "in Mistral"
+        self.usage = {"input": 0, "output": 0}
+        self.chat = SimpleNamespace(complete_async=self._complete, stream_async=self._stream)
+
+    async def _wait(self, seconds):
+        if seconds:
+            self.seconds += seconds
+            await asyncio.sleep(seconds)
+
+    async def _admit(self, kwargs):
+        """Latency, 429 draw, then the next scripted step and its usage."""
+        await self._wait(self.latency)
+        if self.rate_429 and self.random.random() < self.rate_429:
+            self.rejected += 1
+            raise chat.MistralError(
+                "API error occurred", httpx.Response(429, headers={"Retry-After": "0"})
+            )
+        self.calls += 1
+        step = self.steps.pop(0) if self.steps else "(fin du scénario)"
+        prompt = _tokens(kwargs.get("messages", [])) + _tokens(kwargs.get("tools", []))
+        completion = _tokens(step)
+        self.usage["input"] += prompt
+        self.usage["output"] += completion
+        usage = SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion)
+        return step, usage
+
+    def _tool_calls(self, step):
+        return [
+            SimpleNamespace(
+                id=f"call_{self.calls}_{i}", index=i,
+                function=SimpleNamespace(name=name, arguments=json.dumps(args)),
+            )
+            for i, (name, args) in enumerate(step)
+        ]
+
+    async def _complete(self, **kwargs):
+        step, usage = await self._admit(kwargs)
+        text, calls = (step, None) if isinstance(step, str) else ("", self._tool_calls(step))
+        message = SimpleNamespace(content=text, tool_calls=calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    async def _stream(self, **kwargs):
+        step, usage = await self._admit(kwargs)
+        if isinstance(step, str):
+            words = step.split(" ")
+            deltas = [
+                SimpleNamespace(content=" ".join(words[i:i + _STREAM_CHUNK_WORDS])
+                                + (" " if i + _STREAM_CHUNK_WORDS < len(words) else ""),
+                                tool_calls=None)
+                for i in range(0, len(words), _STREAM_CHUNK_WORDS)
+            ]
+        else:
+            deltas = [SimpleNamespace(content=None, tool_calls=self._tool_calls(step))]
+        return _FakeStream(self, deltas, usage)
+
+
+class _FakeStream:
+    """Async context manager and iterator of stream events (`event.data`)."""
+
+    def __init__(self, client, deltas, usage):
+        self.client = client
+        self.deltas = deltas
+        self.usage = usage
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        for i, delta in enumerate(self.deltas):
+            if i:
+                await self.client._wait(self.client.chunk_delay)
+            last = i == len(self.deltas) - 1
+            yield SimpleNamespace(data=SimpleNamespace(
+                choices=[SimpleNamespace(delta=delta)],
+                usage=self.usage if last else None,
+            ))
+
+
+@contextmanager
+def stub_tools(payload=None):
+    """Replace every chat tool by a canned result (default: a small series),
+    to time the conversation loop without S3/DuckDB. Not thread-safe: for
+    benchmarks and tests only."""
+    canned = payload or {
+        "unit": "MW", "rows_total": 3,
+        "data": [{"date": f"2024-01-0{i}", "value": 50_000.0 + i} for i in range(1, 4)],
+    }
+    saved = dict(chat._DISPATCH)
+    for name in saved:
+        chat._DISPATCH[name] = lambda args, _canned=canned: _canned
+    chat._tool_cache.clear()
+    try:
+        yield
+    finally:
+        chat._DISPATCH.update(saved)
+        chat._tool_cache.clear()
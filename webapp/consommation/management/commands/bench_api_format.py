@@ -0,0 +1,62 @@
+"""
+Management command: benchmark the API courbe serialization paths.
+
+Compares, on a synthetic consumption curve (no S3/Parquet needed), the default
+`rows` path (list of dicts + Ninja schema validation + JSON) with the
+`format=columns` path (NumPy arrays encoded directly).
+
+Usage:
+    python manage.py bench_api_format             # one year at 15 min (~35 000 rows)
+    python manage.py bench_api_format --rows 100000 --repeat 10
+"""
+
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from ninja.renderers import JSONRenderer
+
+from consommation import api
+
+
+def _best_of(repeat, func):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rows vs columns JSON serialization of the API courbe endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=366 * 96, help='Number of rows (default: 1 year at 15 min).')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the best time is kept.')
+
+    def handle(self, *args, **options):
+        n = options['rows']
+        df = pd.DataFrame({
+            'date_heure': pd.date_range('2024-01-01', periods=n, freq='15min'),
+            'consommation': np.random.default_rng(0).normal(50000, 8000, n).round(1),
+            'source': 'Données Consolidées',
+        })
+        df.loc[::500, 'consommation'] = np.nan  # a few gaps, as in real data
+        meta = {'count': n, 'debut': date(2024, 1, 1), 'fin': date(2024, 12, 31)}
+        renderer = JSONRenderer()
+
+        def rows_path():
+            payload = api.CourbeConsoOut.model_validate({**meta, 'data': api._records(df)})
+            return renderer.render(None, payload.model_dump(), response_status=200)
+
+        def columns_path():
+            return api._columns_response({**meta, 'unite': 'MW'}, df).content
+
+        encoder = 'orjson' if api.orjson is not None else 'json (stdlib fallback)'
+        self.stdout.write(f"{n} rows, best of {options['repeat']}, encoder: {encoder}")
+        for name, func in (('rows', rows_path), ('columns', columns_path)):
+            seconds, body = _best_of(options['repeat'], func)
+            self.stdout.write(f"  {name:<8} {seconds * 1000:8.1f} ms  {len(body) / 1024:9.0f} KiB")
@@ -0,0 +1,138 @@
+"""
+Management command: benchmark the chat tool-use loop without the Mistral API.
+
+Runs a corpus of typical questions through ChatService.run (or run_stream)
+against FakeMistral, which replays each question's scripted tool calls with
+the configured latency and 429 rate. Tools run for real (S3/DuckDB data
+needed) unless --stub-tools is given. Reports, per question: Mistral calls,
+simulated 429s, time in Mistral (simulated), in tools (wall time of each
+parallel batch), in 429 backoff, the rest of the turn (loop overhead,
+serialisation), time to first token (--stream), and estimated input/output
+tokens. Stage times come from ChatService.stage_seconds, per turn, so they
+stay exact under --concurrency.
+
+Usage:
+    python manage.py bench_chat --stub-tools                  # loop overhead only
+    python manage.py bench_chat --latency 0.8 --rate-429 0.1   # real tools, slow API
+    python manage.py bench_chat --stream --concurrency 20 --runs 3
+"""
+
+import asyncio
+import statistics
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+
+from consommation.chat import ChatService
+from consommation.fake_mistral import FakeMistral, stub_tools
+
+# Questions typiques et la séquence d'appels qu'y fait le modèle.
+CORPUS = [
+    ("Quelle a été la consommation hier ?", [
+        [("get_overview", {})],
+        [("get_consommation", {"granularity": "raw", "start": "2024-12-30", "end": "2024-12-31"})],
+        "Hier, la consommation a varié entre 52 et 71 GW, avec un pic à 19 h.",
+    ]),
+    ("Production nucléaire mensuelle en 2023 ?", [
+        [("get_production", {"filiere": "nucleaire", "granularity": "monthly"})],
+        "En 2023, la production nucléaire mensuelle a oscillé entre 22 et 35 TWh.",
+    ]),
+    ("Compare l'éolien et le solaire en juillet 2024.", [
+        [("get_production", {"filiere": "eolien", "granularity": "daily",
+                             "start": "2024-07-01", "end": "2024-07-31"}),
+         ("get_production", {"filiere": "solaire", "granularity": "daily",
+                             "start": "2024-07-01", "end": "2024-07-31"})],
+        "En juillet 2024, le solaire a dépassé l'éolien en moyenne journalière.",
+    ]),
+    ("Quel a été le pic de consommation en 2024 ?", [
+        [("get_peak", {"dataset": "consommation", "start": "2024-01-01", "end": "2024-12-31", "n": 3})],
+        "Le pic de 2024 a atteint 83 GW, un soir de janvier.",
+    ]),
+    ("Solde des échanges avec l'Espagne sur dix ans ?", [
+        [("get_echanges", {"pays": "ech_comm_espagne", "granularity": "weekly",
+                           "start": "2015-01-01", "end": "2024-12-31"})],
+        [("get_echanges_energie", {"granularity": "annual", "start": "2015-01-01",
+                                   "end": "2024-12-31", "pays": "ech_comm_espagne"})],
+        "Sur dix ans, la France est restée exportatrice nette vers l'Espagne.",
+    ]),
+]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:8.0f}"
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the chat tool-use loop against a scripted, offline Mistral stand-in.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=1, help='Passes over the corpus.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Conversations in flight at once.')
+        parser.add_argument('--latency', type=float, default=0.5, help='Seconds to first event of each Mistral call.')
+        parser.add_argument('--chunk-delay', type=float, default=0.02, help='Seconds between streamed chunks.')
+        parser.add_argument('--rate-429', type=float, default=0.0, help='Probability that a Mistral call gets a 429.')
+        parser.add_argument('--stream', action='store_true', help='Use run_stream (adds time to first token).')
+        parser.add_argument('--stub-tools', action='store_true', help='Canned tool results (no S3/DuckDB).')
+
+    def handle(self, *args, **options):
+        with stub_tools() if options['stub_tools'] else nullcontext():
+            results = asyncio.run(self._bench(options))
+
+        self.stdout.write(
+            f"{'question':<50} {'calls':>5} {'429':>4} {'total ms':>9} {'mistral':>8} "
+            f"{'tools':>8} {'backoff':>8} {'other':>8} {'1st tok':>8} {'tok in':>7} {'tok out':>7}"
+        )
+        for r in results:
+            first = _ms(r['first_token']) if r['first_token'] is not None else f"{'-':>8}"
+            other = r['total'] - r['mistral'] - r['tools'] - r['retry_wait']
+            self.stdout.write(
+                f"{r['question'][:50]:<50} {r['calls']:>5} {r['rejected']:>4} {_ms(r['total']):>9} "
+                f"{_ms(r['mistral'])} {_ms(r['tools'])} {_ms(r['retry_wait'])} {_ms(other)} {first} "
+                f"{r['usage']['input']:>7} {r['usage']['output']:>7}"
+            )
+        totals = [r['total'] for r in results]
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{len(results)} turns — p50 {_ms(_percentile(totals, 0.5)).strip()} ms, "
+            f"p95 {_ms(_percentile(totals, 0.95)).strip()} ms, "
+            f"tokens in {sum(r['usage']['input'] for r in results)}, "
+            f"out {sum(r['usage']['output'] for r in results)}, "
+            f"mean Mistral share {statistics.mean(r['mistral'] / r['total'] for r in results if r['total']):.0%}, "
+            f"tools {statistics.mean(r['tools'] / r['total'] for r in results if r['total']):.0%}"
+        ))
+
+    async def _bench(self, options):
+        semaphore = asyncio.Semaphore(max(1, options['concurrency']))
+        jobs = [
+            self._turn(question, steps, options, semaphore, seed=run * len(CORPUS) + i)
+            for run in range(options['runs'])
+            for i, (question, steps) in enumerate(CORPUS)
+        ]
+        return await asyncio.gather(*jobs)
+
+    async def _turn(self, question, steps, options, semaphore, seed):
+        client = FakeMistral(steps, latency=options['latency'], chunk_delay=options['chunk_delay'],
+                             rate_429=options['rate_429'], seed=seed)
+        service = ChatService(client=client)
+        messages = [{"role": "user", "content": question}]
+        first_token = None
+        async with semaphore:
+            start = time.perf_counter()
+            if options['stream']:
+                async for event, _data in service.run_stream(messages):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+            else:
+                await service.run(messages)
+            total = time.perf_counter() - start
+        return {
+            'question': question, 'calls': client.calls, 'rejected': client.rejected,
+            'total': total, 'mistral': client.seconds, 'first_token': first_token,
+            'tools': service.stage_seconds['tools'], 'retry_wait': service.stage_seconds['retry_wait'],
+            'usage': client.usage,
+        }
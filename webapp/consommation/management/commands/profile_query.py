@@ -0,0 +1,91 @@
+"""
+Management command: run one service function under DuckDB profiling.
+
+Each query's JSON plan (operator timings, rows scanned) is appended to
+DUCKDB_PROFILE_LOG and summarised on stdout.
+
+Usage:
+    python manage.py profile_query get_dashboard_data
+    python manage.py profile_query get_puissance_data 2024-01-01 2024-12-31
+    python manage.py profile_query get_echanges_data 2024-01-01 2024-03-31 --arg pays=total
+"""
+
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from consommation import query_log, services
+
+
+def _coerce(value):
+    """CLI string → date (YYYY-MM-DD), int, or unchanged string."""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _operators(node, depth=0):
+    """Yield (depth, name, timing, cardinality) for each operator of the plan tree."""
+    for child in node.get("children", []):
+        yield (
+            depth,
+            child.get("operator_name") or child.get("operator_type") or "?",
+            child.get("operator_timing", 0.0),
+            child.get("operator_cardinality", 0),
+        )
+        yield from _operators(child, depth + 1)
+
+
+class Command(BaseCommand):
+    help = 'Profile the DuckDB queries of a service function (JSON plans appended to DUCKDB_PROFILE_LOG).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('function', help='Name of a function in consommation/services.py.')
+        parser.add_argument('params', nargs='*', help='Positional arguments (dates as YYYY-MM-DD).')
+        parser.add_argument(
+            '--arg', action='append', default=[], metavar='NAME=VALUE',
+            help='Keyword argument, repeatable.',
+        )
+
+    def handle(self, *args, **options):
+        name = options['function']
+        func = getattr(services, name, None)
+        if name.startswith('_') or not callable(func):
+            raise CommandError(f"Unknown service function: {name}")
+
+        kwargs = {}
+        for item in options['arg']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Expected NAME=VALUE, got {item!r}")
+            kwargs[key] = _coerce(value)
+
+        log_path = settings.DUCKDB_PROFILE_LOG
+        with open(log_path, 'a'):
+            pass
+        with open(log_path) as f:
+            f.seek(0, 2)
+            offset = f.tell()
+
+        with query_log.profiling():
+            result = func(*[_coerce(p) for p in options['params']], **kwargs)
+
+        self.stdout.write(f"{name} -> {type(result).__name__}"
+                          + (f" ({len(result)} rows)" if hasattr(result, '__len__') else ''))
+        with open(log_path) as f:
+            f.seek(offset)
+            entries = [json.loads(line) for line in f if line.strip()]
+        for entry in entries:
+            self.stdout.write(self.style.NOTICE(
+                f"\n{entry['elapsed_ms']} ms, {entry['rows']} rows — {entry['sql'][:160]}"
+            ))
+            for depth, op, timing, card in _operators(entry['profile']):
+                self.stdout.write(f"  {'  ' * depth}{op:<24} {timing * 1000:9.1f} ms {card:>12} rows")
+        self.stdout.write(self.style.SUCCESS(f"\n{len(entries)} query profile(s) appended to {log_path}"))
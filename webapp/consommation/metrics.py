@@ -0,0 +1,316 @@
+"""
+Métriques applicatives au format texte Prometheus (endpoint `/metrics`).
+
+Compteurs et histogrammes minimalistes, sans dépendance externe : chaque
+process tient ses valeurs en mémoire et en publie un instantané JSON dans
+METRICS_DIR (un fichier par worker, écriture atomique, au plus une fois par
+METRICS_FLUSH_INTERVAL). Le worker qui sert `/metrics` additionne tous les
+instantanés : le résultat couvre l'ensemble des workers Gunicorn, quel que
+soit celui qui reçoit le scrape.
+
+Les instantanés des workers morts (recyclage max-requests) sont repliés dans
+un fichier d'archive au moment du rendu : les compteurs restent monotones sans
+accumuler un fichier par worker recyclé. METRICS_DIR vit dans /tmp, vidé à
+chaque déploiement — Prometheus gère la remise à zéro des compteurs.
+
+Usage :
+    from . import metrics
+    HITS = metrics.Counter('elecstat_cache_requests_total', 'Lookups de cache.', ['cache', 'result'])
+    HITS.inc(cache='charts', result='hit')
+
+    DUREE = metrics.Histogram('elecstat_duckdb_query_seconds', 'Durée.', ['function'])
+    with DUREE.time(function='get_date_range'):
+        ...
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bornes (secondes) adaptées à nos latences : du cache LocMem (ms) aux requêtes
+# DuckDB lourdes et aux tours de chat (dizaines de secondes).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ARCHIVE_NAME = "_archive.json"
+
+_registry: dict[str, "_Metric"] = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()  # un seul écrivain du fichier .tmp à la fois
+_last_flush = 0.0
+_flush_timer: threading.Timer | None = None
+# pid + instant de démarrage : un pid réutilisé par un nouveau worker n'écrase
+# pas l'instantané (pas encore archivé) de l'ancien.
+_process_id = f"{os.getpid()}-{int(time.time() * 1000)}"
+_process_pid = os.getpid()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        # Re-déclaration (rechargement de module en dev) : la dernière gagne.
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} attend les labels {self.labelnames}, reçu {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _snapshot(self) -> dict:
+        return {
+            "kind": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": [[list(k), v] for k, v in self._values.items()],
+        }
+
+
+class Counter(_Metric):
+    """Compteur monotone (suffixe `_total` par convention Prometheus)."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _schedule_flush()
+
+
+class Histogram(_Metric):
+    """Histogramme à bornes fixes (compte par bucket, somme et nombre)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+        _schedule_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe la durée (secondes) du bloc, y compris s'il lève."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self) -> dict:
+        snap = super()._snapshot()
+        # Copie des états : la sérialisation se fait hors verrou.
+        snap["samples"] = [[k, {**v, "buckets": list(v["buckets"])}] for k, v in snap["samples"]]
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+
+# ---------- instantanés multi-workers ---------- #
+
+def _metrics_dir() -> Path | None:
+    path = getattr(settings, "METRICS_DIR", "")
+    return Path(path) if path else None
+
+
+def _snapshot_all() -> dict:
+    with _lock:
+        return {name: m._snapshot() for name, m in _registry.items()}
+
+
+def flush() -> None:
+    """Écrit l'instantané de ce process dans METRICS_DIR (atomique).
+
+    Sérialisé : le timer et `/metrics` (collect) peuvent flusher en même
+    temps, et partagent le même fichier temporaire.
+    """
+    global _last_flush
+    directory = _metrics_dir()
+    if directory is None:
+        return
+    with _flush_lock:
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            target = directory / f"{_process_id}.json"
+            tmp = target.with_suffix(".json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(_snapshot_all(), f)
+            tmp.replace(target)  # atomique en POSIX
+            _last_flush = time.monotonic()
+        except OSError:
+            logger.warning("Écriture des métriques impossible dans %s", directory, exc_info=True)
+
+
+def _schedule_flush() -> None:
+    """Programme un flush sur le thread du timer — jamais d'I/O sur le
+    chemin de la requête. Au plus un flush par intervalle, et au plus tard
+    un intervalle après la mise à jour (un worker qui devient inactif publie
+    quand même ses dernières valeurs)."""
+    global _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            return
+        interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+        delay = max(0.0, interval - (time.monotonic() - _last_flush))
+        _flush_timer = threading.Timer(delay, _timer_flush)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _timer_flush() -> None:
+    global _flush_timer
+    with _lock:
+        _flush_timer = None
+    flush()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into: dict, snap: dict) -> None:
+    """Additionne l'instantané `snap` dans l'agrégat `into` (en place)."""
+    for name, metric in snap.items():
+        target = into.setdefault(name, {**metric, "samples": {}})
+        if isinstance(target["samples"], list):
+            target["samples"] = {tuple(k): v for k, v in target["samples"]}
+        for labels, value in metric["samples"]:
+            labels = tuple(labels)
+            current = target["samples"].get(labels)
+            if metric["kind"] == "histogram":
+                if current is None or len(current["buckets"]) != len(value["buckets"]):
+                    # Bornes modifiées entre deux versions : la plus récente gagne.
+                    target["samples"][labels] = {
+                        "buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"],
+                    }
+                else:
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["sum"] += value["sum"]
+                    current["count"] += value["count"]
+            else:
+                target["samples"][labels] = (current or 0.0) + value
+
+
+def _read(path: Path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _freeze(agg: dict) -> dict:
+    """Agrégat (samples en dict) → format instantané (samples en liste)."""
+    return {
+        name: {**m, "samples": [[list(k), v] for k, v in m["samples"].items()]}
+        for name, m in agg.items()
+    }
+
+
+def collect() -> dict:
+    """Agrège les instantanés de tous les workers (vivants et archivés)."""
+    directory = _metrics_dir()
+    if directory is None:
+        agg: dict = {}
+        _merge(agg, _snapshot_all())
+        return agg
+
+    flush()
+    agg = {}
+    with open(directory / ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = directory / _ARCHIVE_NAME
+        archive = _read(archive_path)
+        archive_agg: dict = {}
+        _merge(archive_agg, archive)
+        archived = False
+        for path in directory.glob("*.json"):
+            if path.name == _ARCHIVE_NAME:
+                continue
+            snap = _read(path)
+            pid = int(path.stem.split("-", 1)[0]) if path.stem.split("-", 1)[0].isdigit() else None
+            if pid is not None and pid != _process_pid and not _pid_alive(pid):
+                _merge(archive_agg, snap)
+                path.unlink(missing_ok=True)
+                archived = True
+            else:
+                _merge(agg, snap)
+        if archived:
+            tmp = archive_path.with_suffix(".json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(_freeze(archive_agg), f)
+            tmp.replace(archive_path)
+        _merge(agg, _freeze(archive_agg))
+    return agg
+
+
+# ---------- rendu texte ---------- #
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: tuple = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render() -> str:
+    """Exposition texte Prometheus (version 0.0.4) de l'agrégat multi-workers."""
+    lines = []
+    for name, metric in sorted(collect().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["kind"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(names, labels, (('le', _fmt(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(names, labels, (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{_labels(names, labels)} {_fmt(value['sum'])}")
+                lines.append(f"{name}_count{_labels(names, labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_labels(names, labels)} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Dernier instantané à l'arrêt propre du worker (recyclage max-requests).
+atexit.register(flush)
@@ -0,0 +1,27 @@
+"""Endpoint `/metrics` : exposition Prometheus (cf. consommation/metrics.py).
+
+Interne : protégé par un Bearer statique (METRICS_TOKEN), à renseigner dans
+la config de scrape. Sans token configuré, l'endpoint n'existe pas (404) —
+on ne révèle ni son existence ni les volumes de trafic.
+"""
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+
+from . import metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@require_GET
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    header = request.headers.get('Authorization', '')
+    scheme, _, provided = header.partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(provided.strip(), token):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
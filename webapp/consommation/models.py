@@ -1,4 +1,4 @@
-"""Modèle des clés d'API de l'API publique v1.
+"""Modèles : clés d'API de l'API publique v1, conversations du chatbot.
 
 Une `ApiKey` appartient à un utilisateur (identifié par son `sub` OIDC). On ne
 stocke JAMAIS la clé en clair : seulement son hash SHA-256 (`key_hash`) et un
@@ -11,8 +11,10 @@ trace (audit). Cf. consommation/api_auth.py pour la vérification à chaque requ
 """
 import hashlib
 import secrets
+import uuid
+from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 
@@ -46,6 +48,11 @@ class ApiKey(models.Model):
         if self.revoked_at is None:
             self.revoked_at = timezone.now()
             self.save(update_fields=['revoked_at'])
+            # L'auth garde les identités en cache : effet immédiat malgré tout.
+            # Après le commit seulement : invalidé plus tôt, un autre worker
+            # pourrait remettre en cache la clé encore valide en base.
+            from .api_auth import invalidate_cache
+            transaction.on_commit(invalidate_cache)
 
     @staticmethod
     def generate_raw_key() -> str:
@@ -64,7 +71,39 @@ class ApiKey(models.Model):
         Returns:
             Le nombre de lignes anonymisées.
         """
+        from .api_auth import invalidate_cache
         rows = cls.objects.filter(user_sub=sub)
         rows.filter(revoked_at__isnull=True).update(revoked_at=timezone.now())
+        transaction.on_commit(invalidate_cache)
         pseudo = f"deleted:{hashlib.sha256(sub.encode()).hexdigest()[:12]}"
         return rows.update(user_sub=pseudo, user_email='')
+
+
+class Conversation(models.Model):
+    """Historique d'une conversation du chatbot, conservé côté serveur.
+
+    Le client n'envoie que son nouveau message et l'identifiant de la
+    conversation (UUID : non devinable, et toujours filtré par `user_sub`).
+    `messages` ne garde que les échanges texte (plomberie tool-use élaguée) ;
+    au-delà d'un budget de tokens, les tours les plus anciens sont condensés
+    dans `summary` (cf. chat.compact_history) — requête et prompt restent
+    bornés quelle que soit la longueur de la conversation.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_sub = models.CharField(max_length=255, db_index=True)
+    # Résumé des tours anciens, injecté dans le prompt système.
+    summary = models.TextField(blank=True)
+    messages = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Indexé : purge des conversations inactives (cf. purge_expired).
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.id} ({len(self.messages)} messages)"
+
+    @classmethod
+    def purge_expired(cls, ttl_seconds: int) -> int:
+        """Supprime les conversations inactives depuis plus de `ttl_seconds`."""
+        limit = timezone.now() - timedelta(seconds=ttl_seconds)
+        deleted, _ = cls.objects.filter(updated_at__lt=limit).delete()
+        return deleted
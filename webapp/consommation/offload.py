@@ -0,0 +1,78 @@
+"""
+Exécution du travail bloquant (DuckDB, pandas) hors de la boucle asyncio.
+
+Les endpoints de l'API sont asynchrones : servis par un worker ASGI
+(uvicorn, cf. clevercloud/run.sh), une requête qui attend DuckDB n'occupe
+plus un des 8 threads Gunicorn — la boucle continue de servir les autres
+requêtes (chaîne de middlewares asynchrone, sans WhiteNoise : cf.
+static_asgi.py). Le calcul lui-même part dans un pool de threads *borné*
+(API_EXECUTOR_THREADS par worker) : au-delà, les appels attendent leur tour
+au lieu de multiplier les connexions DuckDB (dont la mémoire est par
+ailleurs bornée par admission.py).
+
+Le contexte (contextvars) est propagé : échéance de la requête
+(deadlines.py), priorité d'admission, fonction courante du journal des
+requêtes lentes.
+
+Usage :
+    df = await offload.run(services.get_puissance_data, debut, fin)
+
+    async for chunk in offload.iterate(generateur):   # réponse streamée
+        ...
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "API_EXECUTOR_THREADS", 4),
+                    thread_name_prefix="api-offload",
+                )
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """Exécute `func(*args, **kwargs)` dans le pool borné et attend son résultat."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(ctx.run, func, *args, **kwargs)
+    )
+
+
+async def iterate(iterable):
+    """Itérateur asynchrone sur un itérable bloquant (générateur DuckDB).
+
+    Chaque `next()` s'exécute dans le pool, toujours dans le même Context : un
+    générateur qui pose des contextvars entre deux `yield` (priorité,
+    admission) les retrouve au lot suivant. Le générateur est fermé — et sa
+    connexion DuckDB libérée — si le client part avant la fin.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    ctx = contextvars.copy_context()
+    it = iter(iterable)
+    done = object()
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, ctx.run, next, it, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            await loop.run_in_executor(executor, ctx.run, close)
@@ -0,0 +1,231 @@
+"""
+Journal des requêtes DuckDB lentes et capture du profil d'exécution.
+
+`get_duckdb_connection` enveloppe la connexion dans un proxy qui chronomètre
+chaque requête de l'`execute` jusqu'à la fin du `fetchdf` (DuckDB matérialise
+le résultat à ce moment-là : c'est la durée que paie la vue) — ou jusqu'au
+dernier lot pour `fetch_record_batch` (exports streamés). Le relevé est fait
+aussi quand la requête échoue ou est interrompue (échéance, cf.
+deadlines.py) : ce sont souvent les plus lentes.
+
+- au-delà de DUCKDB_SLOW_QUERY_MS, la requête est journalisée (WARNING) avec
+  la fonction de service appelante, le SQL, les paramètres, le nombre de
+  lignes et l'issue (`status` : ok, interrupted, partial — flux abandonné
+  par le lecteur — ou le type de l'exception) ;
+- en mode profilage (DUCKDB_PROFILE=1, ou ponctuellement via `profiling()`,
+  cf. la commande `profile_query`), DuckDB écrit son plan JSON avec les
+  timings par opérateur ; il est ajouté en une ligne JSON au fichier tournant
+  DUCKDB_PROFILE_LOG. Utile pour repérer les scans complets, p.ex. un filtre
+  `EXTRACT(YEAR FROM date_heure)` qui empêche l'élagage des row groups.
+
+Les deux désactivés (seuil 0, pas de profilage), la connexion brute est
+renvoyée : aucun surcoût.
+"""
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import duckdb
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Fonction de service en cours (posée par services.timed_query) : identifie
+# l'appelant dans les logs sans remonter la pile.
+current_function: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "duckdb_current_function", default="?"
+)
+_profiling_forced: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "duckdb_profiling_forced", default=False
+)
+
+_profile_logger = logging.getLogger("consommation.duckdb_profile")
+_profile_logger.propagate = False
+
+
+@contextmanager
+def profiling():
+    """Active la capture du profil DuckDB pour les requêtes du bloc."""
+    token = _profiling_forced.set(True)
+    try:
+        yield
+    finally:
+        _profiling_forced.reset(token)
+
+
+def _profiling_enabled() -> bool:
+    return _profiling_forced.get() or getattr(settings, "DUCKDB_PROFILE", False)
+
+
+def _slow_threshold() -> float:
+    return getattr(settings, "DUCKDB_SLOW_QUERY_MS", 0) / 1000.0
+
+
+def _profile_log() -> logging.Logger:
+    """Logger du fichier de profils, handler tournant posé au premier usage."""
+    if not _profile_logger.handlers:
+        path = getattr(settings, "DUCKDB_PROFILE_LOG", "/tmp/elecstat_duckdb_profile.log")
+        handler = RotatingFileHandler(path, maxBytes=5 * 1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _profile_logger.addHandler(handler)
+        _profile_logger.setLevel(logging.INFO)
+    return _profile_logger
+
+
+def _compact_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def wrap(conn):
+    """Connexion instrumentée si le journal ou le profilage est actif."""
+    if _slow_threshold() <= 0 and not _profiling_enabled():
+        return conn
+    return LoggedConnection(conn)
+
+
+class LoggedConnection:
+    """Proxy de DuckDBPyConnection : chronomètre `execute(...).fetchdf()`."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._profile_path = None
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, params=None):
+        if _profiling_enabled() and self._profile_path is None:
+            fd, self._profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+            os.close(fd)
+            self._conn.execute("PRAGMA enable_profiling='json'")
+            self._conn.execute(f"SET profiling_output='{self._profile_path}'")
+        start = time.perf_counter()
+        try:
+            if params is None:
+                self._conn.execute(sql)
+            else:
+                self._conn.execute(sql, params)
+        except BaseException as e:
+            self._record(sql, params, start, None, _status(e))
+            raise
+        return _LoggedResult(self, sql, params, start)
+
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            if self._profile_path:
+                try:
+                    os.unlink(self._profile_path)
+                except OSError:
+                    pass
+
+    def _record(self, sql, params, start, rows, status="ok"):
+        elapsed = time.perf_counter() - start
+        function = current_function.get()
+        threshold = _slow_threshold()
+        if threshold > 0 and elapsed >= threshold:
+            logger.warning(
+                "DuckDB lente %.0f ms function=%s status=%s rows=%s params=%r sql=%s",
+                elapsed * 1000, function, status, rows, params, _compact_sql(sql),
+            )
+        # Profil écrit par DuckDB en fin de requête seulement : rien de fiable
+        # pour une requête qui a échoué.
+        if self._profile_path and status == "ok":
+            try:
+                with open(self._profile_path) as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                return
+            _profile_log().info(json.dumps({
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "function": function,
+                "elapsed_ms": round(elapsed * 1000, 1),
+                "rows": rows,
+                "params": params,
+                "sql": _compact_sql(sql),
+                "profile": profile,
+            }, default=str, ensure_ascii=False))
+
+
+class _LoggedResult:
+    """Résultat d'`execute` : le relevé est fait à la matérialisation."""
+
+    def __init__(self, owner: LoggedConnection, sql, params, start):
+        self._owner = owner
+        self._sql = sql
+        self._params = params
+        self._start = start
+
+    def __getattr__(self, name):
+        return getattr(self._owner._conn, name)
+
+    def _fetch(self, method, count, *args):
+        rows, status = None, "ok"
+        try:
+            result = getattr(self._owner._conn, method)(*args)
+            rows = count(result)
+            return result
+        except BaseException as e:
+            status = _status(e)
+            raise
+        finally:
+            self._owner._record(self._sql, self._params, self._start, rows, status)
+
+    def fetchdf(self):
+        return self._fetch("fetchdf", len)
+
+    df = fetchdf
+
+    def fetchall(self):
+        return self._fetch("fetchall", len)
+
+    def fetchone(self):
+        return self._fetch("fetchone", lambda row: int(row is not None))
+
+    def fetch_record_batch(self, rows_per_batch=1_000_000):
+        try:
+            reader = self._owner._conn.fetch_record_batch(rows_per_batch)
+        except BaseException as e:
+            self._owner._record(self._sql, self._params, self._start, None, _status(e))
+            raise
+        return _LoggedBatchReader(self, reader)
+
+
+class _LoggedBatchReader:
+    """RecordBatchReader dont l'itération est chronométrée jusqu'au dernier
+    lot (ou à l'erreur, ou à l'abandon du flux par le lecteur)."""
+
+    def __init__(self, result: _LoggedResult, reader):
+        self._result = result
+        self._reader = reader
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+    def __iter__(self):
+        result = self._result
+        rows, status = 0, "partial"
+        try:
+            for batch in self._reader:
+                rows += batch.num_rows
+                yield batch
+            status = "ok"
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            status = _status(e)
+            raise
+        finally:
+            result._owner._record(result._sql, result._params, result._start, rows, status)
+
+
+def _status(exc: BaseException) -> str:
+    if isinstance(exc, duckdb.InterruptException):
+        return "interrupted"
+    return type(exc).__name__
@@ -1,14 +1,22 @@
 import logging
 import re
+import tempfile
 
 import duckdb
 import pandas as pd
+import pyarrow as pa
 from django.conf import settings
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+from functools import wraps
 
 from .constants import FILIERES, PAYS_ECHANGES
+from . import admission
+from . import calendrier
 from . import data_cache
+from . import deadlines
+from . import metrics
+from . import query_log
 
 logger = logging.getLogger(__name__)
 
@@ -32,13 +40,23 @@ def _validate_s3_credential(value, name):
     return value
 
 
+# memory_limit par connexion (Mo). LIGHT : agrégats pré-calculés et MIN/MAX,
+# dont l'empreinte est minime — ils ne réservent qu'une fraction du budget.
+QUERY_MEMORY_MB = 256
+LIGHT_QUERY_MB = 64
+
+
 @contextmanager
-def get_duckdb_connection(*paths):
+def get_duckdb_connection(*paths, memory_mb=QUERY_MEMORY_MB):
     """
     Creates a DuckDB connection.  Configures S3 access (httpfs + credentials)
     only if any of the supplied *paths* is an s3:// URL — i.e. when the local
     cache is unavailable and we fall back to reading directly from S3.
 
+    memory_mb is both the DuckDB memory_limit and the weight reserved on the
+    worker's admission budget: pass LIGHT_QUERY_MB for small scans (date
+    ranges, pre-aggregated files) so they don't queue behind heavy ones.
+
     Usage:
         path = data_cache.get_local_path('puissance')
         with get_duckdb_connection(path) as conn:
@@ -46,48 +64,93 @@ def get_duckdb_connection(*paths):
     """
     needs_s3 = any(p and isinstance(p, str) and p.startswith("s3://") for p in paths)
 
-    conn = duckdb.connect()
-    try:
-        # Garde-fou multi-workers (XS 1 Go) : borne la RAM par requête, DuckDB
-        # spille sur disque au-delà. threads=2 : 1 vCPU, inutile d'en créer plus.
-        conn.execute("SET memory_limit='256MB'")
-        conn.execute("SET threads=2")
-        if needs_s3:
-            # Validate credentials before using them
-            region = _validate_s3_credential(settings.AWS_CONFIG['region'], 'AWS region')
-            access_key = _validate_s3_credential(settings.AWS_CONFIG['access_key'], 'AWS access key')
-            secret_key = _validate_s3_credential(settings.AWS_CONFIG['secret_key'], 'AWS secret key')
-
-            conn.execute("INSTALL httpfs")
-            conn.execute("LOAD httpfs")
-            # Note: DuckDB's SET doesn't support parameterized queries, so we validate inputs strictly
-            conn.execute(f"SET s3_region='{region}'")
-            conn.execute(f"SET s3_access_key_id='{access_key}'")
-            conn.execute(f"SET s3_secret_access_key='{secret_key}'")
-
-            # Endpoint S3-compatible hors AWS (ex. Scaleway) : hôte sans schéma
-            # pour DuckDB, et style path (le virtual-host est propre à AWS).
-            # Validation positive hôte[:port] — la blocklist de
-            # _validate_s3_credential laisse passer ' et /, dangereux dans un SET.
-            endpoint_url = settings.AWS_CONFIG.get('endpoint_url')
-            if endpoint_url:
-                host = endpoint_url.split('://', 1)[-1].rstrip('/')
-                if not re.fullmatch(r"[A-Za-z0-9.-]+(:\d{1,5})?", host):
-                    raise ValueError(f"Invalid S3 endpoint host: {host!r}")
-                conn.execute(f"SET s3_endpoint='{host}'")
-                conn.execute("SET s3_url_style='path'")
-
-        yield conn
-    finally:
-        conn.close()
+    # Réserve memory_mb sur le budget DuckDB du worker, en file si saturé
+    # (cf. admission.py) : la RAM engagée reste bornée sous forte charge.
+    with admission.admit(memory_mb):
+        conn = duckdb.connect()
+        # Fermer le proxy (et non la connexion brute) : c'est lui qui supprime
+        # le fichier de profil temporaire créé par query_log.
+        wrapped = conn
+        try:
+            # Garde-fou multi-workers (XS 1 Go) : borne la RAM par requête, DuckDB
+            # spille sur disque au-delà. threads=2 : 1 vCPU, inutile d'en créer plus.
+            conn.execute(f"SET memory_limit='{int(memory_mb)}MB'")
+            conn.execute("SET threads=2")
+            if needs_s3:
+                # Validate credentials before using them
+                region = _validate_s3_credential(settings.AWS_CONFIG['region'], 'AWS region')
+                access_key = _validate_s3_credential(settings.AWS_CONFIG['access_key'], 'AWS access key')
+                secret_key = _validate_s3_credential(settings.AWS_CONFIG['secret_key'], 'AWS secret key')
+
+                conn.execute("INSTALL httpfs")
+                conn.execute("LOAD httpfs")
+                # Note: DuckDB's SET doesn't support parameterized queries, so we validate inputs strictly
+                conn.execute(f"SET s3_region='{region}'")
+                conn.execute(f"SET s3_access_key_id='{access_key}'")
+                conn.execute(f"SET s3_secret_access_key='{secret_key}'")
+
+                # Endpoint S3-compatible hors AWS (ex. Scaleway) : hôte sans schéma
+                # pour DuckDB, et style path (le virtual-host est propre à AWS).
+                # Validation positive hôte[:port] — la blocklist de
+                # _validate_s3_credential laisse passer ' et /, dangereux dans un SET.
+                endpoint_url = settings.AWS_CONFIG.get('endpoint_url')
+                if endpoint_url:
+                    host = endpoint_url.split('://', 1)[-1].rstrip('/')
+                    if not re.fullmatch(r"[A-Za-z0-9.-]+(:\d{1,5})?", host):
+                        raise ValueError(f"Invalid S3 endpoint host: {host!r}")
+                    conn.execute(f"SET s3_endpoint='{host}'")
+                    conn.execute("SET s3_url_style='path'")
+
+            # Proxy de journalisation (requêtes lentes / profilage), cf. query_log.py.
+            # Échéance de la requête HTTP surveillée (interrupt), cf. deadlines.py.
+            wrapped = query_log.wrap(conn)
+            with deadlines.watch(conn):
+                yield wrapped
+        finally:
+            wrapped.close()
+
+
+QUERY_SECONDS = metrics.Histogram(
+    'elecstat_duckdb_query_seconds',
+    'Durée des fonctions de service DuckDB (connexion + requêtes + DataFrame).',
+    ['function'],
+)
+QUERY_ERRORS = metrics.Counter(
+    'elecstat_duckdb_query_errors_total',
+    'Fonctions de service DuckDB terminées en exception.',
+    ['function'],
+)
+
+
+def timed_query(func):
+    """
+    Décorateur des fonctions de service qui ouvrent une connexion DuckDB :
+    durée par fonction (histogramme) et nombre d'échecs. Le nom de la fonction
+    est aussi exposé au journal des requêtes lentes (query_log).
+    """
+    name = func.__name__
 
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = query_log.current_function.set(name)
+        try:
+            with QUERY_SECONDS.time(function=name):
+                return func(*args, **kwargs)
+        except Exception:
+            QUERY_ERRORS.inc(function=name)
+            raise
+        finally:
+            query_log.current_function.reset(token)
+    return wrapper
 
+
+@timed_query
 def get_date_range():
     """
     Retrieves the min and max dates from the dataset
     """
     path = data_cache.get_local_path('puissance')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = """
             SELECT MIN(date_heure) as min_date, MAX(date_heure) as max_date
             FROM read_parquet(?);
@@ -100,6 +163,7 @@ def get_date_range():
     return min_date, max_date
 
 
+@timed_query
 def get_puissance_data(start_date, end_date):
     """
     Loads power data for a date range
@@ -124,24 +188,26 @@ def get_puissance_data(start_date, end_date):
     return result
 
 
+@timed_query
 def get_annual_data():
     """
     Loads annual data
     """
     path = data_cache.get_local_path('annuel')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = "SELECT * FROM read_parquet(?)"
         df = conn.execute(query, [path]).fetchdf()
     return df
 
 
+@timed_query
 def get_monthly_data():
     """
     Loads monthly data
     Aggregates by year_month to handle multiple sources (Consolidated/Real-Time)
     """
     path = data_cache.get_local_path('mensuel')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = "SELECT * FROM read_parquet(?)"
         df = conn.execute(query, [path]).fetchdf()
     # Aggregate by year_month to sum values from different sources
@@ -149,12 +215,13 @@ def get_monthly_data():
     return df
 
 
+@timed_query
 def get_production_date_range():
     """
     Retrieves the min and max dates from the production dataset
     """
     path = data_cache.get_local_path('production')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = """
             SELECT MIN(date_heure) as min_date, MAX(date_heure) as max_date
             FROM read_parquet(?);
@@ -167,6 +234,20 @@ def get_production_date_range():
     return min_date, max_date
 
 
+@timed_query
+def get_dataset_stats(key):
+    """
+    Row count and local update time (epoch seconds, None if unknown) of a
+    dataset. Read from the Parquet footer only — no data page is scanned.
+    """
+    path = data_cache.get_local_path(key)
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
+        rows = conn.execute(
+            "SELECT SUM(num_rows) FROM parquet_file_metadata(?)", [path]
+        ).fetchone()[0]
+    return int(rows or 0), data_cache.get_updated_at(key)
+
+
 def get_production_filieres():
     """
     Returns the list of available production sectors (filières)
@@ -185,6 +266,7 @@ def get_production_filieres():
     return filieres
 
 
+@timed_query
 def get_production_data(start_date, end_date, filiere='nucleaire'):
     """
     Loads production data for a date range and specific sector
@@ -224,6 +306,7 @@ def get_production_data(start_date, end_date, filiere='nucleaire'):
     return result
 
 
+@timed_query
 def get_production_data_multi(start_date, end_date, filieres):
     """
     Loads production data for a date range and several sectors (filières).
@@ -268,6 +351,7 @@ def get_production_data_multi(start_date, end_date, filieres):
     return result
 
 
+@timed_query
 def get_consommation_peaks(start_date, end_date, n=5, direction='max'):
     """
     Top-N peaks (or troughs) of consumption with their exact datetime.
@@ -296,6 +380,7 @@ def get_consommation_peaks(start_date, end_date, n=5, direction='max'):
         ).fetchdf()
 
 
+@timed_query
 def get_production_peaks(filiere, start_date, end_date, n=5, direction='max'):
     """Top-N peaks (or troughs) of production for a given filière."""
     if direction not in ('max', 'min'):
@@ -323,6 +408,7 @@ def get_production_peaks(filiere, start_date, end_date, n=5, direction='max'):
         ).fetchdf()
 
 
+@timed_query
 def get_echanges_peaks(pays, start_date, end_date, n=5, direction='max'):
     """Top-N peaks (or troughs) of cross-border exchanges for a given country."""
     if direction not in ('max', 'min'):
@@ -350,23 +436,25 @@ def get_echanges_peaks(pays, start_date, end_date, n=5, direction='max'):
         ).fetchdf()
 
 
+@timed_query
 def get_production_annual_data():
     """
     Loads annual production data aggregated by sector from S3
     """
     path = data_cache.get_local_path('production_annuel')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = "SELECT * FROM read_parquet(?)"
         result = conn.execute(query, [path]).fetchdf()
     return result
 
 
+@timed_query
 def get_production_monthly_data():
     """
     Loads monthly production data aggregated by sector from S3
     """
     path = data_cache.get_local_path('production_mensuel')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = "SELECT * FROM read_parquet(?)"
         result = conn.execute(query, [path]).fetchdf()
     return result
@@ -388,12 +476,13 @@ def get_echanges_pays_commerciaux():
     return {k: v for k, v in get_echanges_pays().items() if k != 'ech_physiques'}
 
 
+@timed_query
 def get_echanges_date_range():
     """
     Retrieves the min and max dates from the echanges dataset
     """
     path = data_cache.get_local_path('echanges')
-    with get_duckdb_connection(path) as conn:
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
         query = """
             SELECT MIN(date_heure) as min_date, MAX(date_heure) as max_date
             FROM read_parquet(?);
@@ -406,6 +495,7 @@ def get_echanges_date_range():
     return min_date, max_date
 
 
+@timed_query
 def get_echanges_data(start_date, end_date, pays='ech_physiques'):
     """
     Loads exchange data for a date range and specific country
@@ -450,6 +540,7 @@ def get_echanges_data(start_date, end_date, pays='ech_physiques'):
     return result
 
 
+@timed_query
 def get_echanges_data_multi(start_date, end_date, pays_list):
     """
     Loads exchange data for a date range and several commercial borders.
@@ -495,6 +586,370 @@ def get_echanges_data_multi(start_date, end_date, pays_list):
     return result
 
 
+
+@timed_query
+def get_series_multi(start_date, end_date, consommation=False, filieres=(), pays_list=()):
+    """
+    Several power series for the same window, aligned on date_heure.
+
+    One query per Parquet file, projecting only the requested columns (the
+    whole production file is read once for all filières). Duplicate
+    timestamps (overlap between data sources) are averaged, as in the energy
+    functions. Returns a wide DataFrame: date_heure then one column per series
+    named 'consommation', 'production:<filiere>' and 'echange:<pays>' (pays
+    may be 'total'); timestamps missing in one file are left NULL.
+    """
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+
+    # Validate before opening any connection (column names are interpolated)
+    valid_filieres = get_production_filieres()
+    for filiere in filieres:
+        if filiere not in valid_filieres:
+            raise ValueError(f"Filière invalide. Choisissez parmi: {', '.join(valid_filieres)}")
+    valid_pays = get_echanges_pays()
+    commercial = list(get_echanges_pays_commerciaux().keys())
+    for pays in pays_list:
+        if pays != 'total' and pays not in valid_pays:
+            raise ValueError(f"Pays invalide. Choisissez parmi: total, {', '.join(valid_pays)}")
+    if not (consommation or filieres or pays_list):
+        raise ValueError("Au moins une série doit être demandée.")
+
+    # (clé data_cache, [(expression SQL, nom de colonne)])
+    projections = []
+    if consommation:
+        projections.append(('puissance', [("consommation", "consommation")]))
+    if filieres:
+        projections.append(('production', [(f, f"production:{f}") for f in filieres]))
+    if pays_list:
+        exprs = []
+        for pays in pays_list:
+            if pays == 'total':
+                expr = "(" + " + ".join(f"COALESCE({c}, 0)" for c in commercial) + ")"
+            else:
+                expr = pays
+            exprs.append((expr, f"echange:{pays}"))
+        projections.append(('echanges', exprs))
+
+    paths = {key: data_cache.get_local_path(key) for key, _ in projections}
+    frames = []
+    with get_duckdb_connection(*paths.values()) as conn:
+        for key, exprs in projections:
+            cols = ", ".join(f'AVG({expr}) AS "{name}"' for expr, name in exprs)
+            query = f"""
+                SELECT date_heure, {cols}
+                FROM read_parquet(?)
+                WHERE date_heure BETWEEN ? AND ?
+                GROUP BY date_heure
+            """
+            frames.append(conn.execute(
+                query,
+                [paths[key], start_str, f"{end_str} 23:59:59"]
+            ).fetchdf().set_index('date_heure'))
+
+    result = frames[0].join(frames[1:], how='outer') if len(frames) > 1 else frames[0]
+    return result.sort_index().reset_index()
+
+
+# Lignes par lot Arrow en streaming : ~10 000 lignes × 3 colonnes ≈ quelques
+# centaines de Ko en mémoire, quelle que soit la plage demandée.
+STREAM_BATCH_ROWS = 10_000
+
+
+def _courbe_projection(kind, key):
+    """
+    (data_cache key, SQL value expression, column name) of a power curve.
+    Validates kind/key (ValueError) — the expression is interpolated in SQL,
+    but only ever built from our own column dicts.
+    """
+    if kind == 'consommation':
+        return 'puissance', 'consommation', 'consommation'
+    if kind == 'production':
+        valid_filieres = list(get_production_filieres().keys())
+        if key not in valid_filieres:
+            raise ValueError(f"Filière invalide. Choisissez parmi: {', '.join(valid_filieres)}")
+        return 'production', key, 'production'
+    if kind == 'echange':
+        valid_pays = list(get_echanges_pays().keys())
+        if key == 'total':
+            commercial = list(get_echanges_pays_commerciaux().keys())
+            return 'echanges', "(" + " + ".join(f"COALESCE({c}, 0)" for c in commercial) + ")", 'echange'
+        if key in valid_pays:
+            return 'echanges', key, 'echange'
+        raise ValueError(f"Pays invalide. Choisissez parmi: total, {', '.join(valid_pays)}")
+    raise ValueError(f"Courbe inconnue : {kind}")
+
+
+def stream_courbe(kind, start_date, end_date, key=None, batch_rows=STREAM_BATCH_ROWS):
+    """
+    Streams a power curve as pandas DataFrame chunks, for exports whose full
+    result would not fit comfortably in memory.
+
+    kind is 'consommation', 'production' (key = filière) or 'echange'
+    (key = pays, 'total' allowed). Columns match get_puissance_data /
+    get_production_data / get_echanges_data: date_heure, <value>, source.
+
+    Arguments are validated eagerly (ValueError) so that errors surface
+    before the HTTP response starts. The query runs when the returned
+    generator is first iterated: its result is spooled to a temporary file
+    (Arrow IPC stream) and the DuckDB connection and admission slot are
+    released before the first chunk is yielded, so a slow download holds
+    neither. The file is removed when the generator is exhausted or closed
+    (client gone).
+    """
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+    cache_key, expr, name = _courbe_projection(kind, key)
+
+    path = data_cache.get_local_path(cache_key)
+    query = f"""
+        SELECT date_heure, {expr} AS {name}, source
+        FROM read_parquet(?)
+        WHERE date_heure BETWEEN ? AND ?
+        ORDER BY date_heure;
+    """
+    return _iter_batches(path, query, [path, start_str, f"{end_str} 23:59:59"], batch_rows)
+
+
+def _iter_batches(path, query, params, batch_rows):
+    source_map = {
+        'Consolidated Data': 'Données Consolidées',
+        'Real-Time Data': 'Temps Réel'
+    }
+    # Export : priorité basse dans la file d'admission, et le résultat est
+    # vidé sur disque lot par lot avant le premier envoi. La connexion (et sa
+    # place dans le budget) ne dure que le calcul DuckDB, sous l'échéance de
+    # la requête — pas le téléchargement, dont la durée dépend du client.
+    with tempfile.TemporaryFile() as spool:
+        with admission.priority(admission.BULK):
+            with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
+                reader = conn.execute(query, params).fetch_record_batch(batch_rows)
+                with pa.ipc.new_stream(spool, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+        spool.seek(0)
+        for batch in pa.ipc.open_stream(spool):
+            df = batch.to_pandas()
+            df['source'] = df['source'].map(source_map).fillna(df['source'])
+            yield df
+
+
+@timed_query
+def get_courbe_page(kind, start_date, end_date, key=None, after=None, limit=10_000):
+    """
+    One page of a power curve, keyset-paginated on date_heure.
+
+    Returns (df, next_cursor): at most `limit` rows strictly after `after`
+    (a datetime; None, or a cursor before start_date — e.g. `debut` changed
+    between calls — = from start_date inclusive), and the last date_heure of the
+    page, or None on the last page. A page never splits the rows sharing a
+    timestamp (overlapping data sources), so `date_heure > next_cursor` is an
+    exact resume point. Each page is a bounded top-N scan (the lower bound
+    prunes Parquet row groups): memory per call is constant, whatever the
+    overall range.
+    """
+    cache_key, expr, name = _courbe_projection(kind, key)
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+    if after is None or after < datetime.combine(start_date, datetime.min.time()):
+        lower, params = "date_heure >= ?", [start_str]
+    else:
+        lower, params = "date_heure > ?", [after]
+
+    path = data_cache.get_local_path(cache_key)
+    with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
+        query = f"""
+            SELECT date_heure, {expr} AS {name}, source
+            FROM read_parquet(?)
+            WHERE {lower} AND date_heure <= ?
+            ORDER BY date_heure, source
+            LIMIT ?;
+        """
+        # Une ligne de plus : indique s'il reste une page, et si la dernière
+        # date de la page a encore des lignes au-delà de la limite.
+        result = conn.execute(
+            query, [path, *params, f"{end_str} 23:59:59", limit + 1]
+        ).fetchdf()
+
+    next_cursor = None
+    if len(result) > limit:
+        boundary = result['date_heure'].iloc[limit]
+        page = result.iloc[:limit]
+        complete = page[page['date_heure'] != boundary]
+        # Groupe plus grand qu'une page : impossible tant que limit dépasse le
+        # nombre de sources (l'API impose limite >= 100) — repli défensif.
+        page = complete if len(complete) else page
+        next_cursor = page['date_heure'].iloc[-1].to_pydatetime()
+        result = page.reset_index(drop=True)
+
+    source_map = {
+        'Consolidated Data': 'Données Consolidées',
+        'Real-Time Data': 'Temps Réel'
+    }
+    result['source'] = result['source'].map(source_map).fillna(result['source'])
+    return result, next_cursor
+
+
+# Pas de ré-échantillonnage : libellé API → (intervalle DuckDB, minutes).
+RESAMPLE_STEPS = {
+    '15min': ('15 minutes', 15),
+    '30min': ('30 minutes', 30),
+    '1h': ('1 hour', 60),
+    '1j': ('1 day', 1440),
+    '1sem': ('1 week', 10080),
+}
+# Agrégats par pas. `energie` = intégrale de la puissance (MWh), même calcul
+# que les fonctions *_energie_mensuelle (durée du pas bornée à 1 h).
+RESAMPLE_AGGS = {
+    'mean': 'AVG(val)',
+    'min': 'MIN(val)',
+    'max': 'MAX(val)',
+    'energie': 'SUM(val * dt_h)',
+}
+
+
+@timed_query
+def get_courbe_resampled(kind, start_date, end_date, key=None, pas='1h', agg='mean'):
+    """
+    Power curve resampled inside DuckDB (time_bucket): one row per step.
+
+    kind/key as in stream_courbe; pas in RESAMPLE_STEPS, agg in RESAMPLE_AGGS.
+    Duplicate timestamps (overlap between data sources) are averaged first.
+    Weeks start on Monday, days at midnight. Columns: date_heure, <value>
+    (MW, or MWh for agg='energie').
+    """
+    if pas not in RESAMPLE_STEPS:
+        raise ValueError(f"Pas invalide. Choisissez parmi: {', '.join(RESAMPLE_STEPS)}")
+    if agg not in RESAMPLE_AGGS:
+        raise ValueError(f"Agrégat invalide. Choisissez parmi: {', '.join(RESAMPLE_AGGS)}")
+    cache_key, expr, name = _courbe_projection(kind, key)
+    interval, _ = RESAMPLE_STEPS[pas]
+    query = _bucket_query(expr, interval, f"{RESAMPLE_AGGS[agg]} AS {name}",
+                          energy=agg == 'energie')
+    return _run_bucket_query(cache_key, query, start_date, end_date)
+
+
+# Toutes les statistiques d'une période, en une passe.
+_PERIOD_STATS = ", ".join(
+    f"{RESAMPLE_AGGS[agg]} AS {alias}"
+    for agg, alias in (('mean', 'mean'), ('min', 'min'), ('max', 'max'), ('energie', 'energie_mwh'))
+)
+
+# Agrégation calendaire du chatbot : granularité → intervalle DuckDB.
+AGGREGATE_STEPS = {
+    'hourly': '1 hour',
+    'daily': '1 day',
+    'weekly': '1 week',
+    'monthly': '1 month',
+}
+
+
+@timed_query
+def get_courbe_aggregated(kind, start_date, end_date, key=None, step='daily'):
+    """
+    Power curve aggregated per hour/day/week/month inside DuckDB, every
+    statistic in a single scan — only one row per period reaches pandas.
+
+    kind/key as in stream_courbe; step in AGGREGATE_STEPS (weeks start on
+    Monday, months on the 1st). Columns: date_heure (period start), mean,
+    min, max (MW) and energie_mwh (MWh, same integration as
+    get_courbe_resampled's 'energie').
+    """
+    if step not in AGGREGATE_STEPS:
+        raise ValueError(f"Pas invalide. Choisissez parmi: {', '.join(AGGREGATE_STEPS)}")
+    cache_key, expr, _ = _courbe_projection(kind, key)
+    query = _bucket_query(expr, AGGREGATE_STEPS[step], _PERIOD_STATS, energy=True)
+    return _run_bucket_query(cache_key, query, start_date, end_date)
+
+
+def _bucket_query(expr, interval, aggregates, energy):
+    """
+    SQL grouping a power curve into time_bucket(interval) periods.
+
+    Duplicate timestamps (overlap between data sources) are averaged first;
+    the duration of each step (lead window, capped at 1 h) is only computed
+    when an energy aggregate needs it. Parameters: path, start, end.
+    """
+    dt_col = (
+        ", LEAST(date_diff('second', date_heure, "
+        "lead(date_heure) OVER (ORDER BY date_heure)) / 3600.0, 1.0) AS dt_h"
+        if energy else ""
+    )
+    return f"""
+        WITH per_step AS (
+            SELECT date_heure, AVG({expr}) AS val
+            FROM read_parquet(?)
+            WHERE date_heure BETWEEN ? AND ?
+              AND {expr} IS NOT NULL
+            GROUP BY date_heure
+        ),
+        stepped AS (
+            SELECT date_heure, val{dt_col}
+            FROM per_step
+        )
+        SELECT time_bucket(INTERVAL '{interval}', date_heure) AS date_heure,
+               {aggregates}
+        FROM stepped
+        GROUP BY 1
+        ORDER BY 1
+    """
+
+
+def _run_bucket_query(cache_key, query, start_date, end_date, with_calendar=False):
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+    path = data_cache.get_local_path(cache_key)
+    with get_duckdb_connection(path) as conn:
+        if with_calendar:
+            calendrier.register_calendar(conn, start_date, end_date)
+        return conn.execute(query, [path, start_str, f"{end_str} 23:59:59"]).fetchdf()
+
+
+# Regroupements calendaires : libellé → (colonne de la table calendrier,
+# ordre des groupes, filtre). Cf. calendrier.py.
+DAY_TYPE_GROUPS = {
+    'type_jour': ('type_jour', 'groupe', ''),
+    'jour_semaine': ('jour', 'MIN(c.jour_semaine)', ''),
+    'saison': ('saison', 'MIN(month(c.date) % 12)', ''),
+    'ferie': ('nom_ferie', 'MIN(c.date)', 'WHERE c.is_ferie'),
+}
+
+
+@timed_query
+def get_courbe_by_day_type(kind, start_date, end_date, key=None, by='type_jour'):
+    """
+    Daily statistics of a power curve averaged per calendar group, in one
+    DuckDB query: daily buckets joined with the calendar dimension.
+
+    by in DAY_TYPE_GROUPS: 'type_jour' (ouvré / samedi / dimanche / férié),
+    'jour_semaine', 'saison' or 'ferie' (one row per public holiday name).
+    Columns: groupe, jours (number of days), mean (MW, mean of daily means),
+    min, max (MW, extremes over the group) and energie_mwh_jour (mean daily
+    energy, MWh).
+    """
+    if by not in DAY_TYPE_GROUPS:
+        raise ValueError(f"Regroupement invalide. Choisissez parmi: {', '.join(DAY_TYPE_GROUPS)}")
+    cache_key, expr, _ = _courbe_projection(kind, key)
+    column, order, where = DAY_TYPE_GROUPS[by]
+    daily = _bucket_query(expr, '1 day', _PERIOD_STATS, energy=True)
+    query = f"""
+        WITH daily AS ({daily})
+        SELECT c.{column} AS groupe,
+               COUNT(*) AS jours,
+               AVG(d.mean) AS mean,
+               MIN(d.min) AS min,
+               MAX(d.max) AS max,
+               AVG(d.energie_mwh) AS energie_mwh_jour
+        FROM daily d
+        JOIN {calendrier.TABLE_NAME} c ON c.date = d.date_heure
+        {where}
+        GROUP BY 1
+        ORDER BY {order};
+    """
+    return _run_bucket_query(cache_key, query, start_date, end_date, with_calendar=True)
+
+
+@timed_query
 def get_echanges_annual_import_export(start_date, end_date, pays='total'):
     """
     Annual import/export volumes (MWh) for a commercial border, derived from the
@@ -560,6 +1015,8 @@ def get_echanges_annual_import_export(start_date, end_date, pays='total'):
     return result
 
 
+
+@timed_query
 def get_echanges_annual_import_export_agg(pays='total'):
     """
     Import/export annuels sur tout l'historique, depuis l'agrégat pré-calculé
@@ -577,7 +1034,7 @@ def get_echanges_annual_import_export_agg(pays='total'):
 
     try:
         path = data_cache.get_local_path('echanges_annuel_imp_exp')
-        with get_duckdb_connection(path) as conn:
+        with get_duckdb_connection(path, memory_mb=LIGHT_QUERY_MB) as conn:
             # `pays` est validé contre la liste fermée ci-dessus, pas d'injection.
             result = conn.execute(f"""
                 SELECT CAST(year AS VARCHAR) AS annee,
@@ -588,6 +1045,10 @@ def get_echanges_annual_import_export_agg(pays='total'):
             """, [path]).fetchdf()
         if not result.empty:
             return result
+    except (admission.Overloaded, deadlines.QueryTimeout, deadlines.ClientDisconnected):
+        # Worker saturé, échéance dépassée ou client parti : surtout pas le
+        # calcul détaillé, bien plus lourd.
+        raise
     except Exception:
         logger.warning("Agrégat echanges_annuels_import_export indisponible, "
                        "fallback sur le calcul détaillé", exc_info=True)
@@ -596,6 +1057,7 @@ def get_echanges_annual_import_export_agg(pays='total'):
     return get_echanges_annual_import_export(start_date, end_date, pays)
 
 
+@timed_query
 def get_echanges_net_by_border(start_date, end_date):
     """
     Import/export/solde volumes (MWh) over the whole period, one row per
@@ -660,6 +1122,7 @@ def get_echanges_net_by_border(start_date, end_date):
     return result
 
 
+@timed_query
 def get_echanges_annual_detail(start_date, end_date):
     """
     Annual import/export (MWh) for every commercial border plus the overall
@@ -726,6 +1189,7 @@ def get_echanges_annual_detail(start_date, end_date):
 # un même horodatage, on déduplique d'abord par date_heure (AVG) pour ne pas
 # fausser les durées de pas.
 
+@timed_query
 def get_consommation_energie_mensuelle(start_date, end_date):
     """Énergie consommée (MWh) par mois sur une plage. Colonnes: mois, energie_mwh."""
     start_str = start_date.strftime("%Y-%m-%d")
@@ -760,6 +1224,7 @@ def get_consommation_energie_mensuelle(start_date, end_date):
     return result
 
 
+@timed_query
 def get_production_energie_mensuelle(start_date, end_date, filiere='nucleaire'):
     """Énergie produite (MWh) par mois pour une filière. Colonnes: mois, energie_mwh."""
     start_str = start_date.strftime("%Y-%m-%d")
@@ -799,6 +1264,7 @@ def get_production_energie_mensuelle(start_date, end_date, filiere='nucleaire'):
     return result
 
 
+@timed_query
 def get_echanges_energie_mensuelle(start_date, end_date, pays='total'):
     """Import/export (MWh) par mois pour une frontière commerciale ou 'total'.
 
@@ -848,6 +1314,7 @@ def get_echanges_energie_mensuelle(start_date, end_date, pays='total'):
     return result
 
 
+@timed_query
 def get_parc_installe_data():
     """
     Computes monthly installed capacity (MW) for wind (onshore/offshore) and solar.
@@ -858,7 +1325,8 @@ def get_parc_installe_data():
     sol_prod_path = data_cache.get_local_path('rte_solaire_production')
     sol_fc_path = data_cache.get_local_path('rte_solaire_facteur_charge')
 
-    with get_duckdb_connection(eol_prod_path, eol_fc_path, sol_prod_path, sol_fc_path) as conn:
+    with get_duckdb_connection(eol_prod_path, eol_fc_path, sol_prod_path, sol_fc_path,
+                               memory_mb=LIGHT_QUERY_MB) as conn:
         eol_df = conn.execute("""
             SELECT
                 p.date,
@@ -891,6 +1359,7 @@ def get_parc_installe_data():
     return df.sort_values('date').reset_index(drop=True)
 
 
+@timed_query
 def get_dashboard_data():
     """
     Returns data for the homepage dashboard.
@@ -0,0 +1,73 @@
+"""
+Fichiers statiques servis devant Django en mode ASGI.
+
+WhiteNoiseMiddleware est synchrone seulement (pas d'équivalent ASGI dans
+whitenoise 6) : placé dans MIDDLEWARE, il oblige Django à adapter toute la
+chaîne via sync_to_async, et chaque requête « asynchrone » (API, chat)
+occupe alors un thread du début à la fin. En ASGI, settings.py le retire de
+la chaîne et config/asgi.py enveloppe l'application dans StaticFilesApp :
+même index de fichiers et mêmes en-têtes que WhiteNoise (versions
+compressées, cache immuable des noms hachés, Range, 304), fichiers lus par
+blocs hors de la boucle.
+
+Usage (config/asgi.py) :
+    application = StaticFilesApp(get_asgi_application())
+"""
+import asyncio
+
+from django.core.handlers.asgi import get_script_prefix
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class StaticFilesApp:
+    """Application ASGI : sert STATIC_URL, délègue le reste à `application`."""
+
+    def __init__(self, application):
+        self.application = application
+        # Réglages WHITENOISE_* et index de STATIC_ROOT, comme le middleware.
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            static_file = self._find(scope)
+            if static_file is not None:
+                await self._serve(static_file, scope, send)
+                return
+        await self.application(scope, receive, send)
+
+    def _find(self, scope):
+        # Même path_info que ASGIRequest (préfixe FORCE_SCRIPT_NAME / root_path ôté).
+        path = scope["path"]
+        script_name = get_script_prefix(scope)
+        if script_name:
+            path = path.removeprefix(script_name)
+        if self.whitenoise.autorefresh:
+            return self.whitenoise.find_file(path)
+        return self.whitenoise.files.get(path)
+
+    async def _serve(self, static_file, scope, send):
+        request_headers = {
+            "HTTP_" + name.decode("latin-1").upper().replace("-", "_"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        # get_response ouvre le fichier : hors de la boucle, comme les lectures.
+        response = await asyncio.to_thread(static_file.get_response, scope["method"], request_headers)
+        await send({
+            "type": "http.response.start",
+            "status": int(response.status),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response.headers],
+        })
+        if response.file is None:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        try:
+            while True:
+                chunk = await asyncio.to_thread(response.file.read, _CHUNK_SIZE)
+                more = len(chunk) == _CHUNK_SIZE
+                await send({"type": "http.response.body", "body": chunk, "more_body": more})
+                if not more:
+                    break
+        finally:
+            response.file.close()
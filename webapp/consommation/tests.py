@@ -1,34 +1,53 @@
 """Tests de l'API publique v1 : authentification par clé (401/200) et
 throttling par clé (429).
 
-On utilise le `TestClient` de Django Ninja (exécute la pipeline auth + throttle
+On utilise le client de test de Django Ninja (exécute la pipeline auth + throttle
 sans le middleware HTTP, donc pas de redirection HTTPS à gérer) et on mocke la
 couche `services` pour ne pas dépendre de S3/DuckDB. Les clés sont créées en
 base (chemin principal de `ApiKeyAuth`), via une `TestCase` transactionnelle.
 """
+import atexit
 import json
+import logging
+import os
+import tempfile
+import threading
 from datetime import date, timedelta
+from io import StringIO
 from types import SimpleNamespace
 from unittest import mock
 
+import duckdb
 import httpx
+import numpy as np
 import pandas as pd
 import requests
+from asgiref.sync import async_to_sync
 from django.conf import settings as django_settings
 from django.contrib.sessions.backends.signed_cookies import SessionStore
 from django.core.cache import cache
-from django.test import Client, RequestFactory, TestCase, override_settings
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 
-from ninja.testing import TestClient
+from ninja.testing import TestAsyncClient
 
+from . import admission
 from . import api_auth
+from . import calendrier
 from . import chat
 from . import chat_views
+from . import data_cache
+from . import deadlines
+from . import fake_mistral
+from . import metrics
+from . import query_log
 from . import services
 from . import views
 from .api import api
-from .models import ApiKey
+from .management.commands import bench_chat
+from .models import ApiKey, Conversation
 
 # Clé de test et son hash, enregistrés en base pendant les tests.
 VALID_KEY = "elf_test_key"
@@ -40,6 +59,13 @@ PARC_ENDPOINT = "/parc"
 FAKE_PARC = pd.DataFrame([{"date": "2024-01", "filiere": "eolien", "parc_mw": 1000.0}])
 
 
+class TestClient(TestAsyncClient):
+    """Client de test Ninja appelé de façon synchrone (endpoints asynchrones)."""
+
+    def get(self, path, data=None, **request_params):
+        return async_to_sync(super().get)(path, data, **request_params)
+
+
 def _make_key(raw_key: str, label: str) -> ApiKey:
     """Crée une clé active en base à partir de sa valeur brute."""
     return ApiKey.objects.create(
@@ -217,9 +243,9 @@ class ChatMessageGuardTests(TestCase):
         self.addCleanup(cache.clear)
         with mock.patch.object(chat_views, "ChatService") as MockSvc, \
              mock.patch.object(chat_views, "CHAT_RATE_HOURLY", 2):
-            MockSvc.return_value.run.return_value = {
+            MockSvc.return_value.run = mock.AsyncMock(return_value={
                 "reply": "ok", "messages": [], "usage": {"input": 1, "output": 1},
-            }
+            })
             for _ in range(2):
                 resp = self._post({"messages": [{"role": "user", "content": "salut"}]})
                 self.assertEqual(resp.status_code, 200)
@@ -241,7 +267,9 @@ class ChatRetryTests(TestCase):
     def _service(self):
         with override_settings(MISTRAL_API_KEY="test-key"):
             with mock.patch.object(chat, "Mistral"):
-                return chat.ChatService()
+                svc = chat.ChatService()
+        svc.client.chat.complete_async = mock.AsyncMock()
+        return svc
 
     @staticmethod
     def _err(status, headers=None):
@@ -258,40 +286,458 @@ class ChatRetryTests(TestCase):
 
     def test_429_transitoire_absorbe_par_backoff(self):
         svc = self._service()
-        svc.client.chat.complete.side_effect = [self._err(429), self._err(429), self._ok()]
-        with mock.patch.object(chat.time, "sleep") as sleep:
-            result = svc.run([{"role": "user", "content": "salut"}])
+        svc.client.chat.complete_async.side_effect = [self._err(429), self._err(429), self._ok()]
+        with mock.patch.object(chat.asyncio, "sleep") as sleep:
+            result = async_to_sync(svc.run)([{"role": "user", "content": "salut"}])
         self.assertEqual(result["reply"], "ok")
         # Backoff exponentiel : 1 s puis 2 s.
         self.assertEqual([c.args[0] for c in sleep.call_args_list], [1.0, 2.0])
 
     def test_retry_after_du_serveur_honore(self):
         svc = self._service()
-        svc.client.chat.complete.side_effect = [
+        svc.client.chat.complete_async.side_effect = [
             self._err(429, {"Retry-After": "5"}), self._ok(),
         ]
-        with mock.patch.object(chat.time, "sleep") as sleep:
-            svc.run([{"role": "user", "content": "salut"}])
+        with mock.patch.object(chat.asyncio, "sleep") as sleep:
+            async_to_sync(svc.run)([{"role": "user", "content": "salut"}])
         self.assertEqual([c.args[0] for c in sleep.call_args_list], [5.0])
 
     def test_429_persistant_leve_chat_busy(self):
         svc = self._service()
-        svc.client.chat.complete.side_effect = [self._err(429)] * chat._RETRY_ATTEMPTS
-        with mock.patch.object(chat.time, "sleep"):
+        svc.client.chat.complete_async.side_effect = [self._err(429)] * chat._RETRY_ATTEMPTS
+        with mock.patch.object(chat.asyncio, "sleep"):
             with self.assertRaises(chat.ChatBusyError):
-                svc.run([{"role": "user", "content": "salut"}])
-        self.assertEqual(svc.client.chat.complete.call_count, chat._RETRY_ATTEMPTS)
+                async_to_sync(svc.run)([{"role": "user", "content": "salut"}])
+        self.assertEqual(svc.client.chat.complete_async.call_count, chat._RETRY_ATTEMPTS)
 
     def test_erreur_non_429_remonte_sans_retry(self):
         svc = self._service()
-        svc.client.chat.complete.side_effect = [self._err(500)]
-        with mock.patch.object(chat.time, "sleep") as sleep:
+        svc.client.chat.complete_async.side_effect = [self._err(500)]
+        with mock.patch.object(chat.asyncio, "sleep") as sleep:
             with self.assertRaises(chat.MistralError):
-                svc.run([{"role": "user", "content": "salut"}])
-        self.assertEqual(svc.client.chat.complete.call_count, 1)
+                async_to_sync(svc.run)([{"role": "user", "content": "salut"}])
+        self.assertEqual(svc.client.chat.complete_async.call_count, 1)
         sleep.assert_not_called()
 
 
+class ChatParallelToolsTests(TestCase):
+    """Tools d'un même message exécutés en parallèle, résultats dans l'ordre."""
+
+    def _service(self):
+        with override_settings(MISTRAL_API_KEY="test-key"):
+            with mock.patch.object(chat, "Mistral"):
+                svc = chat.ChatService()
+        svc.client.chat.complete_async = mock.AsyncMock()
+        return svc
+
+    @staticmethod
+    def _call(id_, name):
+        return SimpleNamespace(id=id_, function=SimpleNamespace(name=name, arguments="{}"))
+
+    @staticmethod
+    def _resp(content=None, tool_calls=None):
+        return SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1),
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=tool_calls))],
+        )
+
+    def test_tools_concurrents_resultats_ordonnes(self):
+        import threading
+        # Chaque tool attend l'autre : ne passe que s'ils tournent en même temps.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def tool(name):
+            def run(args):
+                barrier.wait()
+                return {"tool": name}
+            return run
+
+        svc = self._service()
+        svc.client.chat.complete_async.side_effect = [
+            self._resp(tool_calls=[self._call("a", "lent"), self._call("b", "rapide")]),
+            self._resp(content="fini"),
+        ]
+        with mock.patch.dict(chat._DISPATCH, {"lent": tool("lent"), "rapide": tool("rapide")}):
+            result = async_to_sync(svc.run)([{"role": "user", "content": "deux séries"}])
+        self.assertEqual(result["reply"], "fini")
+        history = svc.client.chat.complete_async.call_args_list[1].kwargs["messages"]
+        tools = [m for m in history if m["role"] == "tool"]
+        self.assertEqual([m["tool_call_id"] for m in tools], ["a", "b"])
+        self.assertEqual([json.loads(m["content"]) for m in tools],
+                         [{"tool": "lent"}, {"tool": "rapide"}])
+
+    def test_erreur_d_un_tool_isolee(self):
+        with mock.patch.dict(chat._DISPATCH, {"ok": lambda args: {"ok": True},
+                                              "boom": lambda args: 1 / 0}):
+            results = async_to_sync(chat._run_tools)([("inexistant", {}), ("boom", {}), ("ok", {})])
+        self.assertIn("inconnu", json.loads(results[0])["error"])
+        self.assertIn("ZeroDivisionError", json.loads(results[1])["error"])
+        self.assertEqual(json.loads(results[2]), {"ok": True})
+
+
+class ChatToolCacheTests(TestCase):
+    """Cache des résultats de tools : clé (tool, args, ETags), budget LRU en octets."""
+
+    def setUp(self):
+        chat._tool_cache.clear()
+        self.addCleanup(chat._tool_cache.clear)
+        self.df = pd.DataFrame([{"year_month": "2024-01", "monthly_consumption": 1.0}])
+
+    def _run(self, **args):
+        return chat._run_tool("get_consommation", {"granularity": "monthly", **args})
+
+    def test_appel_repete_servi_depuis_le_cache(self):
+        with mock.patch("consommation.services.get_monthly_data", return_value=self.df) as m:
+            first = self._run(top_n=3)
+            # Ordre des clés et arguments nuls sans effet sur la clé.
+            second = chat._run_tool("get_consommation",
+                                    {"top_n": 3, "month": None, "granularity": "monthly"})
+        self.assertEqual(first, second)
+        m.assert_called_once()
+
+    @override_settings(S3_PATHS={"mensuel": "s3://bucket/mensuel.parquet"})
+    def test_nouvelle_version_des_donnees_recalcule(self):
+        with mock.patch("consommation.services.get_monthly_data", return_value=self.df) as m:
+            with mock.patch.object(data_cache, "get_etag", return_value="etl-1"):
+                self._run()
+                self._run()
+            with mock.patch.object(data_cache, "get_etag", return_value="etl-2"):
+                self._run()
+        self.assertEqual(m.call_count, 2)
+
+    def test_erreur_non_mise_en_cache(self):
+        with mock.patch("consommation.services.get_monthly_data",
+                        side_effect=[ValueError("panne"), self.df]) as m:
+            self.assertIn("error", json.loads(self._run()))
+            self.assertNotIn("error", json.loads(self._run()))
+        self.assertEqual(m.call_count, 2)
+
+    def test_budget_en_octets_evince_le_moins_recent(self):
+        cache_ = chat._ToolResultCache()
+        with override_settings(CHAT_TOOL_CACHE_MB=100 / (1024 * 1024)):  # 100 octets
+            cache_.put(("a",), "x" * 40)
+            cache_.put(("b",), "x" * 40)
+            cache_.get(("a",))  # « a » redevient le plus récent
+            cache_.put(("c",), "x" * 40)
+            cache_.put(("d",), "x" * 200)  # plus gros que le budget : ignoré
+        self.assertIsNotNone(cache_.get(("a",)))
+        self.assertIsNone(cache_.get(("b",)))
+        self.assertIsNotNone(cache_.get(("c",)))
+        self.assertIsNone(cache_.get(("d",)))
+
+
+class PromptPrefixTests(TestCase):
+    """Préfixe statique du prompt, schémas compacts, usage par tour."""
+
+    def test_date_apres_le_prefixe_statique(self):
+        with mock.patch.object(chat.timezone, "localdate", return_value=date(2025, 3, 4)):
+            prompt = chat._build_system_prompt()
+            self.assertIs(chat._build_system_prompt(), prompt)  # construit une fois par jour
+        self.assertTrue(prompt.startswith(chat.SYSTEM_PROMPT))
+        self.assertIn("mardi 4 mars 2025 (2025-03-04)", prompt[len(chat.SYSTEM_PROMPT):])
+        self.assertNotIn("{today}", chat.SYSTEM_PROMPT)
+
+    def test_schemas_compacts(self):
+        self.assertEqual([t["function"]["name"] for t in chat.MISTRAL_TOOLS], [t["name"] for t in chat.TOOLS])
+        overview = chat.MISTRAL_TOOLS[0]["function"]["parameters"]
+        self.assertEqual(overview, {"type": "object", "properties": {}})
+        self.assertEqual(chat._compact_schema({"description": " a\n   b ", "required": ["x"]}),
+                         {"description": "a b", "required": ["x"]})
+        conso = chat.MISTRAL_TOOLS[1]["function"]["parameters"]["properties"]
+        self.assertEqual(set(chat._MONTHLY_FILTERS) - set(conso), set())
+        # Budget du préfixe fixe : ~2 770 tokens de schémas avant compactage,
+        # ~1 450 après. Une description qui regonfle fait échouer ce test.
+        size = len(json.dumps(chat.MISTRAL_TOOLS, ensure_ascii=False, separators=(",", ":")))
+        self.assertLess(size // chat._CHARS_PER_TOKEN, 1600)
+        for tool in chat.MISTRAL_TOOLS:
+            for name, prop in tool["function"]["parameters"]["properties"].items():
+                if "enum" in prop:  # le type se déduit des valeurs
+                    self.assertNotIn("type", prop, f"{tool['function']['name']}.{name}")
+
+    def test_usage_par_tour(self):
+        client = fake_mistral.FakeMistral(FakeMistralBenchTests.STEPS)
+        with fake_mistral.stub_tools():
+            result = async_to_sync(chat.ChatService(client=client).run)(
+                [{"role": "user", "content": "pic ?"}])
+        self.assertEqual(result["usage"]["calls"], 2)
+        self.assertEqual(result["usage"]["prefix"], 2 * chat._PREFIX_TOKENS)
+        self.assertLess(result["usage"]["prefix"], result["usage"]["input"])
+
+
+class FakeMistralBenchTests(TestCase):
+    """Client Mistral hors ligne (fake_mistral) et commande bench_chat."""
+
+    STEPS = [[("get_overview", {}), ("get_peak", {"dataset": "consommation"})], "Pic : 83 GW."]
+
+    def test_scenario_rejoue_avec_tools_et_usage(self):
+        client = fake_mistral.FakeMistral(self.STEPS)
+        original = chat._DISPATCH["get_peak"]
+        with fake_mistral.stub_tools({"v": 1}):
+            result = async_to_sync(chat.ChatService(client=client).run)(
+                [{"role": "user", "content": "pic ?"}])
+            self.assertEqual(chat._DISPATCH["get_peak"]({}), {"v": 1})
+        self.assertEqual(result["reply"], "Pic : 83 GW.")
+        self.assertEqual(client.calls, 2)
+        self.assertGreater(result["usage"]["input"], 0)
+        self.assertEqual((result["usage"]["input"], result["usage"]["output"]),
+                         (client.usage["input"], client.usage["output"]))
+        self.assertEqual(result["usage"]["calls"], 2)
+        self.assertIs(chat._DISPATCH["get_peak"], original)  # tools d'origine restaurés
+
+    def test_flux_et_429_simules(self):
+        client = fake_mistral.FakeMistral(self.STEPS, rate_429=1.0)
+        with mock.patch.object(chat.asyncio, "sleep"), self.assertRaises(chat.ChatBusyError):
+            async_to_sync(chat.ChatService(client=client).run)([{"role": "user", "content": "x"}])
+        self.assertEqual((client.rejected, client.calls), (chat._RETRY_ATTEMPTS, 0))
+
+        client = fake_mistral.FakeMistral(["Un deux trois quatre cinq."])
+        events = ChatStreamTests._collect(
+            chat.ChatService(client=client).run_stream([{"role": "user", "content": "x"}]))
+        self.assertEqual([e for e, _ in events], ["token", "token", "done"])
+        self.assertEqual(events[-1][1]["reply"], "Un deux trois quatre cinq.")
+
+    def test_temps_par_etape(self):
+        import time as _time
+
+        def slow_tool(args):
+            _time.sleep(0.05)
+            return {"v": 1}
+
+        service = chat.ChatService(client=fake_mistral.FakeMistral(self.STEPS, latency=0))
+        with mock.patch.dict(chat._DISPATCH, {"get_overview": slow_tool, "get_peak": slow_tool}):
+            async_to_sync(service.run)([{"role": "user", "content": "pic ?"}])
+        # Deux tools en parallèle : un seul lot de ~50 ms.
+        self.assertGreaterEqual(service.stage_seconds["tools"], 0.05)
+        self.assertLess(service.stage_seconds["tools"], 0.1)
+
+        service = chat.ChatService(client=fake_mistral.FakeMistral(self.STEPS, rate_429=1.0))
+        with mock.patch.object(chat.asyncio, "sleep"), self.assertRaises(chat.ChatBusyError):
+            async_to_sync(service.run)([{"role": "user", "content": "x"}])
+        self.assertEqual(service.stage_seconds["retry_wait"],
+                         sum(min(2 ** a, chat._RETRY_MAX_SLEEP) for a in range(chat._RETRY_ATTEMPTS - 1)))
+
+    def test_commande_bench_chat(self):
+        out = StringIO()
+        call_command("bench_chat", "--stub-tools", "--stream", "--latency", "0",
+                     "--chunk-delay", "0", "--concurrency", "5", stdout=out)
+        self.assertIn(f"{len(bench_chat.CORPUS)} turns", out.getvalue())
+        self.assertIn("backoff", out.getvalue().splitlines()[0])
+
+
+class ChatStreamTests(TestCase):
+    """/chat/stream/ : jetons et progression des tools en Server-Sent Events."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(mock.patch.stopall)
+        with override_settings(MISTRAL_API_KEY="test-key"):
+            with mock.patch.object(chat, "Mistral"):
+                self.svc = chat.ChatService()
+
+    @staticmethod
+    def _chunk(content=None, tool_calls=None, usage=None):
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(data=SimpleNamespace(
+            choices=[SimpleNamespace(delta=delta)], usage=usage))
+
+    @staticmethod
+    def _stream(*chunks):
+        stream = mock.MagicMock()
+        stream.__aenter__.return_value = stream
+        stream.__aiter__.return_value = chunks
+        return stream
+
+    @staticmethod
+    def _collect(events):
+        async def collect():
+            return [e async for e in events]
+        return async_to_sync(collect)()
+
+    def _tool_then_text(self):
+        call = SimpleNamespace(id="c1", function=SimpleNamespace(name="outil", arguments='{"a":'))
+        suite = SimpleNamespace(id=None, function=SimpleNamespace(name=None, arguments=" 1}"))
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=2)
+        self.svc.client.chat.stream_async = mock.AsyncMock(side_effect=[
+            self._stream(self._chunk(content="Je regarde…"),
+                         self._chunk(tool_calls=[call]), self._chunk(tool_calls=[suite])),
+            self._stream(self._chunk(content="Pic : "), self._chunk(content="42 MW", usage=usage)),
+        ])
+
+    def test_evenements_tokens_tools_puis_fin(self):
+        self._tool_then_text()
+        seen = []
+        with mock.patch.dict(chat._DISPATCH, {"outil": lambda args: seen.append(args) or {"v": 42}}):
+            events = self._collect(self.svc.run_stream([{"role": "user", "content": "pic ?"}]))
+        self.assertEqual(seen, [{"a": 1}])  # arguments recollés depuis les fragments
+        self.assertEqual([e for e, _ in events],
+                         ["token", "tool", "tool", "token", "token", "done"])
+        self.assertEqual(events[1][1], {"name": "outil", "status": "start"})
+        done = events[-1][1]
+        self.assertEqual(done["reply"], "Pic : 42 MW")
+        self.assertEqual(done["usage"], {"input": 10, "output": 2, "calls": 1,
+                                         "prefix": chat._PREFIX_TOKENS})
+        self.assertEqual(done["messages"][-1], {"role": "assistant", "content": "Pic : 42 MW"})
+
+    def test_vue_sse(self):
+        mock.patch.object(chat_views, "get_user_from_session",
+                          return_value={"sub": "oidc|alice", "email": "alice@example.com"}).start()
+        self._tool_then_text()
+        with mock.patch.object(chat_views, "ChatService", return_value=self.svc), \
+                mock.patch.dict(chat._DISPATCH, {"outil": lambda args: {"v": 42}}):
+            resp = Client().post("/chat/stream/", content_type="application/json",
+                                 data=json.dumps({"messages": [{"role": "user", "content": "pic ?"}]}))
+            body = b"".join(resp.streaming_content).decode()
+        self.assertEqual(resp["Content-Type"], "text/event-stream; charset=utf-8")
+        self.assertEqual(resp["X-Accel-Buffering"], "no")
+        blocks = [b for b in body.split("\n\n") if b]
+        self.assertTrue(blocks[0].startswith("event: token\ndata: "))
+        event, data = blocks[-1].split("\n")
+        self.assertEqual(event, "event: done")
+        self.assertEqual(json.loads(data[len("data: "):])["reply"], "Pic : 42 MW")
+
+    def test_saturation_en_evenement_erreur(self):
+        mock.patch.object(chat_views, "get_user_from_session",
+                          return_value={"sub": "oidc|alice", "email": "alice@example.com"}).start()
+        with mock.patch.object(chat_views, "ChatService") as MockSvc:
+            MockSvc.return_value.run_stream.side_effect = chat.ChatBusyError()
+            resp = Client().post("/chat/stream/", content_type="application/json",
+                                 data=json.dumps({"messages": [{"role": "user", "content": "x"}]}))
+            body = b"".join(resp.streaming_content).decode()
+        self.assertTrue(body.startswith("event: error\n"))
+        self.assertIn("sollicité", body)
+
+    def test_sans_auth_renvoie_401(self):
+        resp = Client().post("/chat/stream/", content_type="application/json",
+                             data=json.dumps({"messages": [{"role": "user", "content": "x"}]}))
+        self.assertEqual(resp.status_code, 401)
+
+
+class ConversationStoreTests(TestCase):
+    """Conversations côté serveur : le client n'envoie que son message, le
+    serveur recharge l'historique et le résume au-delà du budget."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(mock.patch.stopall)
+        self.user = mock.patch.object(
+            chat_views, "get_user_from_session",
+            return_value={"sub": "oidc|alice", "email": "alice@example.com"},
+        ).start()
+        self.svc = mock.patch.object(chat_views, "ChatService").start().return_value
+        self.svc.run = mock.AsyncMock(side_effect=lambda messages, summary="": {
+            "reply": "ok", "usage": {"input": 1, "output": 1},
+            "messages": messages + [{"role": "assistant", "content": "ok"}],
+        })
+
+    def _post(self, payload):
+        return Client().post("/chat/message/", content_type="application/json",
+                             data=json.dumps(payload))
+
+    def test_nouvelle_conversation_puis_message_seul(self):
+        resp = self._post({"message": "salut"})
+        self.assertEqual(resp.status_code, 200)
+        conv_id = resp.json()["conversation_id"]
+        self.assertNotIn("messages", resp.json())
+
+        resp = self._post({"conversation_id": conv_id, "message": "et ensuite ?"})
+        self.assertEqual(resp.status_code, 200)
+        sent = self.svc.run.call_args.args[0]
+        self.assertEqual([m["content"] for m in sent], ["salut", "ok", "et ensuite ?"])
+        conv = Conversation.objects.get(pk=conv_id)
+        self.assertEqual(conv.user_sub, "oidc|alice")
+        self.assertEqual(len(conv.messages), 4)
+
+    def test_conversation_d_un_autre_utilisateur_renvoie_404(self):
+        conv = Conversation.objects.create(user_sub="oidc|bob", messages=[])
+        for conv_id in (str(conv.pk), "pas-un-uuid"):
+            resp = self._post({"conversation_id": conv_id, "message": "salut"})
+            self.assertEqual(resp.status_code, 404)
+        self.svc.run.assert_not_called()
+
+    def test_message_vide_renvoie_400(self):
+        self.assertEqual(self._post({"message": "  "}).status_code, 400)
+
+    def test_conversations_expirees_purgees(self):
+        old = Conversation.objects.create(user_sub="oidc|bob", messages=[])
+        Conversation.objects.filter(pk=old.pk).update(
+            updated_at=timezone.now() - timedelta(days=2))
+        with override_settings(CHAT_CONVERSATION_TTL=3600):
+            self._post({"message": "salut"})
+        self.assertFalse(Conversation.objects.filter(pk=old.pk).exists())
+
+    def test_resume_au_dela_du_budget(self):
+        svc = mock.Mock(summarize=mock.AsyncMock(return_value="Alice étudie le pic 2023."))
+        messages = []
+        for i in range(6):
+            messages += [{"role": "user", "content": f"q{i} " + "x" * 400},
+                         {"role": "assistant", "content": f"r{i} " + "y" * 400}]
+        with override_settings(CHAT_HISTORY_TOKEN_BUDGET=500):
+            summary, kept = async_to_sync(chat.compact_history)(svc, "", messages)
+        self.assertEqual(summary, "Alice étudie le pic 2023.")
+        self.assertEqual(kept[0]["role"], "user")
+        self.assertEqual(kept[-1], messages[-1])
+        self.assertLessEqual(chat._estimate_tokens(kept), 500)
+        self.assertEqual(svc.summarize.call_args.args[1], messages[:len(messages) - len(kept)])
+
+    def test_echec_du_resume_abandonne_les_anciens_tours(self):
+        svc = mock.Mock(summarize=mock.AsyncMock(side_effect=RuntimeError("boom")))
+        messages = [{"role": "user", "content": "x" * 2000},
+                    {"role": "assistant", "content": "y" * 2000},
+                    {"role": "user", "content": "dernière"},
+                    {"role": "assistant", "content": "réponse"}]
+        with override_settings(CHAT_HISTORY_TOKEN_BUDGET=500), \
+                self.assertLogs("consommation.chat", "WARNING"):
+            summary, kept = async_to_sync(chat.compact_history)(svc, "ancien", messages)
+        self.assertEqual(summary, "ancien")
+        self.assertEqual(kept, messages[2:])
+
+    def test_resume_transmis_au_modele(self):
+        conv = Conversation.objects.create(
+            user_sub="oidc|alice", summary="Contexte résumé.", messages=[])
+        self._post({"conversation_id": str(conv.pk), "message": "salut"})
+        self.assertEqual(self.svc.run.call_args.args[1], "Contexte résumé.")
+
+
+class ConversationStreamTests(TransactionTestCase):
+    """Tour streamé d'une conversation stockée, vue servie en WSGI : le flux
+    passe par une boucle dédiée et l'enregistrement par le thread de
+    sync_to_async (autre connexion, d'où TransactionTestCase)."""
+
+    def setUp(self):
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(chat_views, "get_user_from_session",
+                          return_value={"sub": "oidc|alice", "email": "alice@example.com"}).start()
+        svc = mock.patch.object(chat_views, "ChatService").start().return_value
+
+        async def run_stream(messages, summary=""):
+            yield "token", {"text": "ok"}
+            yield "done", {"reply": "ok", "usage": {"input": 1, "output": 1},
+                           "messages": messages + [{"role": "assistant", "content": "ok"}]}
+        svc.run_stream = run_stream
+
+    def test_tour_streame_enregistre_la_conversation(self):
+        resp = Client().post("/chat/stream/", content_type="application/json",
+                             data=json.dumps({"message": "salut"}))
+        blocks = b"".join(resp.streaming_content).decode().split("\n\n")
+        event, data = blocks[-2].split("\n")
+        self.assertEqual(event, "event: done")
+        conv = Conversation.objects.get(pk=json.loads(data[len("data: "):])["conversation_id"])
+        self.assertEqual([m["content"] for m in conv.messages], ["salut", "ok"])
+
+    def test_tour_enregistre_si_le_client_ferme_sur_done(self):
+        resp = Client().post("/chat/stream/", content_type="application/json",
+                             data=json.dumps({"message": "salut"}))
+        stream = iter(resp.streaming_content)
+        next(stream)  # token
+        event, data = next(stream).decode().split("\n")[:2]
+        self.assertEqual(event, "event: done")
+        resp.close()  # client parti dès la réponse
+        conv = Conversation.objects.get(pk=json.loads(data[len("data: "):])["conversation_id"])
+        self.assertEqual([m["content"] for m in conv.messages], ["salut", "ok"])
+
+
 class ChatPayloadTests(TestCase):
     """Sérialisation des séries pour le chatbot (`chat._df_to_payload`).
 
@@ -359,6 +805,149 @@ class ChatPayloadTests(TestCase):
         self.assertIn("sample", payload)
         self.assertNotIn("data", payload)
 
+    def _spiky_df(self, n=2000):
+        values = [50_000.0 + (i % 48) * 10 for i in range(n)]
+        values[1001] = 90_000.0  # pic isolé, entre deux pas d'un échantillon régulier
+        return pd.DataFrame({"date_heure": pd.date_range("2024-01-01", periods=n, freq="30min"),
+                             "value": values})
+
+    def test_echantillon_en_colonnes_garde_le_pic(self):
+        payload = chat._df_to_payload(self._spiky_df(), "value", "MW")
+        sample = payload["sample"]
+        self.assertEqual(set(sample), {"date_heure", "value"})
+        self.assertEqual(len(sample["date_heure"]), len(sample["value"]))
+        self.assertIn(90_000.0, sample["value"])
+        self.assertEqual(sample["date_heure"][0], "2024-01-01T00:00:00")
+        self.assertEqual(payload["stats"]["period"]["end"], sample["date_heure"][-1])
+
+    def test_budget_de_tokens_respecte(self):
+        df = self._spiky_df()
+        with override_settings(CHAT_TOOL_TOKEN_BUDGET=0):
+            large = chat._df_to_payload(df, "value", "MW")
+        with override_settings(CHAT_TOOL_TOKEN_BUDGET=600):
+            small = chat._df_to_payload(df, "value", "MW")
+        self.assertEqual(len(large["sample"]["value"]), chat._SAMPLE_MAX)
+        self.assertLess(len(small["sample"]["value"]), chat._SAMPLE_MAX)
+        self.assertLessEqual(chat._payload_tokens(small), 600)
+        self.assertIn(90_000.0, small["sample"]["value"])
+
+    def test_lttb_bornes_et_ordre(self):
+        idx = chat._lttb_indices(np.sin(np.arange(500) / 10.0), 50)
+        self.assertEqual(len(idx), 50)
+        self.assertEqual((idx[0], idx[-1]), (0, 499))
+        self.assertTrue((np.diff(idx) > 0).all())
+
+
+class ChatAggregatedSeriesTests(TestCase):
+    """Granularités agrégées des tools de courbe : calculées par DuckDB
+    (services.get_courbe_aggregated), sans rapatrier les points bruts."""
+
+    AGG = pd.DataFrame({
+        "date_heure": pd.to_datetime(["2015-01-01", "2015-01-02"]),
+        "mean": [60_000.0, 62_000.0], "min": [50_000.0, 51_000.0],
+        "max": [70_000.0, 72_000.0], "energie_mwh": [1.44e6, 1.49e6],
+    })
+
+    def test_daily_sur_dix_ans_agrege_en_sql(self):
+        with mock.patch("consommation.services.get_courbe_aggregated", return_value=self.AGG) as agg, \
+                mock.patch("consommation.services.get_puissance_data") as raw:
+            payload = chat._tool_get_consommation(
+                {"granularity": "daily", "start": "2015-01-01", "end": "2024-12-31"})
+        raw.assert_not_called()
+        agg.assert_called_once_with("consommation", date(2015, 1, 1), date(2024, 12, 31),
+                                    key=None, step="daily")
+        self.assertEqual(payload["data"][0], {"date": "2015-01-01", "value": 60_000.0, "min": 50_000.0,
+                                              "max": 70_000.0, "energie_mwh": 1.44e6})
+
+    def test_echanges_weekly_par_pays(self):
+        with mock.patch("consommation.services.get_courbe_aggregated", return_value=self.AGG) as agg:
+            chat._tool_get_echanges({"pays": "ech_comm_espagne", "granularity": "weekly",
+                                     "start": "2015-01-01", "end": "2015-03-01"})
+        self.assertEqual(agg.call_args.kwargs, {"key": "ech_comm_espagne", "step": "weekly"})
+
+    def test_raw_au_dela_du_plafond_agrege_au_lieu_de_refuser(self):
+        with mock.patch("consommation.services.get_courbe_aggregated", return_value=self.AGG) as agg:
+            hourly = chat._tool_get_production(
+                {"filiere": "eolien", "granularity": "raw", "start": "2024-01-01", "end": "2024-06-30"})
+            daily = chat._tool_get_production(
+                {"filiere": "eolien", "granularity": "raw", "start": "2015-01-01", "end": "2024-06-30"})
+        self.assertNotIn("error", hourly)
+        self.assertEqual([c.kwargs["step"] for c in agg.call_args_list], ["hourly", "daily"])
+        self.assertEqual((hourly["granularity"], daily["granularity"]), ("hourly", "daily"))
+        self.assertIn("agrégées par heure", hourly["note"])
+
+    def test_raw_agrege_tient_dans_le_budget(self):
+        n = 4000  # au-delà de _MAX_ROWS : échantillonné
+        agg = pd.DataFrame({
+            "date_heure": pd.date_range("2024-01-01", periods=n, freq="h"),
+            "mean": [50_000.0 + (i % 24) * 100 for i in range(n)], "min": 40_000.0,
+            "max": 60_000.0, "energie_mwh": 50_000.0,
+        })
+        args = {"granularity": "raw", "start": "2024-01-01", "end": "2024-06-30"}
+        with mock.patch("consommation.services.get_courbe_aggregated", side_effect=lambda *a, **k: agg.copy()):
+            with override_settings(CHAT_TOOL_TOKEN_BUDGET=0):
+                full = chat._tool_get_consommation(args)
+            # Juste sous la taille à _SAMPLE_MAX points, note comprise.
+            budget = chat._payload_tokens(full) - 1
+            with override_settings(CHAT_TOOL_TOKEN_BUDGET=budget):
+                payload = chat._tool_get_consommation(args)
+        self.assertTrue(payload["note"].startswith("Période de 181 jours"))
+        self.assertIn("points représentatifs", payload["note"])
+        self.assertLessEqual(chat._payload_tokens(payload), budget)
+
+    def test_raw_court_reste_demi_horaire(self):
+        df = pd.DataFrame({"date_heure": pd.date_range("2024-01-01", periods=4, freq="30min"),
+                           "consommation": [1.0, 2.0, 3.0, 4.0], "source": "x"})
+        with mock.patch("consommation.services.get_puissance_data", return_value=df), \
+                mock.patch("consommation.services.get_courbe_aggregated") as agg:
+            payload = chat._tool_get_consommation(
+                {"granularity": "raw", "start": "2024-01-01", "end": "2024-01-02"})
+        agg.assert_not_called()
+        self.assertEqual([r["value"] for r in payload["data"]], [1.0, 2.0, 3.0, 4.0])
+
+
+class CalendrierTests(TestCase):
+    """Dimension calendrier (calendrier.py) et tools qui s'en servent."""
+
+    def test_table_types_de_jour_et_changements_d_heure(self):
+        cal = calendrier.get_calendar(date(2024, 1, 1), date(2024, 12, 31)).set_index("date")
+        self.assertEqual(len(cal), 366)
+        premier_mai = cal.loc["2024-05-01"]
+        self.assertEqual((premier_mai["type_jour"], premier_mai["nom_ferie"]), ("férié", "Fête du Travail"))
+        self.assertFalse(premier_mai["is_ouvrable"])
+        self.assertEqual(cal.loc["2024-05-04", "type_jour"], "samedi")
+        self.assertTrue(cal.loc["2024-05-04", "is_ouvrable"])
+        self.assertEqual(cal.loc["2024-03-31", "duree_h"], 23)
+        self.assertEqual(cal.loc["2024-10-27", "duree_h"], 25)
+        self.assertTrue(cal.loc["2024-07-14", "is_heure_ete"])
+        self.assertEqual(cal.loc["2024-12-21", "saison"], "hiver")
+        self.assertTrue((cal["is_ouvre"] == ~cal["is_weekend"] & ~cal["is_ferie"]).all())
+
+    def test_tool_get_calendrier(self):
+        out = chat._tool_get_calendrier({"start": "2024-04-30", "end": "2024-05-02"})
+        self.assertEqual(out["summary"], {"ouvrés": 2, "ouvrables": 2, "weekends": 0,
+                                          "fériés": 1, "total": 3})
+        self.assertEqual(out["jours"][1], {"date": "2024-05-01", "jour": "Mercredi", "is_ouvre": False,
+                                           "is_ouvrable": False, "is_weekend": False, "is_ferie": True,
+                                           "nom_ferie": "Fête du Travail"})
+        self.assertNotIn("nom_ferie", out["jours"][0])
+        # Résumé seul : plus de limite de plage.
+        long = chat._tool_get_calendrier({"start": "2015-01-01", "end": "2024-12-31", "summary": True})
+        self.assertEqual(long["summary"]["total"], 3653)
+        self.assertNotIn("jours", long)
+
+    def test_tool_stats_type_jour(self):
+        df = pd.DataFrame([{"groupe": "férié", "jours": 11, "mean": 55_123.456, "min": 40_000.0,
+                            "max": 70_000.0, "energie_mwh_jour": 1_300_000.04}])
+        with mock.patch("consommation.services.get_courbe_by_day_type", return_value=df) as m:
+            out = chat._tool_get_stats_type_jour(
+                {"dataset": "production", "filiere": "solaire", "start": "2023-01-01", "end": "2023-12-31"})
+        m.assert_called_once_with("production", date(2023, 1, 1), date(2023, 12, 31),
+                                  key="solaire", by="type_jour")
+        self.assertEqual(out["rows"][0]["mean"], 55_123.5)
+        self.assertIn("error", chat._tool_get_stats_type_jour(
+            {"dataset": "echanges", "start": "2023-01-01", "end": "2023-12-31"}))
+
 
 class ChatParcToolTests(TestCase):
     """Tool `get_parc` : historique mensuel du parc installé
@@ -458,12 +1047,12 @@ class ChatPruneHistoryTests(TestCase):
     def test_run_renvoie_un_historique_sans_plomberie_tool(self):
         with mock.patch.object(chat, "Mistral") as MockMistral, \
              mock.patch.object(chat, "_run_tool", return_value='{"ok": true}'):
-            complete = MockMistral.return_value.chat.complete
+            complete = MockMistral.return_value.chat.complete_async = mock.AsyncMock()
             complete.side_effect = [
                 self._fake_resp(tool_calls=[self._fake_tool_call()]),
                 self._fake_resp(content="La conso était de 55 GW."),
             ]
-            result = chat.ChatService().run([{"role": "user", "content": "conso hier ?"}])
+            result = async_to_sync(chat.ChatService().run)([{"role": "user", "content": "conso hier ?"}])
 
         # L'historique renvoyé au frontend ne contient que du texte.
         self.assertEqual(result["reply"], "La conso était de 55 GW.")
@@ -491,9 +1080,9 @@ class ChatPruneHistoryTests(TestCase):
             {"role": "user", "content": "et avant-hier ?"},
         ]
         with mock.patch.object(chat, "Mistral") as MockMistral:
-            complete = MockMistral.return_value.chat.complete
+            complete = MockMistral.return_value.chat.complete_async = mock.AsyncMock()
             complete.side_effect = [self._fake_resp(content="54 GW.")]
-            result = chat.ChatService().run(legacy)
+            result = async_to_sync(chat.ChatService().run)(legacy)
 
         sent = complete.call_args.kwargs["messages"]
         self.assertNotIn("tool", [m["role"] for m in sent])
@@ -511,8 +1100,9 @@ class ChatPruneHistoryTests(TestCase):
             {"role": "assistant", "content": "r"},
         ]
         with mock.patch.object(chat, "Mistral") as MockMistral:
-            MockMistral.return_value.chat.complete.side_effect = [self._fake_resp(content="ok")]
-            result = chat.ChatService().run(history)
+            MockMistral.return_value.chat.complete_async = mock.AsyncMock(
+                side_effect=[self._fake_resp(content="ok")])
+            result = async_to_sync(chat.ChatService().run)(history)
         self.assertNotIn("error", result)
 
 
@@ -794,7 +1384,15 @@ class AccountDeletionTests(TestCase):
         # Session locale vidée : l'utilisateur n'est plus connecté.
         self.assertNotIn("user", self.client.session)
 
+    def test_succes_supprime_les_conversations(self):
+        Conversation.objects.create(user_sub=self.SUB, messages=[{"role": "user", "content": "x"}])
+        self._login()
+        with mock.patch("consommation.account_views.delete_idp_user"):
+            self.client.post(self.URL, {"confirm": "SUPPRIMER"})
+        self.assertFalse(Conversation.objects.filter(user_sub=self.SUB).exists())
+
 
+@override_settings(PAGE_CACHE_MAX_AGE=0)  # couche testée : le contexte, sous le cache de page
 class AccueilCacheTests(TestCase):
     """Cache du contexte de l'accueil : le calcul (~1 s de DuckDB + Plotly,
     identique pour tous les visiteurs) ne doit tourner qu'une fois par clé
@@ -861,6 +1459,21 @@ class AccueilCacheTests(TestCase):
         _, dash2 = self._get_accueil(etag="etag2")
         self.assertEqual(dash2.call_count, 1)
 
+    def test_delestage_ni_absorbe_ni_cache(self):
+        for exc in (admission.Overloaded, deadlines.QueryTimeout):
+            with self.subTest(exc=exc.__name__), \
+                 mock.patch.object(views, "get_dashboard_data",
+                                   return_value=self._fake_dashboard_data()), \
+                 mock.patch.object(views, "get_echanges_net_by_border", return_value={}), \
+                 mock.patch.object(views, "get_parc_installe_data", side_effect=exc), \
+                 mock.patch.object(views.data_cache, "get_etag", return_value="e"):
+                resp = Client().get("/")
+            self.assertIn(resp.status_code, (503, 504))
+            self.assertNotIn("public", resp.get("Cache-Control", ""))
+        # Rien de figé : la visite suivante recalcule le tableau de bord.
+        _, dash = self._get_accueil(etag="e")
+        self.assertEqual(dash.call_count, 1)
+
     def test_contexte_vide_non_cache(self):
         with mock.patch.object(views, "get_dashboard_data", return_value=None) as dash, \
              mock.patch.object(views.data_cache, "get_etag", return_value="e"):
@@ -973,6 +1586,1159 @@ class EchangesImportExportAggTests(TestCase):
         fallback.assert_called_once_with(_date(2012, 1, 1), _date(2026, 7, 17), "total")
         self.assertTrue(res.equals(sentinel))
 
+    def test_pas_de_fallback_en_delestage(self):
+        for exc in (admission.Overloaded, deadlines.QueryTimeout, deadlines.ClientDisconnected):
+            with self.subTest(exc=exc.__name__), \
+                 mock.patch.object(services.data_cache, "get_local_path", return_value="agg.parquet"), \
+                 mock.patch.object(services, "get_duckdb_connection", side_effect=exc), \
+                 mock.patch.object(services, "get_echanges_annual_import_export") as fallback:
+                with self.assertRaises(exc):
+                    services.get_echanges_annual_import_export_agg("total")
+                fallback.assert_not_called()
+
     def test_pays_invalide(self):
         with self.assertRaises(ValueError):
             services.get_echanges_annual_import_export_agg("ech_comm_atlantide")
+
+
+class MetricsTests(TestCase):
+    """Endpoint /metrics : accès par token et agrégation multi-workers."""
+
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        override = override_settings(METRICS_DIR=self._tmp.name, METRICS_TOKEN="tok")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_desactive_sans_token(self):
+        with override_settings(METRICS_TOKEN=""):
+            resp = Client().get("/metrics", HTTP_AUTHORIZATION="Bearer tok")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_token_invalide(self):
+        resp = Client().get("/metrics", HTTP_AUTHORIZATION="Bearer autre")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_format_prometheus(self):
+        compteur = metrics.Counter("elecstat_test_total", "Test.", ["cache"])
+        histo = metrics.Histogram("elecstat_test_seconds", "Test.", ["function"], buckets=(0.1, 1.0))
+        compteur.inc(cache='ch"arts')
+        histo.observe(0.05, function="f")
+        histo.observe(0.5, function="f")
+
+        resp = Client().get("/metrics", HTTP_AUTHORIZATION="Bearer tok")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = resp.content.decode()
+        self.assertIn("# TYPE elecstat_test_total counter", body)
+        self.assertIn('elecstat_test_total{cache="ch\\"arts"} 1', body)
+        self.assertIn('elecstat_test_seconds_bucket{function="f",le="0.1"} 1', body)
+        self.assertIn('elecstat_test_seconds_bucket{function="f",le="1"} 2', body)
+        self.assertIn('elecstat_test_seconds_bucket{function="f",le="+Inf"} 2', body)
+        self.assertIn('elecstat_test_seconds_count{function="f"} 2', body)
+
+    def test_agrege_les_workers_et_archive_les_morts(self):
+        import os
+        compteur = metrics.Counter("elecstat_test_workers_total", "Test.", ["cache"])
+        compteur.inc(2, cache="charts")
+        # Instantané d'un worker recyclé (pid inexistant).
+        mort = {"elecstat_test_workers_total": {
+            "kind": "counter", "help": "Test.", "labelnames": ["cache"],
+            "samples": [[["charts"], 3.0]],
+        }}
+        with open(os.path.join(self._tmp.name, "999999999-1.json"), "w") as f:
+            json.dump(mort, f)
+
+        for _ in range(2):  # l'archivage ne doit pas compter deux fois
+            body = metrics.render()
+            self.assertIn('elecstat_test_workers_total{cache="charts"} 5', body)
+        self.assertFalse(os.path.exists(os.path.join(self._tmp.name, "999999999-1.json")))
+
+    def test_flush_hors_du_chemin_de_requete(self):
+        compteur = metrics.Counter("elecstat_test_timer_total", "Test.", ["cache"])
+        with mock.patch.object(metrics, "_last_flush", 0.0), \
+             mock.patch.object(metrics, "_flush_timer", None), \
+             mock.patch.object(metrics.threading, "Timer") as timer, \
+             mock.patch.object(metrics, "flush") as flush:
+            compteur.inc(cache="charts")  # intervalle échu : flush immédiat… mais en tâche de fond
+            compteur.inc(cache="charts")  # timer déjà programmé
+        flush.assert_not_called()
+        timer.assert_called_once_with(0.0, metrics._timer_flush)
+
+    def test_flushs_concurrents(self):
+        metrics.Counter("elecstat_test_concurrent_total", "Test.", ["cache"]).inc(cache="charts")
+        threads = [threading.Thread(target=metrics.flush) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        with open(os.path.join(self._tmp.name, f"{metrics._process_id}.json")) as f:
+            self.assertIn("elecstat_test_concurrent_total", json.load(f))
+        self.assertEqual([p for p in os.listdir(self._tmp.name) if p.endswith(".tmp")], [])
+
+
+class QueryLogTests(TestCase):
+    """Journal des requêtes DuckDB lentes et capture du profil JSON."""
+
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.path = f"{self._tmp.name}/puissance.parquet"
+        pd.DataFrame({
+            "date_heure": pd.date_range("2024-01-01", periods=96, freq="15min"),
+            "consommation": [50000.0] * 96,
+            "source": ["Données consolidées"] * 96,
+        }).to_parquet(self.path, index=False)
+        patcher = mock.patch.object(services.data_cache, "get_local_path", return_value=self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requete_lente_journalisee(self):
+        # Seuil quasi nul : toute requête est « lente », sans dépendre du chrono.
+        with mock.patch.object(query_log, "_slow_threshold", return_value=1e-9), \
+             self.assertLogs("consommation.query_log", level="WARNING") as logs:
+            services.get_puissance_data(date(2024, 1, 1), date(2024, 1, 1))
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("function=get_puissance_data", logs.output[0])
+        self.assertIn("rows=96", logs.output[0])
+        self.assertIn("2024-01-01 23:59:59", logs.output[0])
+
+    def test_seuil_nul_connexion_brute(self):
+        with override_settings(DUCKDB_SLOW_QUERY_MS=0, DUCKDB_PROFILE=False):
+            with services.get_duckdb_connection(self.path) as conn:
+                self.assertNotIsInstance(conn, query_log.LoggedConnection)
+
+    def test_profilage_ecrit_le_plan(self):
+        log_path = f"{self._tmp.name}/profile.log"
+        query_log._profile_logger.handlers.clear()
+        self.addCleanup(query_log._profile_logger.handlers.clear)
+        with override_settings(DUCKDB_PROFILE_LOG=log_path, DUCKDB_SLOW_QUERY_MS=0), \
+             query_log.profiling():
+            services.get_puissance_data(date(2024, 1, 1), date(2024, 1, 1))
+
+        with open(log_path) as f:
+            entry = json.loads(f.readline())
+        self.assertEqual(entry["function"], "get_puissance_data")
+        self.assertEqual(entry["rows"], 96)
+        self.assertIn("children", entry["profile"])
+
+    def test_fichier_de_profil_supprime_a_la_fermeture(self):
+        query_log._profile_logger.handlers.clear()
+        self.addCleanup(query_log._profile_logger.handlers.clear)
+        with override_settings(DUCKDB_PROFILE_LOG=f"{self._tmp.name}/profile.log", DUCKDB_SLOW_QUERY_MS=0), \
+             query_log.profiling():
+            with services.get_duckdb_connection(self.path) as conn:
+                conn.execute("SELECT 1").fetchdf()
+                profile_path = conn._profile_path
+                self.assertTrue(os.path.exists(profile_path))
+        self.assertFalse(os.path.exists(profile_path))
+
+    def test_requete_en_echec_journalisee(self):
+        with mock.patch.object(query_log, "_slow_threshold", return_value=1e-9), \
+             self.assertLogs("consommation.query_log", level="WARNING") as logs:
+            with services.get_duckdb_connection(self.path) as conn:
+                with self.assertRaises(duckdb.Error):
+                    conn.execute("SELECT * FROM read_parquet('/nulle/part.parquet')").fetchall()
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("status=IOException", logs.output[0])
+
+    def test_requete_interrompue_journalisee(self):
+        with mock.patch.object(query_log, "_slow_threshold", return_value=1e-9), \
+             self.assertLogs("consommation.query_log", level="WARNING") as logs, \
+             self.assertRaises(deadlines.QueryTimeout), deadlines.deadline(0.3):
+            with services.get_duckdb_connection() as conn:
+                conn.execute(DeadlinesTests._SLOW_SQL).fetchall()
+
+        self.assertIn("status=interrupted", logs.output[0])
+
+    def test_export_streame_journalise(self):
+        with mock.patch.object(query_log, "_slow_threshold", return_value=1e-9), \
+             self.assertLogs("consommation.query_log", level="WARNING") as logs:
+            chunks = list(services.stream_courbe(
+                "consommation", date(2024, 1, 1), date(2024, 1, 1), batch_rows=10,
+            ))
+
+        self.assertEqual(sum(len(c) for c in chunks), 96)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("status=ok", logs.output[0])
+        self.assertIn("rows=96", logs.output[0])
+
+    def test_lecture_par_lots_abandonnee_journalisee(self):
+        with mock.patch.object(query_log, "_slow_threshold", return_value=1e-9), \
+             self.assertLogs("consommation.query_log", level="WARNING") as logs:
+            with services.get_duckdb_connection(self.path) as conn:
+                reader = conn.execute("SELECT * FROM range(100)").fetch_record_batch(10)
+                batches = iter(reader)
+                next(batches)
+                batches.close()  # lecteur parti après le premier lot
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("status=partial", logs.output[0])
+
+
+class DeadlinesTests(TestCase):
+    """Échéance DuckDB : interrupt → QueryTimeout / ClientDisconnected → 504 / 503."""
+
+    _SLOW_SQL = "SELECT count(*) FROM range(100000000000) t(i) WHERE i % 7 = 3"
+
+    def test_requete_interrompue_a_echeance(self):
+        import time as _time
+        start = _time.monotonic()
+        with self.assertRaises(deadlines.QueryTimeout), deadlines.deadline(0.3):
+            with services.get_duckdb_connection() as conn:
+                conn.execute(self._SLOW_SQL).fetchall()
+        self.assertLess(_time.monotonic() - start, 5)
+
+    def test_client_deconnecte(self):
+        with self.assertRaises(deadlines.ClientDisconnected), \
+             deadlines.deadline(30, disconnected=lambda: True):
+            with services.get_duckdb_connection() as conn:
+                conn.execute(self._SLOW_SQL).fetchall()
+
+    def test_echeance_deja_passee(self):
+        # Fonction qui enchaîne les requêtes : la suivante n'est même pas lancée.
+        with deadlines.deadline(1e-9):
+            with self.assertRaises(deadlines.QueryTimeout):
+                with services.get_duckdb_connection():
+                    pass
+
+    def test_sans_echeance_pas_de_surveillance(self):
+        with services.get_duckdb_connection() as conn:
+            self.assertEqual(conn.execute("SELECT 1").fetchall(), [(1,)])
+        self.assertFalse(deadlines._watches)
+
+    def test_api_renvoie_504(self):
+        cache.clear()
+        _make_key(VALID_KEY, "alice")
+        with mock.patch("consommation.services.get_parc_installe_data",
+                        side_effect=deadlines.QueryTimeout("trop long")):
+            resp = TestClient(api).get(PARC_ENDPOINT, headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 504)
+        self.assertIn("detail", resp.json())
+
+    def test_middleware_traduit_en_504_json_pour_xhr(self):
+        request = RequestFactory().get("/consommation/", HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        middleware = deadlines.DeadlineMiddleware(lambda r: None)
+        resp = middleware.process_exception(request, deadlines.QueryTimeout())
+        self.assertEqual(resp.status_code, 504)
+        self.assertIn("error", json.loads(resp.content))
+        self.assertIsNone(middleware.process_exception(request, ValueError()))
+
+    @override_settings(DUCKDB_QUERY_TIMEOUT=25)
+    def test_echeance_active_pendant_le_streaming(self):
+        def view(request):
+            return StreamingHttpResponse(str(deadlines.remaining()) for _ in range(2))
+
+        resp = deadlines.DeadlineMiddleware(view)(RequestFactory().get("/"))
+        self.assertIsNone(deadlines.remaining())  # posée lot par lot seulement
+        self.assertTrue(all(float(chunk) > 20 for chunk in resp.streaming_content))
+        self.assertIsNone(deadlines.remaining())
+
+    @override_settings(DUCKDB_QUERY_TIMEOUT=0.3)
+    def test_requete_du_corps_streame_interrompue(self):
+        def body():
+            with services.get_duckdb_connection() as conn:
+                yield str(conn.execute(self._SLOW_SQL).fetchall())
+
+        resp = deadlines.DeadlineMiddleware(lambda r: StreamingHttpResponse(body()))(
+            RequestFactory().get("/")
+        )
+        with self.assertRaises(deadlines.QueryTimeout):
+            b"".join(resp.streaming_content)
+
+    @override_settings(DUCKDB_QUERY_TIMEOUT=25)
+    def test_echeance_active_pendant_le_streaming_asynchrone(self):
+        async def body():
+            yield str(deadlines.remaining())
+
+        async def view(request):
+            return StreamingHttpResponse(body())
+
+        async def consume():
+            resp = await deadlines.DeadlineMiddleware(view)(RequestFactory().get("/"))
+            return [chunk async for chunk in resp.streaming_content]
+
+        self.assertGreater(float(async_to_sync(consume)()[0]), 20)
+
+
+@override_settings(DUCKDB_MEMORY_BUDGET_MB=256, DUCKDB_ADMISSION_TIMEOUT=5)
+class AdmissionTests(TestCase):
+    """Budget mémoire DuckDB par worker : file par priorité, refus borné."""
+
+    def test_priorite_interactive_avant_export(self):
+        import threading
+        controller = admission._Controller()
+        self.assertTrue(controller.acquire(256, admission.INTERACTIVE, 1))  # budget plein
+        order = []
+
+        def waiter(level, name):
+            controller.acquire(256, level, 5)
+            order.append(name)
+            controller.release(256)
+
+        bulk = threading.Thread(target=waiter, args=(admission.BULK, "export"))
+        bulk.start()
+        while not controller._queue:
+            pass
+        interactive = threading.Thread(target=waiter, args=(admission.INTERACTIVE, "graphique"))
+        interactive.start()
+        while len(controller._queue) < 2:
+            pass
+        controller.release(256)
+        bulk.join(5)
+        interactive.join(5)
+        self.assertEqual(order, ["graphique", "export"])
+
+    def test_refus_si_budget_sature(self):
+        with override_settings(DUCKDB_ADMISSION_TIMEOUT=0):
+            admission._controller.acquire(256, admission.INTERACTIVE, 1)
+            try:
+                with self.assertRaises(admission.Overloaded):
+                    with services.get_duckdb_connection():
+                        pass
+            finally:
+                admission._controller.release(256)
+
+    def test_connexion_imbriquee_sans_interblocage(self):
+        with services.get_duckdb_connection():
+            with services.get_duckdb_connection(memory_mb=services.LIGHT_QUERY_MB) as conn:
+                self.assertEqual(conn.execute("SELECT 42").fetchall(), [(42,)])
+        self.assertEqual(admission._controller._in_use, 0)
+
+    def test_api_renvoie_503_avec_retry_after(self):
+        cache.clear()
+        _make_key(VALID_KEY, "alice")
+        with mock.patch("consommation.services.get_parc_installe_data",
+                        side_effect=admission.Overloaded("saturé")):
+            resp = TestClient(api).get(PARC_ENDPOINT, headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "5")
+
+
+class AnonymousPageCacheTests(TestCase):
+    """Cache de page complète : HTML servi tel quel aux anonymes, avec
+    Cache-Control public ; les visiteurs connectés gardent le rendu dynamique."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def _get_accueil(self, client=None, dashboard=None):
+        with mock.patch.object(views, "get_dashboard_data",
+                               return_value=dashboard) as dash, \
+             mock.patch.object(views, "get_echanges_net_by_border", side_effect=Exception), \
+             mock.patch.object(views, "get_parc_installe_data", side_effect=Exception), \
+             mock.patch.object(views, "get_echanges_annual_import_export", side_effect=Exception), \
+             mock.patch.object(views.data_cache, "get_etag", return_value="e"):
+            resp = (client or Client()).get("/")
+        return resp, dash
+
+    def _dashboard(self):
+        return AccueilCacheTests._fake_dashboard_data()
+
+    def test_anonyme_servi_depuis_le_cache(self):
+        resp1, dash1 = self._get_accueil(dashboard=self._dashboard())
+        with mock.patch.object(views, "render") as render:
+            resp2, dash2 = self._get_accueil(dashboard=self._dashboard())
+
+        self.assertEqual(dash1.call_count, 1)
+        self.assertEqual(dash2.call_count, 0)
+        render.assert_not_called()  # pas même le rendu du template
+        self.assertEqual(resp2.content, resp1.content)
+        self.assertIn("public", resp2["Cache-Control"])
+        self.assertIn("max-age=300", resp2["Cache-Control"])
+        self.assertIn("Cookie", resp2["Vary"])
+        self.assertNotIn("sessionid", resp2.cookies)
+
+    def test_utilisateur_connecte_rendu_dynamique(self):
+        self._get_accueil(dashboard=self._dashboard())  # remplit le cache anonyme
+        client = Client()
+        session = client.session
+        session["user"] = {"sub": "u1", "email": "a@b.c"}
+        session.save()
+        client.cookies[django_settings.SESSION_COOKIE_NAME] = session.session_key
+
+        resp, _ = self._get_accueil(client=client, dashboard=self._dashboard())
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(resp.context)  # rendu effectif, pas le HTML caché
+        self.assertNotIn("public", resp.get("Cache-Control", ""))
+
+    def test_page_avec_jeton_csrf_non_cachee(self):
+        from django.middleware.csrf import CsrfViewMiddleware, get_token
+        calls = []
+
+        @views.anonymous_page_cache(("puissance",))
+        def page(request):
+            calls.append(request)
+            return HttpResponse(f"<form>{get_token(request)}</form>")
+
+        def get():
+            request = RequestFactory().get("/page")
+            request.session = SessionStore()
+            return CsrfViewMiddleware(page)(request)
+
+        with mock.patch.object(views.data_cache, "get_etag", return_value="e"):
+            resp1, resp2 = get(), get()
+        self.assertEqual(len(calls), 2)  # jamais servie depuis le cache
+        self.assertNotIn("public", resp2.get("Cache-Control", ""))
+        self.assertIn(django_settings.CSRF_COOKIE_NAME, resp2.cookies)
+
+    def test_page_degradee_non_cachee(self):
+        resp1, _ = self._get_accueil(dashboard=None)
+        self.assertIn("no-cache", resp1["Cache-Control"])
+        resp2, dash2 = self._get_accueil(dashboard=self._dashboard())
+        self.assertEqual(dash2.call_count, 1)
+        self.assertTrue(resp2.context["has_dashboard_data"])
+
+
+class ApiKeyCacheTests(TestCase):
+    """Vérification des clés en cache : plus d'aller-retour base sur le chemin
+    chaud, révocation immédiate, last_used_at écrit par lots."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestClient(api)
+        self.key = _make_key(VALID_KEY, "alice")
+        patch = mock.patch("consommation.services.get_parc_installe_data", return_value=FAKE_PARC)
+        patch.start()
+        self.addCleanup(patch.stop)
+        api_auth._pending_last_used.clear()
+        self.addCleanup(api_auth._pending_last_used.clear)
+
+    def _auth(self):
+        return async_to_sync(api_auth.ApiKeyAuth().authenticate)(None, VALID_KEY)
+
+    def test_identite_servie_sans_requete_sql(self):
+        self.assertEqual(self._auth(), "user:test|alice")
+        with self.assertNumQueries(0):
+            self.assertEqual(self._auth(), "user:test|alice")
+
+    def test_revocation_immediate(self):
+        self._auth()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.key.revoke()
+        self.assertIsNone(self._auth())
+        resp = self.client.get(PARC_ENDPOINT, headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 401)
+
+    def test_anonymisation_invalide_le_cache(self):
+        self._auth()
+        with self.captureOnCommitCallbacks(execute=True):
+            ApiKey.anonymize_user("test|alice")
+        self.assertIsNone(self._auth())
+
+    def test_last_used_at_ecrit_par_lots(self):
+        with override_settings(API_KEY_LAST_USED_FLUSH=3600):
+            self._auth()
+            self._auth()
+        self.key.refresh_from_db()
+        self.assertIsNone(self.key.last_used_at)  # encore en attente
+
+        with self.assertNumQueries(1):
+            api_auth.flush_last_used()
+        self.key.refresh_from_db()
+        self.assertIsNotNone(self.key.last_used_at)
+
+    def test_invalidation_apres_commit(self):
+        self._auth()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.key.revoke()
+            # Transaction non validée : l'identité en cache reste servie.
+            self.assertEqual(self._auth(), "user:test|alice")
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(self._auth())
+
+    def test_revocation_pendant_la_lecture_non_cachee(self):
+        real_first = ApiKey.objects.filter(key_hash=VALID_HASH).first
+
+        def first_then_revoke(*args, **kwargs):
+            key = real_first()
+            api_auth.invalidate_cache()  # révocation validée entre SELECT et cache.set
+            return key
+
+        with mock.patch("django.db.models.query.QuerySet.first", first_then_revoke):
+            self._auth()
+        self.assertIsNone(cache.get(api_auth._cache_key(VALID_HASH)))
+
+    def test_flush_a_l_arret_ignore_une_base_non_migree(self):
+        with override_settings(API_KEY_LAST_USED_FLUSH=3600):
+            self._auth()
+        with mock.patch.object(api_auth.connection.introspection, "table_names", return_value=[]), \
+             mock.patch.object(api_auth, "flush_last_used") as flush:
+            api_auth._flush_at_exit()
+        flush.assert_not_called()
+
+
+class SeriesEndpointTests(TestCase):
+    """/series : plusieurs courbes alignées sur un axe commun, une lecture par fichier."""
+
+    def setUp(self):
+        import tempfile
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        pas = pd.date_range("2024-01-01", periods=4, freq="15min")
+        paths = {
+            "puissance": f"{self._tmp.name}/conso.parquet",
+            "production": f"{self._tmp.name}/prod.parquet",
+            "echanges": f"{self._tmp.name}/ech.parquet",
+        }
+        pd.DataFrame({"date_heure": pas, "consommation": [1.0, 2.0, 3.0, 4.0],
+                      "source": "x"}).to_parquet(paths["puissance"], index=False)
+        prod = pd.DataFrame({"date_heure": pas[::2], "source": "x"})
+        for f in services.get_production_filieres():
+            prod[f] = 10.0
+        prod.to_parquet(paths["production"], index=False)
+        ech = pd.DataFrame({"date_heure": pas, "source": "x"})
+        for p in services.get_echanges_pays():
+            ech[p] = 1.0
+        ech.to_parquet(paths["echanges"], index=False)
+        patch = mock.patch.object(services.data_cache, "get_local_path", side_effect=paths.get)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get(self, series):
+        return self.client.get(
+            f"/series?debut=2024-01-01&fin=2024-01-01&series={series}", headers=AUTH_HEADER
+        )
+
+    def test_series_alignees(self):
+        resp = self._get("consommation,production:nucleaire,echange:total")
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual(body["series"], ["consommation", "production:nucleaire", "echange:total"])
+        self.assertEqual(body["count"], 4)
+        self.assertEqual(body["valeurs"]["consommation"], [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(body["valeurs"]["production:nucleaire"], [10.0, None, 10.0, None])
+        self.assertEqual(body["valeurs"]["echange:total"], [5.0] * 4)  # 5 frontières commerciales
+
+    def test_joker_toutes_les_filieres(self):
+        body = self._get("production:*").json()
+        self.assertEqual(len(body["series"]), len(services.get_production_filieres()))
+
+    def test_serie_inconnue_400(self):
+        self.assertEqual(self._get("meteo").status_code, 400)
+        cache.clear()  # quota de rafale
+        self.assertEqual(self._get("production:atome").status_code, 400)
+
+
+class ColumnsFormatTests(TestCase):
+    """`format=columns` : mêmes données que le format lignes, une liste par colonne."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        df = pd.DataFrame({
+            "date_heure": pd.date_range("2024-01-01", periods=3, freq="15min"),
+            "consommation": [50000.0, float("nan"), 52000.0],
+            "source": ["Données Consolidées", "Temps Réel", "Temps Réel"],
+        })
+        patch = mock.patch("consommation.services.get_puissance_data", return_value=df)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get(self, fmt):
+        cache.clear()  # quota de rafale
+        return self.client.get(
+            f"/courbe_conso?debut=2024-01-01&fin=2024-01-01&format={fmt}", headers=AUTH_HEADER
+        )
+
+    def test_colonnes_equivalentes_aux_lignes(self):
+        rows = self._get("rows").json()
+        resp = self._get("columns")
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual(body["format"], "columns")
+        self.assertEqual(body["count"], 3)
+        self.assertEqual(body["debut"], "2024-01-01")
+        self.assertEqual(body["data"]["consommation"], [50000.0, None, 52000.0])
+        self.assertEqual(body["data"]["source"], ["Données Consolidées", "Temps Réel", "Temps Réel"])
+        self.assertEqual(body["data"]["date_heure"], [r["date_heure"] for r in rows["data"]])
+
+    def test_repli_sans_orjson(self):
+        from . import api as api_module
+        with mock.patch.object(api_module, "orjson", None):
+            body = self._get("columns").json()
+        self.assertEqual(body["data"]["consommation"], [50000.0, None, 52000.0])
+        self.assertEqual(body["data"]["date_heure"][0], "2024-01-01T00:00:00")
+
+    def test_format_inconnu_refuse(self):
+        self.assertEqual(self._get("xml").status_code, 422)
+
+
+class StreamingFormatTests(TestCase):
+    """`format=ndjson|csv` : courbes streamées par lots, plage étendue."""
+
+    def setUp(self):
+        import tempfile
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        path = f"{self._tmp.name}/prod.parquet"
+        prod = pd.DataFrame({
+            "date_heure": pd.date_range("2020-01-01", periods=5, freq="365D"),
+            "source": ["Consolidated Data"] * 4 + ["Real-Time Data"],
+        })
+        for f in services.get_production_filieres():
+            prod[f] = 100.0
+        prod.loc[2, "nucleaire"] = None
+        prod.to_parquet(path, index=False)
+        patch = mock.patch.object(services.data_cache, "get_local_path", return_value=path)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get(self, format, fin="2024-12-31", filiere="nucleaire"):
+        return self.client.get(
+            f"/courbe_prod?debut=2020-01-01&fin={fin}&filiere={filiere}&format={format}",
+            headers=AUTH_HEADER,
+        )
+
+    def test_ndjson_une_ligne_par_point(self):
+        resp = self._get("ndjson")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in resp.content.decode().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0], {"date_heure": "2020-01-01T00:00:00",
+                                    "production": 100.0, "source": "Données Consolidées"})
+        self.assertIsNone(lines[2]["production"])
+        self.assertEqual(lines[4]["source"], "Temps Réel")
+
+    def test_csv_avec_entete_unique(self):
+        resp = self._get("csv")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("attachment", resp["Content-Disposition"])
+        lines = resp.content.decode().splitlines()
+        self.assertEqual(lines[0], "date_heure,production,source")
+        self.assertEqual(len(lines), 6)
+
+    def test_lots_successifs(self):
+        chunks = list(services.stream_courbe(
+            "production", date(2020, 1, 1), date(2024, 12, 31), "nucleaire", batch_rows=2
+        ))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum(len(c) for c in chunks), 5)
+
+    @override_settings(DUCKDB_MEMORY_BUDGET_MB=256)
+    def test_connexion_liberee_avant_le_telechargement(self):
+        stream = services.stream_courbe(
+            "production", date(2020, 1, 1), date(2024, 12, 31), "nucleaire", batch_rows=2
+        )
+        opened, real_connect = [], duckdb.connect
+
+        def connect(*args, **kwargs):
+            opened.append(real_connect(*args, **kwargs))
+            return opened[-1]
+
+        with mock.patch.object(services.duckdb, "connect", side_effect=connect):
+            first = next(stream)
+        # Premier lot reçu : calcul fini, budget rendu, connexion fermée.
+        self.assertEqual(admission._controller._in_use, 0)
+        with self.assertRaises(duckdb.ConnectionException):
+            opened[0].execute("SELECT 1")
+        rest = list(stream)
+        self.assertEqual(len(first) + sum(len(c) for c in rest), 5)
+
+    def test_plage_etendue_reservee_au_streaming(self):
+        self.assertEqual(self._get("rows").status_code, 400)  # > MAX_RANGE_DAYS
+        cache.clear()
+        self.assertEqual(self._get("ndjson").status_code, 200)
+        cache.clear()
+        self.assertEqual(self._get("ndjson", fin="2031-01-01").status_code, 400)
+
+    def test_filiere_invalide_avant_envoi(self):
+        self.assertEqual(self._get("csv", filiere="atome").status_code, 400)
+
+
+class ResampleTests(TestCase):
+    """`pas` / `agg` : ré-échantillonnage DuckDB (time_bucket) des courbes."""
+
+    def setUp(self):
+        import tempfile
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        path = f"{self._tmp.name}/conso.parquet"
+        pas = pd.date_range("2024-01-01", periods=2 * 96, freq="15min")  # 2 jours
+        df = pd.DataFrame({"date_heure": pas, "consommation": 1000.0, "source": "x"})
+        df.loc[df["date_heure"].dt.day == 2, "consommation"] = 3000.0
+        df.loc[1, "consommation"] = 5000.0  # pic le 1er à 00:15
+        # Doublon (chevauchement de sources) : moyenné avant agrégation
+        dup = pd.DataFrame({"date_heure": [pas[0]], "consommation": [3000.0], "source": ["y"]})
+        pd.concat([df, dup]).to_parquet(path, index=False)
+        patch = mock.patch.object(services.data_cache, "get_local_path", return_value=path)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _resample(self, pas, agg="mean"):
+        return services.get_courbe_resampled(
+            "consommation", date(2024, 1, 1), date(2024, 1, 2), pas=pas, agg=agg
+        )
+
+    def test_moyenne_horaire(self):
+        df = self._resample("1h")
+        self.assertEqual(len(df), 48)
+        # 00:00 = moyenne(1000, 3000) = 2000, puis 5000, 1000, 1000
+        self.assertEqual(df["consommation"].iloc[0], (2000 + 5000 + 1000 + 1000) / 4)
+        self.assertEqual(df["consommation"].iloc[-1], 3000.0)
+
+    def test_min_max_journaliers(self):
+        self.assertEqual(self._resample("1j", "max")["consommation"].tolist(), [5000.0, 3000.0])
+        self.assertEqual(self._resample("1j", "min")["consommation"].tolist(), [1000.0, 3000.0])
+
+    def test_energie_journaliere(self):
+        df = self._resample("1j", "energie")
+        # Jour 2 : 95 pas de 15 min à 3000 MW ; le dernier, sans successeur,
+        # compte pour 1 h (LEAST ignore NULL, comme *_energie_mensuelle)
+        self.assertEqual(df["consommation"].iloc[1], 3000.0 * (0.25 * 95 + 1))
+
+    def test_semaine_commence_lundi(self):
+        df = self._resample("1sem")
+        self.assertEqual(len(df), 1)
+        self.assertEqual(df["date_heure"].iloc[0], pd.Timestamp("2024-01-01"))  # un lundi
+
+    def test_agregat_chatbot_toutes_stats_en_une_requete(self):
+        df = services.get_courbe_aggregated("consommation", date(2024, 1, 1), date(2024, 1, 2))
+        self.assertEqual(list(df.columns), ["date_heure", "mean", "min", "max", "energie_mwh"])
+        self.assertEqual(df["max"].tolist(), [5000.0, 3000.0])
+        self.assertEqual(df["min"].tolist(), [1000.0, 3000.0])
+        self.assertEqual(df["energie_mwh"].iloc[1], self._resample("1j", "energie")["consommation"].iloc[1])
+        weekly = services.get_courbe_aggregated(
+            "consommation", date(2024, 1, 1), date(2024, 1, 2), step="weekly")
+        self.assertEqual(len(weekly), 1)
+        with self.assertRaises(ValueError):
+            services.get_courbe_aggregated("consommation", date(2024, 1, 1), date(2024, 1, 2), step="1j")
+
+    def test_jointure_calendrier_par_type_de_jour(self):
+        # 1er janvier 2024 : férié (Jour de l'an, un lundi) ; 2 janvier : ouvré.
+        df = services.get_courbe_by_day_type("consommation", date(2024, 1, 1), date(2024, 1, 2))
+        rows = {r["groupe"]: r for r in df.to_dict(orient="records")}
+        self.assertEqual(set(rows), {"férié", "ouvré"})
+        self.assertEqual(rows["ouvré"]["mean"], 3000.0)
+        self.assertAlmostEqual(rows["férié"]["mean"], (2000 + 5000 + 94 * 1000) / 96)
+        self.assertEqual((rows["férié"]["jours"], rows["férié"]["max"]), (1, 5000.0))
+        feries = services.get_courbe_by_day_type(
+            "consommation", date(2024, 1, 1), date(2024, 1, 2), by="ferie")
+        self.assertEqual(feries["groupe"].tolist(), ["Jour de l'an"])
+
+    def test_endpoint_et_unite(self):
+        resp = self.client.get("/courbe_conso?debut=2024-01-01&fin=2024-01-02&pas=1j&agg=energie",
+                               headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertEqual((body["count"], body["unite"], body["pas"]), (2, "MWh", "1j"))
+        self.assertIsNone(body["data"][0]["source"])
+
+    def test_plage_proportionnelle_au_pas(self):
+        url = "/courbe_conso?debut=2000-01-01&fin=2024-01-02"
+        self.assertEqual(self.client.get(url, headers=AUTH_HEADER).status_code, 400)
+        cache.clear()
+        self.assertEqual(self.client.get(url + "&pas=1j", headers=AUTH_HEADER).status_code, 200)
+
+    def test_agg_sans_pas_refuse(self):
+        resp = self.client.get("/courbe_conso?debut=2024-01-01&fin=2024-01-02&agg=max",
+                               headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 400)
+
+
+class PaginationTests(TestCase):
+    """`limite` / `curseur` : pagination keyset des courbes, sans ligne perdue."""
+
+    def setUp(self):
+        import tempfile
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        path = f"{self._tmp.name}/conso.parquet"
+        pas = pd.date_range("2015-01-01", periods=250, freq="15min")
+        df = pd.DataFrame({"date_heure": pas, "consommation": range(250), "source": "Temps Réel"})
+        # Doublons (deux sources) à cheval sur la frontière de la 1re page
+        dup = df.iloc[98:101].assign(source="Données Consolidées")
+        pd.concat([df, dup]).to_parquet(path, index=False)
+        patch = mock.patch.object(services.data_cache, "get_local_path", return_value=path)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _get(self, query):
+        cache.clear()  # quota de rafale : une page par appel
+        return self.client.get(f"/courbe_conso?debut=2015-01-01&fin=2024-12-31&{query}",
+                               headers=AUTH_HEADER)
+
+    def test_parcours_complet(self):
+        rows, query, pages = [], "limite=100", 0
+        while True:
+            body = self._get(query).json()
+            rows += body["data"]
+            pages += 1
+            if body["next_cursor"] is None:
+                break
+            query = f"limite=100&curseur={body['next_cursor']}"
+        self.assertEqual(len(rows), 253)
+        self.assertEqual(len({(r["date_heure"], r["source"]) for r in rows}), 253)
+        self.assertEqual(pages, 3)
+
+    def test_page_ne_coupe_pas_un_horodatage(self):
+        body = self._get("limite=100").json()
+        # 98 horodatages + 2 doublons = 100 lignes ; le 99e (doublonné) attend la page 2
+        last = body["data"][-1]["date_heure"]
+        self.assertEqual(body["next_cursor"], last)
+        self.assertEqual(sum(r["date_heure"] == last for r in body["data"]), 2)
+
+    def test_curseur_anterieur_au_debut(self):
+        # `debut` changé en gardant l'ancien curseur : la ligne de minuit reste due.
+        cache.clear()
+        body = self.client.get("/courbe_conso?debut=2015-01-02&fin=2024-12-31&limite=100"
+                               "&curseur=2015-01-01T12:00:00", headers=AUTH_HEADER).json()
+        self.assertEqual(body["data"][0]["date_heure"], "2015-01-02T00:00:00")
+
+    def test_plage_libre_en_pagination(self):
+        self.assertEqual(self._get("").status_code, 400)  # > MAX_RANGE_DAYS sans pagination
+        self.assertEqual(self._get("limite=100").status_code, 200)
+
+    def test_parametres_invalides(self):
+        self.assertEqual(self._get("limite=5").status_code, 400)
+        self.assertEqual(self._get("curseur=hier").status_code, 400)
+        self.assertEqual(self._get("limite=100&pas=1h").status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    """ETag / X-Data-Version sur l'API, 304 sans DuckDB ni quota soutenu."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self.parc = mock.patch("consommation.services.get_parc_installe_data", return_value=FAKE_PARC)
+        self.loader = self.parc.start()
+        self.addCleanup(self.parc.stop)
+        version = mock.patch.object(data_cache, "data_version", return_value="v1")
+        self.version = version.start()
+        self.addCleanup(version.stop)
+
+    def _get(self, etag=None):
+        headers = dict(AUTH_HEADER, **({"If-None-Match": etag} if etag else {}))
+        return self.client.get(PARC_ENDPOINT, headers=headers)
+
+    def test_entetes_sur_200(self):
+        resp = self._get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["ETag"].startswith('"'))
+        self.assertEqual(resp["X-Data-Version"], "v1")
+
+    def test_304_sans_recalcul(self):
+        etag = self._get()["ETag"]
+        self.loader.reset_mock()
+        cache.clear()
+        resp = self._get(etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+        self.loader.assert_not_called()
+
+    def test_nouvelle_version_nouvel_etag(self):
+        etag = self._get()["ETag"]
+        self.version.return_value = "v2"
+        cache.clear()
+        resp = self._get(etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+
+    def test_etag_depend_des_parametres(self):
+        from .api import _etag
+        rf = RequestFactory()
+        a = _etag(rf.get("/api/v1/courbe_conso", {"debut": "2024-01-01", "fin": "2024-01-31"}))
+        b = _etag(rf.get("/api/v1/courbe_conso", {"fin": "2024-01-31", "debut": "2024-01-01"}))
+        c = _etag(rf.get("/api/v1/courbe_conso", {"debut": "2024-01-01", "fin": "2024-02-29"}))
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def test_304_hors_quota_soutenu(self):
+        from .api import BurstRateThrottle, SustainedRateThrottle
+        sustained = next(t for t in api.throttle if isinstance(t, SustainedRateThrottle))
+        with mock.patch.object(BurstRateThrottle, "allow_request", return_value=True), \
+                mock.patch.object(sustained, "num_requests", 1), \
+                mock.patch("consommation.api._request_cost", return_value=1.0):
+            etag = self.client.get(PARC_ENDPOINT, headers=AUTH_HEADER)["ETag"]
+            for _ in range(3):
+                self.assertEqual(self._get(etag).status_code, 304)  # quota = 1, déjà pris
+            resp = self.client.get(PARC_ENDPOINT, headers=AUTH_HEADER)
+        self.assertEqual(resp.status_code, 429)
+
+
+class MetaSnapshotTests(TestCase):
+    """/meta : réponse précalculée par version des données, rafraîchie par data_cache."""
+
+    def setUp(self):
+        import tempfile
+        from . import api as api_module
+        self.api_module = api_module
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        path = f"{self._tmp.name}/data.parquet"
+        pd.DataFrame({"date_heure": pd.date_range("2024-01-01", periods=10, freq="D")}).to_parquet(path)
+        for target, value in (("get_local_path", path), ("get_updated_at", 1_700_000_000.0)):
+            patch = mock.patch.object(data_cache, target, return_value=value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        version = mock.patch.object(data_cache, "data_version", return_value="v1")
+        self.version = version.start()
+        self.addCleanup(version.stop)
+        patch = mock.patch.object(api_module, "_meta_snapshot", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _meta(self):
+        cache.clear()
+        return self.client.get("/meta", headers=AUTH_HEADER)
+
+    def test_comptages_et_mise_a_jour(self):
+        body = self._meta().json()
+        self.assertEqual(body["consommation"]["min"], "2024-01-01")
+        self.assertEqual(body["consommation"]["lignes"], 10)
+        self.assertIsNotNone(body["echanges"]["mis_a_jour"])
+        self.assertIn("total", body["pays"])
+
+    def test_calcule_une_fois_par_version(self):
+        with mock.patch.object(self.api_module, "_build_meta", wraps=self.api_module._build_meta) as build:
+            self._meta()
+            self._meta()
+            self.assertEqual(build.call_count, 1)
+            self.version.return_value = "v2"
+            self._meta()
+            self.assertEqual(build.call_count, 2)
+
+    def test_listener_precalcule_apres_rafraichissement(self):
+        with override_settings(S3_PATHS={}):
+            data_cache.refresh_all()
+        self.assertEqual(self.api_module._meta_snapshot[0], "v1")
+
+
+class CostThrottleTests(TestCase):
+    """Quota soutenu pondéré : le coût d'un appel suit la plage, le pas et le volume."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = TestClient(api)
+        _make_key(VALID_KEY, "alice")
+        for target, value in (("get_parc_installe_data", FAKE_PARC),
+                              ("get_puissance_data", pd.DataFrame(
+                                  {"date_heure": pd.to_datetime(["2024-01-01"]),
+                                   "consommation": [1.0], "source": ["x"]}))):
+            patch = mock.patch(f"consommation.services.{target}", return_value=value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        burst = mock.patch("consommation.api.BurstRateThrottle.allow_request", return_value=True)
+        burst.start()
+        self.addCleanup(burst.stop)
+
+    def _cost(self, path, **params):
+        from .api import _request_cost
+        return _request_cost(RequestFactory().get(f"/api/v1/{path}", params))
+
+    def test_estimation_des_couts(self):
+        annee = {"debut": "2024-01-01", "fin": "2024-12-31"}
+        brute = self._cost("courbe_conso", **annee)
+        self.assertGreater(brute, 3)
+        self.assertEqual(self._cost("energie_conso", **annee), 0.2)
+        self.assertEqual(self._cost("parc"), 0.2)
+        journaliere = self._cost("courbe_conso", debut="2015-01-01", fin="2024-12-31", pas="1j")
+        self.assertLess(journaliere, brute / 4)
+        self.assertLess(self._cost("courbe_conso", limite="1000", **annee), brute / 10)
+        self.assertAlmostEqual(
+            self._cost("series", series="consommation,echange:total", **annee), 2 * brute
+        )
+
+    def test_appels_legers_plus_nombreux(self):
+        statuses = [self.client.get(PARC_ENDPOINT, headers=AUTH_HEADER).status_code
+                    for _ in range(10)]
+        self.assertEqual(statuses, [200] * 10)  # 10 × 0,2 unité < 5 unités
+
+    def test_appel_lourd_rationne(self):
+        # Client Django : chemin et paramètres séparés comme en production.
+        client, url = Client(), "/api/v1/courbe_conso?debut=2024-01-01&fin=2024-12-31"
+        self.assertEqual(client.get(url, HTTP_AUTHORIZATION=f"Bearer {VALID_KEY}").status_code, 200)
+        resp = client.get(url, HTTP_AUTHORIZATION=f"Bearer {VALID_KEY}")
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp["Retry-After"]), 20)  # ~2 unités à regagner à 5/min
+        # Un appel léger passe encore sur le reliquat.
+        self.assertEqual(self.client.get(PARC_ENDPOINT, headers=AUTH_HEADER).status_code, 200)
+
+
+class AsyncApiTests(TestCase):
+    """Endpoints asynchrones : DuckDB délégué au pool borné, contexte propagé,
+    streaming non bufferisé sous ASGI."""
+
+    def setUp(self):
+        cache.clear()
+        _make_key(VALID_KEY, "alice")
+
+    def test_travail_delegue_hors_boucle_avec_le_contexte(self):
+        import threading
+        from . import offload
+
+        def work():
+            return threading.current_thread().name, deadlines.remaining()
+
+        async def call():
+            with deadlines.deadline(30):
+                return await offload.run(work)
+
+        thread, left = async_to_sync(call)()
+        self.assertTrue(thread.startswith("api-offload"))
+        self.assertIsNotNone(left)
+
+    def test_iterateur_ferme_dans_son_contexte(self):
+        from . import offload
+        closed = []
+
+        def chunks():
+            with admission.priority(admission.BULK):
+                try:
+                    for i in range(10):
+                        yield admission._priority.get(), i
+                finally:
+                    closed.append(True)
+
+        async def first_two():
+            items = []
+            async for item in offload.iterate(chunks()):
+                items.append(item)
+                if len(items) == 2:
+                    break
+            return items
+
+        self.assertEqual(async_to_sync(first_two)(), [(admission.BULK, 0), (admission.BULK, 1)])
+        self.assertEqual(closed, [True])
+
+    def test_ndjson_streame_en_asynchrone_sous_asgi(self):
+        from django.test import AsyncClient
+        df = pd.DataFrame({"date_heure": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+                           "consommation": [1.0, 2.0], "source": ["x", "x"]})
+        with mock.patch("consommation.services.stream_courbe", return_value=iter([df])):
+            resp = async_to_sync(AsyncClient().get)(
+                "/api/v1/courbe_conso?debut=2024-01-01&fin=2024-01-02&format=ndjson",
+                headers=AUTH_HEADER,
+            )
+
+            async def body():
+                return b"".join([chunk async for chunk in resp.streaming_content])
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.is_async)
+            self.assertEqual(len(async_to_sync(body)().splitlines()), 2)
+
+    @override_settings(DUCKDB_QUERY_TIMEOUT=25)
+    def test_middleware_asynchrone_pose_l_echeance(self):
+        async def view(request):
+            return HttpResponse(str(deadlines.remaining()))
+
+        middleware = deadlines.DeadlineMiddleware(view)
+        left = async_to_sync(middleware)(RequestFactory().get("/")).content
+        self.assertGreater(float(left), 20)
+
+
+class AsgiStackTests(TestCase):
+    """Mode ASGI : chaîne de middlewares sans adaptation sync (aucun thread
+    par requête) et statiques servis devant Django (static_asgi.py)."""
+
+    @staticmethod
+    def _middleware(asgi_mode):
+        import runpy
+        path = os.path.join(django_settings.BASE_DIR, "config", "settings.py")
+        with mock.patch.dict(os.environ, {"ASGI_MODE": asgi_mode}):
+            return runpy.run_path(path)["MIDDLEWARE"]
+
+    def _adaptations(self, middleware):
+        from django.core.handlers.asgi import ASGIHandler
+        with override_settings(MIDDLEWARE=middleware, DEBUG=True), \
+             self.assertLogs("django.request", level="DEBUG") as logs:
+            ASGIHandler()
+            logging.getLogger("django.request").debug("fin")
+        return [line for line in logs.output if "adapted" in line]
+
+    def test_chaine_entierement_asynchrone(self):
+        self.assertEqual(self._adaptations(self._middleware("1")), [])
+        # Témoin : avec WhiteNoiseMiddleware, Django adapte la chaîne en sync.
+        self.assertNotEqual(self._adaptations(self._middleware("0")), [])
+
+    def _call(self, app, path, headers=()):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "root_path": "",
+                 "headers": list(headers), "query_string": b""}
+        async_to_sync(app)(scope, receive, send)
+        return sent
+
+    def test_statiques_servis_devant_django(self):
+        from .static_asgi import StaticFilesApp
+        forwarded = []
+
+        async def django_app(scope, receive, send):
+            forwarded.append(scope["path"])
+
+        with tempfile.TemporaryDirectory() as root, \
+             override_settings(STATIC_ROOT=root, STATIC_URL="/static/", FORCE_SCRIPT_NAME=None):
+            with open(os.path.join(root, "app.css"), "wb") as f:
+                f.write(b"body{}" * 20_000)  # plusieurs blocs
+            app = StaticFilesApp(django_app)
+            sent = self._call(app, "/static/app.css")
+            etag = dict(sent[0]["headers"])[b"etag"]
+            not_modified = self._call(app, "/static/app.css", [(b"if-none-match", etag)])
+            self._call(app, "/api/v1/courbe_conso")
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(dict(sent[0]["headers"])[b"content-type"], b"text/css; charset=\"utf-8\"")
+        self.assertEqual(b"".join(m["body"] for m in sent[1:]), b"body{}" * 20_000)
+        self.assertFalse(sent[-1]["more_body"])
+        self.assertEqual(not_modified[0]["status"], 304)
+        self.assertEqual(forwarded, ["/api/v1/courbe_conso"])
+
+
+_metrics_dir = None
+
+
+def setUpModule():
+    # Tout test qui touche un compteur peut déclencher un flush des
+    # métriques : jamais dans le METRICS_DIR par défaut.
+    global _metrics_dir
+    _metrics_dir = tempfile.TemporaryDirectory()
+    _metrics_dir.override = override_settings(METRICS_DIR=_metrics_dir.name)
+    _metrics_dir.override.enable()
+
+
+def tearDownModule():
+    # Les appels API des tests laissent des last_used_at en attente : sans
+    # ce ménage, le flush atexit viserait la base par défaut, non migrée.
+    api_auth._pending_last_used.clear()
+    with metrics._lock:
+        if metrics._flush_timer is not None:
+            metrics._flush_timer.cancel()
+            metrics._flush_timer = None
+    atexit.unregister(metrics.flush)
+    _metrics_dir.override.disable()
+    _metrics_dir.cleanup()
@@ -4,6 +4,7 @@ from . import auth_views
 from . import chat_views
 from . import api_key_views
 from . import account_views
+from . import metrics_views
 
 app_name = 'consommation'
 
@@ -17,6 +18,7 @@ urlpatterns = [
     # Chatbot
     path('chat/', chat_views.chat_page, name='chat'),
     path('chat/message/', chat_views.chat_message, name='chat_message'),
+    path('chat/stream/', chat_views.chat_stream, name='chat_stream'),
 
     # App routes
     path('', views.accueil, name='accueil'),
@@ -35,4 +37,7 @@ urlpatterns = [
     path('api/', views.api, name='api'),
     path('api/keys/generate/', api_key_views.generate_api_key, name='generate_api_key'),
     path('api/keys/<int:key_id>/revoke/', api_key_views.revoke_api_key, name='revoke_api_key'),
+
+    # Supervision (scrape Prometheus)
+    path('metrics', metrics_views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
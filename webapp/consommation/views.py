@@ -1,7 +1,9 @@
 from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from datetime import date, datetime, timedelta
 import hashlib
 import json
@@ -12,7 +14,10 @@ import pandas as pd
 import csv
 from functools import wraps
 
+from . import admission
 from . import data_cache
+from . import deadlines
+from . import metrics
 
 from .services import (
     get_date_range, get_puissance_data, get_annual_data, get_monthly_data,
@@ -811,6 +816,12 @@ def _accueil_cache_key():
 
 CHARTS_CACHE_TTL = 3600
 
+CACHE_REQUESTS = metrics.Counter(
+    'elecstat_cache_requests_total',
+    'Lookups des caches de vues (charts:, accueil_ctx:) par résultat.',
+    ['cache', 'result'],
+)
+
 
 def _cached_charts_response(view_name, parquet_keys, params, builder):
     """
@@ -828,11 +839,92 @@ def _cached_charts_response(view_name, parquet_keys, params, builder):
 
     charts = cache.get(key)
     if charts is None:
+        CACHE_REQUESTS.inc(cache='charts', result='miss')
         charts = builder()
         cache.set(key, charts, CHARTS_CACHE_TTL)
+    else:
+        CACHE_REQUESTS.inc(cache='charts', result='hit')
     return JsonResponse({'charts': charts})
 
 
+PAGE_CACHE_TTL = 3600
+
+
+def _is_anonymous_cacheable(request):
+    """
+    Requête servie à l'identique à tout visiteur anonyme : GET sans paramètre,
+    hors XHR, session vide (ni connexion OIDC, ni filtres mémorisés) et pas de
+    message flash en attente.
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.GET
+        and request.headers.get('X-Requested-With') != 'XMLHttpRequest'
+        and not request.session.keys()
+        and 'messages' not in request.COOKIES
+    )
+
+
+def anonymous_page_cache(parquet_keys):
+    """
+    Cache de page complète (HTML rendu) pour les visiteurs anonymes.
+
+    Pour un anonyme, l'accueil et les squelettes des pages graphiques ne
+    dépendent que des données : la clé porte sur le chemin + les ETags des
+    Parquet sources + la date du jour (« photo du jour » de l'accueil). La
+    réponse est marquée `Cache-Control: public` pour que le proxy frontal ou
+    un CDN absorbe les pics ; `Vary: Cookie` garde les visiteurs connectés
+    (cookie de session) sur le chemin dynamique, qui n'est jamais mis en cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            max_age = settings.PAGE_CACHE_MAX_AGE
+            if not max_age or not _is_anonymous_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            raw = request.path + '|' + timezone.localdate().isoformat() + '|' + '|'.join(
+                data_cache.get_etag(k) for k in parquet_keys
+            )
+            key = 'page:' + hashlib.md5(raw.encode()).hexdigest()
+            cached = cache.get(key)
+            if cached is not None:
+                CACHE_REQUESTS.inc(cache='page', result='hit')
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                CACHE_REQUESTS.inc(cache='page', result='miss')
+                response = view(request, *args, **kwargs)
+                # Ne cacher qu'une page saine et réellement anonyme : la vue
+                # n'a rien écrit en session ni posé de cookie. Les cookies CSRF
+                # et de session ne sont posés qu'ensuite, par les middlewares :
+                # on regarde donc si la vue les a demandés (get_token, session
+                # modifiée) — sinon la page, servie en public, ne délivrerait
+                # jamais de csrftoken. Une vue refuse aussi le cache en posant
+                # son propre Cache-Control (accueil en mode dégradé).
+                if (response.status_code != 200 or response.cookies
+                        or response.has_header('Cache-Control')
+                        or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+                        or request.session.modified
+                        or request.session.keys() or response.streaming):
+                    return response
+                cache.set(key, (response.content, response['Content-Type']), PAGE_CACHE_TTL)
+
+            patch_cache_control(response, public=True, max_age=max_age)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+# Délestage (worker saturé, échéance dépassée, client parti) : jamais absorbé
+# par les replis « section indisponible » de l'accueil, sinon le contexte
+# partiel serait mis en cache et servi à tous. DeadlineMiddleware en fait
+# une 503/504, ni cachée ni publique.
+_LOAD_SHEDDING = (admission.Overloaded, deadlines.QueryTimeout, deadlines.ClientDisconnected)
+
+
+@anonymous_page_cache(_ACCUEIL_PARQUET_KEYS)
 def accueil(request):
     """
     Home page - welcome page with latest day dashboard data.
@@ -844,7 +936,9 @@ def accueil(request):
     cache_key = _accueil_cache_key()
     context = cache.get(cache_key)
     if context is not None:
+        CACHE_REQUESTS.inc(cache='accueil_ctx', result='hit')
         return render(request, 'consommation/accueil.html', context)
+    CACHE_REQUESTS.inc(cache='accueil_ctx', result='miss')
 
     context = {}
     try:
@@ -873,6 +967,8 @@ def accueil(request):
                 )
                 if net_by_border:
                     echanges_flux_svg = create_echanges_flow_svg(net_by_border, year=_year)
+            except _LOAD_SHEDDING:
+                raise
             except Exception:
                 echanges_flux_svg = None
 
@@ -910,6 +1006,8 @@ def accueil(request):
                             'parc_solaire_delta': _fmt_pct(now_row['solaire'], prev_row['solaire']),
                             'parc_solaire_gw': f"{now_row['solaire'] / 1000:.1f}".replace('.', ','),
                         }
+            except _LOAD_SHEDDING:
+                raise
             except Exception:
                 pass
 
@@ -928,6 +1026,8 @@ def accueil(request):
                         'solde_echanges_twh': f"{abs(solde_mwh) / 1_000_000:.1f}".replace('.', ','),
                         'solde_exportateur': solde_mwh < 0,
                     }
+            except _LOAD_SHEDDING:
+                raise
             except Exception:
                 pass
 
@@ -949,6 +1049,8 @@ def accueil(request):
                 'graph_production_jour': graph_production_jour,
                 'echanges_flux_svg': echanges_flux_svg,
             }
+    except _LOAD_SHEDDING:
+        raise
     except Exception:
         pass
 
@@ -956,11 +1058,15 @@ def accueil(request):
     # le calcul à la requête suivante plutôt que de figer une page en panne.
     if context:
         cache.set(cache_key, context, ACCUEIL_CACHE_TTL)
+        return render(request, 'consommation/accueil.html', context)
 
-    return render(request, 'consommation/accueil.html', context)
+    response = render(request, 'consommation/accueil.html', context)
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
 # ========== Views ==========
+@anonymous_page_cache(('puissance',))
 @handle_validation_errors
 def index(request):
     """
@@ -1030,6 +1136,7 @@ def index(request):
     return render(request, 'consommation/index.html', context)
 
 
+@anonymous_page_cache(('production',))
 @handle_validation_errors
 def production(request):
     """
@@ -1129,6 +1236,7 @@ def production(request):
     return render(request, 'consommation/production.html', context)
 
 
+@anonymous_page_cache(('echanges',))
 @handle_validation_errors
 def echanges(request):
     """
@@ -1274,6 +1382,7 @@ def _export_to_csv(df, filename, columns):
     return response
 
 
+@admission.priority(admission.BULK)
 @handle_validation_errors
 def export_puissance_csv(request):
     """
@@ -1293,6 +1402,7 @@ def export_puissance_csv(request):
     return _export_to_csv(df, filename, ['date_heure', 'consommation'])
 
 
+@admission.priority(admission.BULK)
 def export_annuel_csv(request):
     """
     Export annual consumption data to CSV
@@ -1306,6 +1416,7 @@ def export_annuel_csv(request):
     return _export_to_csv(df, 'consommation_annuelle.csv', ['year', 'yearly_consumption'])
 
 
+@admission.priority(admission.BULK)
 def export_mensuel_csv(request):
     """
     Export monthly consumption data to CSV
@@ -1321,6 +1432,7 @@ def export_mensuel_csv(request):
     return _export_to_csv(df, 'consommation_mensuelle.csv', ['year', 'month', 'monthly_consumption'])
 
 
+@admission.priority(admission.BULK)
 @handle_validation_errors
 def export_production_csv(request):
     """
@@ -1348,6 +1460,7 @@ def export_production_csv(request):
     return _export_to_csv(df, filename, ['date_heure'] + filieres_selected)
 
 
+@admission.priority(admission.BULK)
 def export_production_annuel_csv(request):
     """
     Export annual production data by sector to CSV
@@ -1363,6 +1476,7 @@ def export_production_annuel_csv(request):
     return _export_to_csv(df, 'production_annuelle.csv', columns)
 
 
+@admission.priority(admission.BULK)
 def export_production_mensuel_csv(request):
     """
     Export monthly production data by sector to CSV
@@ -1378,6 +1492,7 @@ def export_production_mensuel_csv(request):
     return _export_to_csv(df, 'production_mensuelle.csv', columns)
 
 
+@admission.priority(admission.BULK)
 def export_parc_installe_csv(request):
     """
     Export installed wind/solar capacity data to CSV
@@ -1402,6 +1517,7 @@ def export_parc_installe_csv(request):
     return _export_to_csv(wide, 'parc_installe_eolien_solaire.csv', columns)
 
 
+@admission.priority(admission.BULK)
 @handle_validation_errors
 def export_echanges_csv(request):
     """
@@ -1434,6 +1550,7 @@ def export_echanges_csv(request):
     return _export_to_csv(df, filename, ['date_heure', *pays_selected])
 
 
+@admission.priority(admission.BULK)
 @handle_validation_errors
 def export_echanges_annuel_csv(request):
     """
@@ -1461,14 +1578,14 @@ def export_echanges_annuel_csv(request):
 
 
 # ========== API ==========
-def _humanize_rate(rate):
+def _humanize_rate(rate, noun=('requête', 'requêtes')):
     """Transforme un taux de throttle ("1/2s", "10/min") en texte FR lisible."""
     units = [('sec', 'seconde'), ('min', 'minute'), ('hour', 'heure'),
              ('day', 'jour'), ('s', 'seconde'), ('m', 'minute'),
              ('h', 'heure'), ('d', 'jour')]
     count, rest = rate.split('/', 1)
     count = int(count)
-    req = 'requête' if count == 1 else 'requêtes'
+    req = noun[0] if count == 1 else noun[1]
     for unit, label in units:
         if rest.endswith(unit):
             mult = int(rest[:-len(unit)]) if rest[:-len(unit)] else 1
@@ -1482,15 +1599,20 @@ def api(request):
     # Page portail : doc réservée aux utilisateurs connectés (le template
     # affiche sinon une invitation à se connecter/s'inscrire). Les endpoints
     # JSON sous /api/v1/ sont, eux, publics en phase 1.
-    from .api import THROTTLE_BURST, THROTTLE_SUSTAINED
+    from .api import (MAX_RANGE_DAYS_STREAM, MIN_COST, PAGE_SIZE, ROWS_PER_UNIT,
+                      THROTTLE_BURST, THROTTLE_SUSTAINED)
     from .api_key_views import MAX_ACTIVE_KEYS
 
     api_base = request.build_absolute_uri('/api/v1/').rstrip('/')
     context = {
         'api_base': api_base,
         'throttle_burst': _humanize_rate(THROTTLE_BURST),
-        'throttle_sustained': _humanize_rate(THROTTLE_SUSTAINED),
+        'throttle_sustained': _humanize_rate(THROTTLE_SUSTAINED, ('unité', 'unités')),
+        'rows_per_unit': ROWS_PER_UNIT,
+        'min_cost': MIN_COST,
         'max_active_keys': MAX_ACTIVE_KEYS,
+        'max_range_days_stream': MAX_RANGE_DAYS_STREAM,
+        'page_size': PAGE_SIZE,
     }
 
     # Gestion des clés d'API de l'utilisateur connecté (génération/révocation